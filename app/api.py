@@ -7,6 +7,7 @@ from anthropic import Anthropic
 from datetime import datetime
 from models import db, Textbook, Part, Chapter, Topic, Deck, Card, StudySession, CardReview
 from supermemo2 import update_card_review
+from app_auth0.study.session_stats import summarize_session, session_totals
 
 api = Blueprint('api', __name__)
 
@@ -573,21 +574,15 @@ def end_study_session(session_id):
         session.ended_at = datetime.utcnow()
         db.session.commit()
         
-        # Calculate statistics
+        # Databases built with db.create_all() have no trigger keeping running totals
         reviews = CardReview.query.filter_by(session_id=session_id).all()
-        total_cards = len(reviews)
-        total_time = sum(r.time_taken for r in reviews if r.time_taken)
-        avg_quality = sum(r.quality for r in reviews) / total_cards if total_cards else 0
+        statistics = summarize_session(session_totals([(r.quality, r.time_taken) for r in reviews]))
         
         return jsonify({
             'sessionId': str(session.id),
             'startedAt': session.started_at.isoformat(),
             'endedAt': session.ended_at.isoformat(),
-            'statistics': {
-                'totalCards': total_cards,
-                'totalTimeMs': total_time,
-                'averageQuality': avg_quality
-            }
+            'statistics': statistics
         })
         
     except Exception as e:
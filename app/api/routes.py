@@ -255,23 +255,9 @@ def create_live_deck():
             name=name,
             description=description
         )
+        Deck.query.get_or_404(deck_id)
+        # Card states are written lazily, on each card's first review or toggle
         db.session.add(live_deck)
-        db.session.flush()
-        
-        # Initialize card states
-        deck = Deck.query.get_or_404(deck_id)
-        for part in deck.parts:
-            for chapter in part.chapters:
-                for topic in chapter.topics:
-                    for card in topic.cards:
-                        card_state = UserCardState(
-                            user_id=request.user.id,
-                            live_deck_id=live_deck.id,
-                            card_id=card.id,
-                            is_active=True
-                        )
-                        db.session.add(card_state)
-        
         db.session.commit()
         return jsonify(live_deck.to_dict())
         
@@ -288,18 +274,21 @@ def get_live_deck_cards(live_deck_id):
         if live_deck.user_id != request.user.id:
             return jsonify({"error": "Unauthorized"}), 403
             
+        # Every card of the deck, with the user's state where they have one
+        rows = db.session.query(Card, UserCardState).join(Topic).join(Chapter).join(Part).filter(
+            Part.deck_id == live_deck.deck_id
+        ).outerjoin(
+            UserCardState,
+            (UserCardState.card_id == Card.id) & (UserCardState.live_deck_id == live_deck.id)
+        ).order_by(Part.order_index, Chapter.order_index, Topic.order_index, Card.created_at).all()
+
         cards = []
-        for card_state in live_deck.card_states:
-            card = card_state.card
+        for card, card_state in rows:
             cards.append({
                 'id': str(card.id),
                 'front': card.front,
                 'back': card.back,
-                'is_active': card_state.is_active,
-                'next_review': card_state.next_review.isoformat() if card_state.next_review else None,
-                'interval': card_state.interval,
-                'easiness': card_state.easiness,
-                'repetitions': card_state.repetitions,
+                **UserCardState.state_dict(card_state),
                 'card_type': card.card_type,
                 'media_urls': card.media_urls,
                 'tags': card.tags,
@@ -317,12 +306,14 @@ def get_live_deck_cards(live_deck_id):
 def toggle_card_state(live_deck_id, card_id):
     """Toggle a card's active state in a live deck"""
     try:
-        card_state = UserCardState.query.filter_by(
-            live_deck_id=live_deck_id,
-            card_id=card_id,
-            user_id=request.user.id
+        live_deck = LiveDeck.query.get_or_404(live_deck_id)
+        if live_deck.user_id != request.user.id:
+            return jsonify({"error": "Unauthorized"}), 403
+        Card.query.join(Topic).join(Chapter).join(Part).filter(
+            Card.id == card_id, Part.deck_id == live_deck.deck_id
         ).first_or_404()
-        
+
+        card_state = UserCardState.get_or_create(request.user.id, live_deck.id, card_id)
         card_state.is_active = not card_state.is_active
         db.session.commit()
         
@@ -688,17 +679,8 @@ def add_card_to_topic(topic_id):
             difficulty=difficulty,
             notes=notes
         )
+        # The card's state for the live deck is written on its first review or toggle
         db.session.add(card)
-        db.session.flush()
-        
-        # Create card state for the live deck
-        card_state = UserCardState(
-            user_id=request.user.id,
-            live_deck_id=live_deck.id,
-            card_id=card.id,
-            is_active=True
-        )
-        db.session.add(card_state)
         db.session.commit()
         
         return jsonify({
@@ -710,7 +692,7 @@ def add_card_to_topic(topic_id):
             'tags': card.tags,
             'difficulty': card.difficulty,
             'notes': card.notes,
-            'is_active': card_state.is_active
+            'is_active': UserCardState.DEFAULTS['is_active']
         })
         
     except Exception as e:
@@ -726,6 +708,9 @@ def get_live_deck_structure(live_deck_id):
         if live_deck.user_id != request.user.id:
             return jsonify({"error": "Unauthorized"}), 403
             
+        # One query for the states; cards without one get the defaults
+        states = {card_state.card_id: card_state for card_state in live_deck.card_states}
+
         structure = []
         for part in live_deck.deck.parts:
             part_data = {
@@ -755,28 +740,17 @@ def get_live_deck_structure(live_deck_id):
                     }
                     
                     for card in topic.cards:
-                        card_state = UserCardState.query.filter_by(
-                            live_deck_id=live_deck_id,
-                            card_id=card.id,
-                            user_id=request.user.id
-                        ).first()
-                        
-                        if card_state:
-                            topic_data['cards'].append({
-                                'id': str(card.id),
-                                'front': card.front,
-                                'back': card.back,
-                                'card_type': card.card_type,
-                                'media_urls': card.media_urls,
-                                'tags': card.tags,
-                                'difficulty': card.difficulty,
-                                'notes': card.notes,
-                                'is_active': card_state.is_active,
-                                'next_review': card_state.next_review.isoformat() if card_state.next_review else None,
-                                'interval': card_state.interval,
-                                'easiness': card_state.easiness,
-                                'repetitions': card_state.repetitions
-                            })
+                        topic_data['cards'].append({
+                            'id': str(card.id),
+                            'front': card.front,
+                            'back': card.back,
+                            'card_type': card.card_type,
+                            'media_urls': card.media_urls,
+                            'tags': card.tags,
+                            'difficulty': card.difficulty,
+                            'notes': card.notes,
+                            **UserCardState.state_dict(states.get(card.id))
+                        })
                     
                     chapter_data['topics'].append(topic_data)
                 
@@ -214,6 +214,32 @@ class UserCardState(db.Model):
     live_deck = db.relationship('LiveDeck', back_populates='card_states')
     card = db.relationship('Card', back_populates='user_states')
 
+    # Live decks don't get a state row per card up front. A card without one
+    # is new and active, and its row is written on the first review or toggle.
+    DEFAULTS = {'is_active': True, 'easiness': 2.5, 'interval': 1, 'repetitions': 0}
+
+    @classmethod
+    def get_or_create(cls, user_id, live_deck_id, card_id):
+        """The card's state row, added to the session with the defaults if it has none yet"""
+        state = cls.query.filter_by(user_id=user_id, live_deck_id=live_deck_id, card_id=card_id).first()
+        if state is None:
+            state = cls(user_id=user_id, live_deck_id=live_deck_id, card_id=card_id, **cls.DEFAULTS)
+            db.session.add(state)
+        return state
+
+    @classmethod
+    def state_dict(cls, state):
+        """Scheduling fields of a state row, or the defaults when state is None"""
+        if state is None:
+            return dict(cls.DEFAULTS, next_review=None)
+        return {
+            'is_active': state.is_active,
+            'next_review': state.next_review.isoformat() if state.next_review else None,
+            'interval': state.interval,
+            'easiness': state.easiness,
+            'repetitions': state.repetitions
+        }
+
 class StudySession(db.Model):
     __tablename__ = 'study_sessions'
     
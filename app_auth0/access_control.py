@@ -4,10 +4,13 @@ from supabase import create_client
 import os
 from dotenv import load_dotenv
 import logging
+import uuid
 from enum import Enum
 from datetime import datetime
 from typing import Optional, Dict, List
 from subscription_management import SubscriptionManager, SubscriptionTier, TIER_FEATURES
+from ttl_cache import TTLCache
+from identity import user_id_for
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -61,63 +64,80 @@ class Role(Enum):
 # Initialize subscription manager
 subscription_manager = SubscriptionManager()
 
+# Deck nodes and the table holding them; each row carries its deck_id
+RESOURCE_TABLES = {
+    ResourceType.DECK: 'decks',
+    ResourceType.PART: 'parts',
+    ResourceType.CHAPTER: 'chapters',
+    ResourceType.TOPIC: 'topics',
+    ResourceType.CARD: 'cards'
+}
+
+# How long a (user, deck) role and a node's deck are trusted without a query.
+# Role changes made through assign_role/remove_role are applied immediately.
+# Nothing invalidates a node's deck, so a node moved to another deck or
+# deleted is only seen once RESOURCE_DECK_CACHE_TTL_SECONDS have passed,
+# by default the same bound as a role. Unknown nodes are never cached.
+DECK_ROLE_CACHE_TTL_SECONDS = int(os.getenv('DECK_ROLE_CACHE_TTL_SECONDS', '60'))
+RESOURCE_DECK_CACHE_TTL_SECONDS = int(os.getenv('RESOURCE_DECK_CACHE_TTL_SECONDS', str(DECK_ROLE_CACHE_TTL_SECONDS)))
+
+_deck_roles = TTLCache(DECK_ROLE_CACHE_TTL_SECONDS, max_entries=50000)
+_resource_decks = TTLCache(RESOURCE_DECK_CACHE_TTL_SECONDS, max_entries=100000)
+_UNKNOWN = object()
+
+def _resolve_deck_role(user_id: str, resource_type: ResourceType, resource_id: str):
+    """Return (deck_id, role) for any deck node with a single RPC, or (None, None)"""
+    result = supabase.rpc('resolve_deck_role', {
+        'p_auth0_id': user_id,
+        'p_resource_table': RESOURCE_TABLES[resource_type],
+        'p_resource_id': resource_id
+    }).execute()
+    if not result.data:
+        return None, None
+
+    row = result.data[0]
+    role = Role(row['role']) if row['role'] else None
+    # Both parts of the answer are cached, so the next check on this
+    # node, or on any other node of the deck, needs no query at all
+    if resource_type != ResourceType.DECK:
+        _resource_decks.set((resource_type, resource_id), row['deck_id'])
+    _deck_roles.set((user_id, row['deck_id']), role)
+    return row['deck_id'], role
+
 def get_user_role(user_id: str, resource_type: ResourceType, resource_id: str) -> Optional[Role]:
     """Get user's role for a specific resource"""
     try:
-        logger.info(f"Getting role for user {user_id} on {resource_type.value} {resource_id}")
-        
-        # First get the user's UUID from our database
-        user_result = supabase.table('users').select('id').eq('auth0_id', user_id).execute()
-        if not user_result.data:
-            logger.error(f"User with Auth0 ID {user_id} not found in database")
-            return None
-            
-        db_user_id = user_result.data[0]['id']
-        logger.info(f"Found database user ID {db_user_id} for Auth0 user {user_id}")
-        
-        if resource_type == ResourceType.DECK:
-            # Check if user owns the deck
-            deck_result = supabase.table('decks').select('*').eq('id', resource_id).execute()
-            if not deck_result.data:
-                logger.error(f"Deck {resource_id} not found")
+        if resource_type == ResourceType.LIVE_DECK:
+            # Live decks are only ever accessible to their owner
+            db_user_id = user_id_for(user_id, supabase)
+            if not db_user_id:
+                logger.error(f"User with Auth0 ID {user_id} not found in database")
                 return None
-                
-            deck = deck_result.data[0]
-            if deck['user_id'] == db_user_id:
-                logger.info(f"User {db_user_id} is owner of deck {resource_id}")
-                return Role.OWNER
-            
-            # Check collaboration role
-            collab_result = supabase.table('deck_collaborations').select('*').eq(
-                'deck_id', resource_id
-            ).eq('user_id', db_user_id).execute()
-            
-            if collab_result.data:
-                role = Role(collab_result.data[0]['role'])
-                logger.info(f"User {db_user_id} has {role.value} role on deck {resource_id}")
-                return role
-            
-            logger.error(f"User {db_user_id} has no access to deck {resource_id}")
-            return None
-            
-        elif resource_type == ResourceType.LIVE_DECK:
-            # Check if user owns the live deck
-            live_deck_result = supabase.table('live_decks').select('*').eq('id', resource_id).execute()
+            live_deck_result = supabase.table('live_decks').select('user_id').eq('id', resource_id).execute()
             if live_deck_result.data and live_deck_result.data[0]['user_id'] == db_user_id:
                 return Role.OWNER
-            
             return None
-            
-        elif resource_type in [ResourceType.PART, ResourceType.CHAPTER, ResourceType.TOPIC, ResourceType.CARD]:
-            # Get the parent deck ID
-            deck_id = get_parent_deck_id(resource_type, resource_id)
-            if deck_id:
-                return get_user_role(user_id, ResourceType.DECK, deck_id)
-            
+
+        if resource_type not in RESOURCE_TABLES:
             return None
-            
-        return None
-        
+
+        if resource_type == ResourceType.DECK:
+            deck_id = resource_id
+        else:
+            deck_id = _resource_decks.get((resource_type, resource_id))
+
+        if deck_id:
+            role = _deck_roles.get((user_id, deck_id), _UNKNOWN)
+            if role is not _UNKNOWN:
+                return role
+
+        deck_id, role = _resolve_deck_role(user_id, resource_type, resource_id)
+        if not deck_id:
+            logger.error(f"User {user_id} or {resource_type.value} {resource_id} not found")
+        elif not role:
+            logger.info(f"User {user_id} has no access to deck {deck_id}")
+        return role
+
     except Exception as e:
         logger.error(f"Error getting user role: {e}")
         logger.error("Exception details:", exc_info=True)
@@ -126,47 +146,31 @@ def get_user_role(user_id: str, resource_type: ResourceType, resource_id: str) -
 def get_parent_deck_id(resource_type: ResourceType, resource_id: str) -> Optional[str]:
     """Get the parent deck ID for a resource"""
     try:
-        if resource_type == ResourceType.PART:
-            result = supabase.table('parts').select('deck_id').eq('id', resource_id).execute()
-        elif resource_type == ResourceType.CHAPTER:
-            result = supabase.table('chapters').select('part_id').eq('id', resource_id).execute()
-            if result.data:
-                part_result = supabase.table('parts').select('deck_id').eq('id', result.data[0]['part_id']).execute()
-                return part_result.data[0]['deck_id'] if part_result.data else None
-        elif resource_type == ResourceType.TOPIC:
-            result = supabase.table('topics').select('chapter_id').eq('id', resource_id).execute()
-            if result.data:
-                chapter_result = supabase.table('chapters').select('part_id').eq('id', result.data[0]['chapter_id']).execute()
-                if chapter_result.data:
-                    part_result = supabase.table('parts').select('deck_id').eq('id', chapter_result.data[0]['part_id']).execute()
-                    return part_result.data[0]['deck_id'] if part_result.data else None
-        elif resource_type == ResourceType.CARD:
-            result = supabase.table('cards').select('topic_id').eq('id', resource_id).execute()
-            if result.data:
-                topic_result = supabase.table('topics').select('chapter_id').eq('id', result.data[0]['topic_id']).execute()
-                if topic_result.data:
-                    chapter_result = supabase.table('chapters').select('part_id').eq('id', topic_result.data[0]['chapter_id']).execute()
-                    if chapter_result.data:
-                        part_result = supabase.table('parts').select('deck_id').eq('id', chapter_result.data[0]['part_id']).execute()
-                        return part_result.data[0]['deck_id'] if part_result.data else None
-        
-        return None
+        if resource_type == ResourceType.DECK:
+            return resource_id
+        if resource_type not in RESOURCE_TABLES:
+            return None
+
+        deck_id = _resource_decks.get((resource_type, resource_id))
+        if deck_id is None:
+            # Every node carries its deck_id, kept up to date by triggers
+            result = supabase.table(RESOURCE_TABLES[resource_type]).select('deck_id').eq('id', resource_id).execute()
+            if not result.data:
+                return None
+            deck_id = result.data[0]['deck_id']
+            _resource_decks.set((resource_type, resource_id), deck_id)
+        return deck_id
     except Exception as e:
         logger.error(f"Error getting parent deck ID: {e}")
         return None
 
+def invalidate_deck_roles(deck_id: str):
+    """Forget cached roles on a deck after its owner or collaborators change"""
+    _deck_roles.invalidate_where(lambda key: key[1] == deck_id)
+
 def has_permission(user_id: str, resource_type: ResourceType, resource_id: str, required_permission: Permission) -> bool:
     """Check if user has the required permission for a resource"""
     try:
-        # First get the user's UUID from our database
-        user_result = supabase.table('users').select('id').eq('auth0_id', user_id).execute()
-        if not user_result.data:
-            logger.error(f"User with Auth0 ID {user_id} not found in database")
-            return False
-            
-        db_user_id = user_result.data[0]['id']
-        logger.info(f"Found database user ID {db_user_id} for Auth0 user {user_id}")
-
         # First check subscription-based permissions
         if required_permission in [
             Permission.CREATE_LIVE_DECK,
@@ -179,6 +183,12 @@ def has_permission(user_id: str, resource_type: ResourceType, resource_id: str,
             Permission.USE_API,
             Permission.USE_PRIORITY_SUPPORT
         ]:
+            # Get the user's UUID from our database
+            db_user_id = user_id_for(user_id, supabase)
+            if not db_user_id:
+                logger.error(f"User with Auth0 ID {user_id} not found in database")
+                return False
+
             feature = required_permission.value.replace('use_', '')
             return subscription_manager.has_feature_access(db_user_id, feature)
 
@@ -339,6 +349,7 @@ def assign_role(user_id: str, resource_type: ResourceType, resource_id: str, rol
                     'updated_at': datetime.utcnow().isoformat()
                 }).execute()
 
+            invalidate_deck_roles(resource_id)
             return True if result.data else False
 
         return False
@@ -355,6 +366,7 @@ def remove_role(user_id: str, resource_type: ResourceType, resource_id: str) ->
                 'deck_id', resource_id
             ).eq('user_id', user_id).execute()
 
+            invalidate_deck_roles(resource_id)
             return True if result.data else False
 
         return False
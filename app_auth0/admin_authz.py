@@ -0,0 +1,94 @@
+"""
+Admin authorization.
+
+The admin tables are small, so they are compiled together into one
+snapshot: a bit per admin permission, a mask per role and, for every user
+with an admin role, the OR of their roles' masks. Admin checks are then
+dictionary lookups and a mask test. The role routes in admin_routes call
+invalidate_admin_authz after changing roles or assignments, and the TTL
+covers changes made directly in the database.
+"""
+import os
+import logging
+import threading
+from collections import namedtuple
+from ttl_cache import TTLCache
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+ADMIN_AUTHZ_TTL_SECONDS = int(os.getenv('ADMIN_AUTHZ_TTL_SECONDS', '300'))
+
+# Always an admin, with or without roles
+SUPER_ADMIN_USER_ID = "845cd193-4692-4e7b-8951-db948424c240"
+
+# permission_bits: name -> bit; user_masks: user_id -> mask, for users with
+# at least one existing role; user_roles: user_id -> role names
+AdminAuthz = namedtuple('AdminAuthz', ['permission_bits', 'user_masks', 'user_roles'])
+
+_snapshot = TTLCache(ADMIN_AUTHZ_TTL_SECONDS, max_entries=1)
+_compile_lock = threading.Lock()
+
+def compile_admin_authz(client):
+    """Build the snapshot from admin_permissions, admin_roles, admin_role_permissions and user_admin_roles"""
+    permissions = client.table('admin_permissions').select('id, name').execute().data or []
+    roles = client.table('admin_roles').select('id, name').execute().data or []
+    grants = client.table('admin_role_permissions').select('role_id, permission_id').execute().data or []
+    assignments = client.table('user_admin_roles').select('user_id, role_id').execute().data or []
+
+    permission_bits = {}
+    bit_of_permission_id = {}
+    for index, permission in enumerate(sorted(permissions, key=lambda row: str(row['id']))):
+        permission_bits[permission['name']] = 1 << index
+        bit_of_permission_id[str(permission['id'])] = 1 << index
+
+    role_names = {str(role['id']): role['name'] for role in roles}
+    role_masks = dict.fromkeys(role_names, 0)
+    for grant in grants:
+        role_id = str(grant['role_id'])
+        if role_id in role_masks:
+            role_masks[role_id] |= bit_of_permission_id.get(str(grant['permission_id']), 0)
+
+    user_masks, user_roles = {}, {}
+    for assignment in assignments:
+        role_id = str(assignment['role_id'])
+        if role_id not in role_masks:
+            continue
+        user_id = str(assignment['user_id'])
+        user_masks[user_id] = user_masks.get(user_id, 0) | role_masks[role_id]
+        user_roles.setdefault(user_id, []).append(role_names[role_id])
+
+    return AdminAuthz(permission_bits, user_masks, user_roles)
+
+def get_admin_authz(client=None):
+    """The current snapshot, compiled on first use and after invalidation or expiry"""
+    snapshot = _snapshot.get('authz')
+    if snapshot is None:
+        with _compile_lock:
+            snapshot = _snapshot.get('authz')
+            if snapshot is None:
+                if client is None:
+                    from supabase_config import supabase as client
+                snapshot = compile_admin_authz(client)
+                _snapshot.set('authz', snapshot)
+                logger.info(f"Compiled admin authorization for {len(snapshot.user_masks)} admins "
+                            f"and {len(snapshot.permission_bits)} permissions")
+    return snapshot
+
+def invalidate_admin_authz():
+    """Recompile on the next check, after roles, grants or assignments changed"""
+    _snapshot.clear()
+
+def is_admin_user(user_id, client=None):
+    """Whether the user is the super admin or has an admin role"""
+    user_id = str(user_id)
+    return user_id == SUPER_ADMIN_USER_ID or user_id in get_admin_authz(client).user_masks
+
+def admin_roles_of(user_id, client=None):
+    """Names of the user's admin roles"""
+    return list(get_admin_authz(client).user_roles.get(str(user_id), []))
+
+def has_admin_permission(user_id, permission, client=None):
+    """Whether one of the user's admin roles grants the permission"""
+    snapshot = get_admin_authz(client)
+    return bool(snapshot.user_masks.get(str(user_id), 0) & snapshot.permission_bits.get(permission, 0))
@@ -2,6 +2,9 @@ from flask import Blueprint, jsonify, request
 from functools import wraps
 from access_control import Role, ResourceType, Permission, get_user_role, assign_role, remove_role
 from supabase_config import supabase
+from identity import user_id_for, invalidate_all_users
+from ttl_cache import TTLCache
+from admin_authz import get_admin_authz, invalidate_admin_authz, is_admin_user, admin_roles_of, has_admin_permission
 import logging
 from datetime import datetime, timedelta
 from admin_models import AdminRole, AdminPermission, AdminRolePermission, UserAdminRole, AdminAuditLog
@@ -9,9 +12,9 @@ import os
 import jwt
 from jwt.algorithms import RSAAlgorithm
 import json
-import requests
 import time
 from functools import lru_cache
+from token_verification import verify_token
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -20,13 +23,11 @@ logger = logging.getLogger(__name__)
 # Create admin blueprint
 admin = Blueprint('admin', __name__)
 
-# Token verification cache
-token_cache = {}
-TOKEN_CACHE_DURATION = timedelta(minutes=5)  # Cache tokens for 5 minutes
-
-# Supabase query cache
-supabase_cache = {}
+# Supabase query cache; admin listings can be large, so it is capped by size as well
 SUPABASE_CACHE_DURATION = timedelta(minutes=1)  # Cache Supabase queries for 1 minute
+SUPABASE_CACHE_MAX_BYTES = int(os.getenv('ADMIN_QUERY_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+supabase_cache = TTLCache(SUPABASE_CACHE_DURATION.total_seconds(), max_entries=1000,
+                          max_bytes=SUPABASE_CACHE_MAX_BYTES)
 
 def get_cached_supabase_query(table, query_params=None, cache_key=None):
     """Get cached Supabase query result or execute new query"""
@@ -36,14 +37,10 @@ def get_cached_supabase_query(table, query_params=None, cache_key=None):
             cache_key = f"{table}_{json.dumps(query_params or {})}"
             
         # Check cache
-        if cache_key in supabase_cache:
-            cache_entry = supabase_cache[cache_key]
-            if datetime.now() - cache_entry['timestamp'] < SUPABASE_CACHE_DURATION:
-                logger.info(f"Using cached Supabase query for {table}")
-                return cache_entry['data']
-            else:
-                logger.info(f"Cache expired for {table}, executing new query")
-                del supabase_cache[cache_key]
+        cached = supabase_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"Using cached Supabase query for {table}")
+            return cached
         
         # Execute query with retry logic
         max_retries = 3
@@ -69,10 +66,7 @@ def get_cached_supabase_query(table, query_params=None, cache_key=None):
                 result = query.execute()
                 
                 # Cache the result
-                supabase_cache[cache_key] = {
-                    'data': result.data,
-                    'timestamp': datetime.now()
-                }
+                supabase_cache.set(cache_key, result.data)
                 
                 return result.data
                 
@@ -90,119 +84,66 @@ def get_cached_supabase_query(table, query_params=None, cache_key=None):
 def is_admin(user_id):
     """Check if a user has admin privileges"""
     try:
-        logger.info(f"Checking admin status for user: {user_id}")
-        
-        # Check for super admin
-        if user_id == "845cd193-4692-4e7b-8951-db948424c240":
-            logger.info("User is super admin")
-            return True
-            
-        # Check user's admin roles
-        result = supabase.table('user_admin_roles').select('role_id').eq('user_id', user_id).execute()
-        if not result.data:
-            logger.info("User has no admin roles")
-            return False
-            
-        # Get the role names
-        role_ids = [role['role_id'] for role in result.data]
-        roles_result = supabase.table('admin_roles').select('name').in_('id', role_ids).execute()
-        
-        if not roles_result.data:
-            logger.info("No admin roles found")
-            return False
-            
-        role_names = [role['name'] for role in roles_result.data]
-        logger.info(f"User has admin roles: {role_names}")
-        return True
+        admin_status = is_admin_user(user_id, supabase)
+        logger.info(f"Admin status for user {user_id}: {admin_status}")
+        return admin_status
         
     except Exception as e:
         logger.error(f"Error checking admin status: {str(e)}")
         return False
 
 def verify_token_with_cache(token):
-    """Verify token with Auth0 and cache the result"""
+    """Verify token locally against Auth0's cached signing keys"""
     try:
-        # Check cache first
-        if token in token_cache:
-            cache_entry = token_cache[token]
-            if datetime.now() - cache_entry['timestamp'] < TOKEN_CACHE_DURATION:
-                logger.info("Using cached token verification")
-                return cache_entry['user_info']
-            else:
-                logger.info("Cache expired, verifying token again")
-                del token_cache[token]
-        
-        # Verify with Auth0
-        auth0_domain = os.getenv('AUTH0_DOMAIN')
-        if not auth0_domain:
-            logger.error("Auth0 domain not configured")
-            return None
-            
-        url = f"https://{auth0_domain}/userinfo"
-        headers = {'Authorization': f'Bearer {token}'}
-        
-        response = requests.get(url, headers=headers)
-        if response.status_code == 429:
-            logger.warning("Auth0 rate limit hit, using cached result if available")
-            if token in token_cache:
-                return token_cache[token]['user_info']
-            return None
-            
-        response.raise_for_status()
-        user_info = response.json()
-        
-        # Cache the result
-        token_cache[token] = {
-            'user_info': user_info,
-            'timestamp': datetime.now()
-        }
-        
-        return user_info
-        
+        return verify_token(token)
     except Exception as e:
         logger.error(f"Error verifying token: {str(e)}")
         return None
 
+def _authenticate_admin():
+    """Return (user_id, None) for an admin caller, or (None, error response)"""
+    # Get token from header
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        logger.error("No valid Authorization header")
+        return None, (jsonify({"error": "No authorization header"}), 401)
+        
+    token = auth_header.split(' ')[1]
+    
+    # Verify token with caching
+    user_info = verify_token_with_cache(token)
+    if not user_info:
+        logger.error("Token verification failed")
+        return None, (jsonify({"error": "Invalid token"}), 401)
+        
+    auth0_id = user_info.get('sub')
+    if not auth0_id:
+        logger.error("No user ID in token")
+        return None, (jsonify({"error": "Invalid user info"}), 401)
+    
+    # Get user ID from our database
+    user_id = user_id_for(auth0_id, supabase)
+    if not user_id:
+        logger.error(f"Admin check - User not found in database for auth0_id: {auth0_id}")
+        return None, (jsonify({"error": "User not found"}), 404)
+        
+    if not is_admin(user_id):
+        logger.info("Admin check - User is not an admin")
+        return None, (jsonify({"error": "Admin access required"}), 403)
+        
+    # Add user info to request for use in the route
+    request.user = user_info
+    return user_id, None
+
 def requires_admin(f):
     """Decorator to require admin access"""
     @wraps(f)
     def decorated(*args, **kwargs):
         try:
-            # Get token from header
-            auth_header = request.headers.get('Authorization')
-            if not auth_header or not auth_header.startswith('Bearer '):
-                logger.error("No valid Authorization header")
-                return jsonify({"error": "No authorization header"}), 401
-                
-            token = auth_header.split(' ')[1]
-            logger.info(f"Admin check - Auth header present: True")
-            logger.info(f"Admin check - Token format: {token[:20]}...")
-            
-            # Verify token with caching
-            user_info = verify_token_with_cache(token)
-            if not user_info:
-                logger.error("Token verification failed")
-                return jsonify({"error": "Invalid token"}), 401
+            user_id, denied = _authenticate_admin()
+            if denied:
+                return denied
                 
-            auth0_id = user_info.get('sub')
-            if not auth0_id:
-                logger.error("No user ID in token")
-                return jsonify({"error": "Invalid user info"}), 401
-            
-            # Get user ID from our database
-            user_result = supabase.table('users').select('id').eq('auth0_id', auth0_id).execute()
-            if not user_result.data:
-                logger.error(f"Admin check - User not found in database for auth0_id: {auth0_id}")
-                return jsonify({"error": "User not found"}), 404
-                
-            user_id = user_result.data[0]['id']
-            logger.info(f"Admin check - Database user ID: {user_id}")
-            
-            if not is_admin(user_id):
-                logger.info("Admin check - User is not an admin")
-                return jsonify({"error": "Admin access required"}), 403
-                
-            logger.info("Admin check - User is an admin, access granted")
             return f(*args, **kwargs)
             
         except Exception as e:
@@ -248,8 +189,8 @@ def check_admin():
             }), 401
         
         # Get user ID from our database
-        user_result = supabase.table('users').select('id').eq('auth0_id', auth0_id).execute()
-        if not user_result.data:
+        user_id = user_id_for(auth0_id, supabase)
+        if not user_id:
             logger.error(f"User not found in database for auth0_id: {auth0_id}")
             return jsonify({
                 "error": "User not found",
@@ -258,20 +199,14 @@ def check_admin():
                 "auth0_id": auth0_id
             }), 404
             
-        user_id = user_result.data[0]['id']
         logger.info(f"Checking admin status for user_id: {user_id}")
         
         # Check admin status
         admin_status = is_admin(user_id)
         logger.info(f"Admin status check result: {admin_status}")
         
-        # Get user's roles and permissions
-        roles_result = supabase.table('user_admin_roles') \
-            .select('admin_roles(name)') \
-            .eq('user_id', user_id) \
-            .execute()
-            
-        roles = [role['admin_roles']['name'] for role in roles_result.data] if roles_result.data else []
+        # Get user's roles
+        roles = admin_roles_of(user_id, supabase)
         logger.info(f"User roles: {roles}")
         
         return jsonify({
@@ -350,53 +285,21 @@ def requires_admin_permission(permission):
         @wraps(f)
         def decorated_function(*args, **kwargs):
             try:
-                # First verify admin status
-                if not requires_admin(f)(*args, **kwargs):
-                    return jsonify({"error": "Admin access required"}), 403
+                user_id, denied = _authenticate_admin()
+                if denied:
+                    return denied
 
-                # Get user info from request
-                auth_header = request.headers.get('Authorization')
-                if not auth_header:
-                    return jsonify({"error": "No authorization header"}), 401
-
-                token = auth_header.split(' ')[1]
-                user_info = verify_token_with_cache(token)
-                
-                if not user_info:
-                    return jsonify({"error": "Invalid token"}), 401
-
-                # Get user from database
-                user_result = supabase.table('users').select('id').eq('auth0_id', user_info['sub']).execute()
-                if not user_result.data:
-                    return jsonify({"error": "User not found"}), 404
-
-                user_id = user_result.data[0]['id']
-
-                # Check if user has the required permission
-                permission_query = supabase.table('admin_role_permissions').select(
-                    'admin_roles(name), admin_permissions(name)'
-                ).eq('admin_permissions.name', permission).execute()
-
-                if not permission_query.data:
+                # One lookup in the compiled role permissions
+                authz = get_admin_authz(supabase)
+                if permission not in authz.permission_bits:
                     return jsonify({"error": "Permission not found"}), 404
 
-                # Get user's roles
-                user_roles = supabase.table('user_admin_roles').select(
-                    'admin_roles(name)'
-                ).eq('user_id', user_id).execute()
-
-                if not user_roles.data:
+                if str(user_id) not in authz.user_masks:
                     return jsonify({"error": "User has no admin roles"}), 403
 
-                # Check if user has any role with the required permission
-                user_role_names = [role['admin_roles']['name'] for role in user_roles.data]
-                permission_role_names = [role['admin_roles']['name'] for role in permission_query.data]
-
-                if not any(role in permission_role_names for role in user_role_names):
+                if not has_admin_permission(user_id, permission, supabase):
                     return jsonify({"error": "Insufficient permissions"}), 403
 
-                # Add user info to request for use in the route
-                request.user = user_info
                 return f(*args, **kwargs)
 
             except Exception as e:
@@ -468,6 +371,10 @@ def update_user_admin(user_id):
         
         if not result.data:
             return jsonify({"error": "User not found"}), 404
+
+        if 'auth0_id' in data:
+            # The old auth0_id may still be cached against this user
+            invalidate_all_users()
             
         # Log the action
         log_admin_action(
@@ -506,6 +413,7 @@ def create_role_admin():
             
         # Create role
         result = supabase.table('admin_roles').insert(data).execute()
+        invalidate_admin_authz()
         
         # Log the action
         log_admin_action(
@@ -548,6 +456,7 @@ def assign_role_admin(user_id):
         
         # Assign role
         result = supabase.table('user_admin_roles').insert(data).execute()
+        invalidate_admin_authz()
         
         # Log the action
         log_admin_action(
@@ -1,9 +1,10 @@
-from flask import Blueprint, request, jsonify
-from anthropic import Anthropic
+from flask import Blueprint, request, jsonify, Response, stream_with_context
 import os
 import uuid
 import json
-from datetime import datetime, timedelta
+import queue
+import threading
+from datetime import datetime, timedelta, timezone
 from models_proposed_dynamic import (
     Users, TextbookContent, CourseParts, CourseChapters, CourseTopics, Decks, Cards,
     StudyProgress, CardReviews, SubjectCategories, SubjectSubcategories
@@ -16,13 +17,24 @@ import jwt
 from jwt.algorithms import RSAAlgorithm
 from jwt_verify import requires_scope
 from access_control import (
-    requires_permission, requires_role, assign_role, remove_role,
+    requires_permission, requires_role, assign_role, remove_role, get_user_role, invalidate_deck_roles,
     ResourceType, Permission, Role
 )
 from supabase_config import supabase
+from identity import current_user_id, user_id_for
 from auth_decorators import requires_auth
-from study.supermemo2 import SuperMemo2
 from subscription_management import SubscriptionManager, SubscriptionTier, SubscriptionStatus
+from textbook_analyzer import TextbookAnalyzer
+from generation_jobs import get_job_store, STATUS_FAILED
+from deck_pipeline import run_deck_pipeline
+from deck_snapshot import get_deck_snapshots, invalidate_deck_snapshot
+from due_queue import get_due_queue, day_start, DUE_QUEUE_LIMIT
+from session_queue import get_session_queues, SESSION_QUEUE_PREFETCH
+from study.forecast import forecast_reviews, DEFAULT_FORECAST_DAYS, MAX_FORECAST_DAYS, FORECAST_RUNS, MAX_FORECAST_RUNS
+from study.load_balancer import LOAD_BALANCE_ENABLED
+from study.session_stats import summarize_session
+from usage_metering import rate_limited
+from review_sync import apply_review_batch, STATUS_APPLIED, STATUS_DUPLICATE, STATUS_REJECTED
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -45,286 +57,26 @@ api = Blueprint('api', __name__)
 # Initialize subscription manager
 subscription_manager = SubscriptionManager()
 
-class TextbookAnalyzer:
-    def __init__(self):
-        self.client = None
-        self._initialize_client()
+# Queue for deck generation jobs, drained by deck_worker.py
+job_store = get_job_store()
 
-    def _initialize_client(self):
-        """Initialize the Anthropic client with API key"""
-        if not hasattr(self, 'client') or self.client is None:
-            api_key = os.getenv('ANTHROPIC_API_KEY')
-            try:
-                self.client = Anthropic(api_key=api_key)
-            except Exception as e:
-                logger.error(f"Error initializing Anthropic client: {e}")
-                raise
+# Comment line sent on idle event streams so proxies keep the connection open
+STREAM_KEEPALIVE_SECONDS = 15
 
-    def analyze_textbook(self, textbook_name, client=None):
-        """Analyze textbook title to determine subject area and requirements"""
-        logger.info(f"Analyzing subject area for: {textbook_name}")
-        
-        if client is None:
-            client = self.client
-        
-        if client is None:
-            api_key = os.getenv('ANTHROPIC_API_KEY')
-            client = Anthropic(api_key=api_key)
-        
-        analysis_prompt = f"""
-        Based solely on this textbook title: "{textbook_name}", please:
-        
-        1. Identify the primary subject area (e.g., mathematics, physics, economics, biology)
-        2. Identify any specialized subfields (e.g., organic chemistry, linear algebra, microeconomics)
-        3. Determine if this subject typically requires:
-        - Mathematical notation (equations, formulas, symbols)
-        - Chemical formulas or reactions
-        - Biological processes or diagrams
-        - Code snippets
-        - Historical context
-        - Conceptual frameworks
-        - Theoretical models
-        - Examples or case studies
-        - Quotations from key figures
-        
-        Return your analysis as a JSON object with the following structure:
-        {{
-            "primary_subject": "subject name",
-            "subfields": ["subfield1", "subfield2"],
-            "requires_math": true/false,
-            "requires_chemistry_notation": true/false,
-            "requires_biology_notation": true/false,
-            "benefits_from_code": true/false,
-            "benefits_from_history": true/false,
-            "benefits_from_concepts": true/false,
-            "benefits_from_theory": true/false,
-            "benefits_from_examples": true/false,
-            "benefits_from_quotes": true/false,
-            "recommended_focus_areas": ["focus1", "focus2", "focus3"],
-            "special_notation_needs": ["need1", "need2"]
-        }}
-        """
-        
-        try:
-            response = client.messages.create(
-                model="claude-3-5-sonnet-20240620",
-                max_tokens=1000,
-                temperature=0.2,
-                system="You are an expert in academic subjects who can identify the subject area and learning requirements of a textbook based on its title. Respond with valid JSON only.",
-                messages=[
-                    {"role": "user", "content": analysis_prompt}
-                ]
-            )
-            
-            content = response.content[0].text
-            
-            if content.startswith("```json") and content.endswith("```"):
-                content = content[7:-3]
-            elif content.startswith("```") and content.endswith("```"):
-                content = content[3:-3]
-                
-            analysis = json.loads(content)
-            logger.info(f"Successfully analyzed textbook: {textbook_name}")
-            return analysis
-            
-        except Exception as e:
-            logger.error(f"Error analyzing textbook: {e}")
-            return {
-                "primary_subject": "general",
-                "subfields": [],
-                "requires_math": True,
-                "requires_chemistry_notation": False,
-                "requires_biology_notation": False,
-                "benefits_from_code": False,
-                "benefits_from_history": True,
-                "benefits_from_concepts": True,
-                "benefits_from_theory": True,
-                "benefits_from_examples": True,
-                "benefits_from_quotes": True,
-                "recommended_focus_areas": ["core concepts", "critical thinking", "applications"],
-                "special_notation_needs": []
-            }
+# Study queue per user and deck, with an upper bound for its ?limit=
+due_queue = get_due_queue()
+MAX_DUE_QUEUE_LIMIT = 500
 
-    def generate_structure(self, textbook_name, test_mode=False):
-        """Generate textbook structure using Claude"""
-        try:
-            structure_prompt = f"""
-            Create a detailed structure for the textbook "{textbook_name}".
-            
-            CRITICAL FORMATTING REQUIREMENTS:
-            1. Title Format:
-               - Parts must be exactly "Part I: [Title]", "Part II: [Title]", etc.
-               - Chapters must be exactly "Chapter 1: [Title]", "Chapter 2: [Title]", etc.
-               - DO NOT double-number chapters (NO "Chapter 1: Chapter 3: Title")
-               - Keep chapter numbers sequential within each part
-               - Topics should have clear titles without numbers
-
-            Example of correct formatting:
-            {{
-                "parts": [
-                    {{
-                        "title": "Part I: Fundamentals",
-                        "chapters": [
-                            {{
-                                "title": "Chapter 1: Introduction",
-                                "topics": [...]
-                            }},
-                            {{
-                                "title": "Chapter 2: Basic Concepts",
-                                "topics": [...]
-                            }}
-                        ]
-                    }}
-                ]
-            }}
-
-            Requirements:
-            1. Include 2-3 main parts
-            2. Each part should have 2-3 chapters
-            3. Each chapter should have 2-4 topics
-            4. Every topic must have:
-               - A clear title
-               - A comment explaining its importance
-               - A card_count between 5-10
-               - requires_latex flag indicating if LaTeX is needed
-               - latex_type specifying the type of notation needed
-            """
-
-            response = self.client.messages.create(
-                model="claude-3-5-sonnet-20240620",
-                max_tokens=2000,
-                temperature=0.3,
-                system="""You are an expert in textbook organization. 
-                         Respond with valid JSON only. 
-                         Ensure parts use Roman numerals (I, II, III).
-                         Ensure chapters use continuous Arabic numerals (1, 2, 3, 4...).
-                         Never double-number chapters.
-                         Maintain consistent formatting throughout.""",
-                messages=[
-                    {"role": "user", "content": structure_prompt}
-                ]
-            )
-            
-            content = response.content[0].text
-            if content.startswith("```json") and content.endswith("```"):
-                content = content[7:-3]
-            elif content.startswith("```") and content.endswith("```"):
-                content = content[3:-3]
-            
-            structure = json.loads(content)
-
-            # Fix and verify formatting
-            chapter_counter = 1
-            for i, part in enumerate(structure['parts']):
-                if not part['title'].startswith(f"Part {self._to_roman(i+1)}:"):
-                    part['title'] = f"Part {self._to_roman(i+1)}: {part['title'].split(':', 1)[-1].strip()}"
-                
-                for chapter in part['chapters']:
-                    if "Chapter" in chapter['title'].split(":", 1)[-1]:
-                        actual_title = chapter['title'].split(":")[-1].strip()
-                        chapter['title'] = f"Chapter {chapter_counter}: {actual_title}"
-                    else:
-                        chapter['title'] = f"Chapter {chapter_counter}: {chapter['title'].split(':', 1)[-1].strip()}"
-                    
-                    chapter_counter += 1
-                    
-                    for topic in chapter['topics']:
-                        if 'requires_latex' not in topic:
-                            topic['requires_latex'] = False
-                        if 'latex_type' not in topic:
-                            topic['latex_type'] = 'none'
-
-            return structure
-
-        except Exception as e:
-            logger.error(f"Error generating structure: {e}")
-            if test_mode:
-                return {
-                    'parts': [
-                        {
-                            'title': 'Part I: Fundamentals',
-                            'chapters': [
-                                {
-                                    'title': 'Chapter 1: Introduction',
-                                    'topics': [
-                                        {
-                                            'title': 'Basic Concepts',
-                                            'comment': 'Foundation of the subject',
-                                            'card_count': 5,
-                                            'requires_latex': False,
-                                            'latex_type': 'none'
-                                        }
-                                    ]
-                                }
-                            ]
-                        }
-                    ]
-                }
-            raise
-
-    def _to_roman(self, num):
-        """Helper method to convert numbers to Roman numerals"""
-        roman_nums = [
-            ('X', 10),
-            ('IX', 9),
-            ('V', 5),
-            ('IV', 4),
-            ('I', 1)
-        ]
-        result = ''
-        for roman, value in roman_nums:
-            while num >= value:
-                result += roman
-                num -= value
-        return result
-
-    def generate_cards_for_topic(self, topic_title, topic_comment, textbook_name, card_count):
-        """Generate flashcards for a specific topic using Claude"""
-        try:
-            cards_prompt = f"""
-            Create {card_count} Anki flashcards for the topic "{topic_title}" from the textbook "{textbook_name}".
-            Topic context: {topic_comment}
-            
-            Return as JSON array of cards:
-            [
-                {{
-                    "question": "Clear, specific question",
-                    "answer": "Comprehensive answer"
-                }}
-            ]
-            """
-
-            response = self.client.messages.create(
-                model="claude-3-5-sonnet-20240620",
-                max_tokens=2000,
-                temperature=0.3,
-                system="You are an expert in creating educational flashcards. Respond with valid JSON only.",
-                messages=[
-                    {"role": "user", "content": cards_prompt}
-                ]
-            )
-            
-            content = response.content[0].text
-            
-            if content.startswith("```json") and content.endswith("```"):
-                content = content[7:-3]
-            elif content.startswith("```") and content.endswith("```"):
-                content = content[3:-3]
-            
-            return json.loads(content)
+# Cards of each running study session, with an upper bound for its ?prefetch=
+session_queues = get_session_queues()
+MAX_SESSION_QUEUE_PREFETCH = 50
 
-        except Exception as e:
-            logger.error(f"Error generating cards: {e}")
-            return [
-                {
-                    "question": f"What is {topic_title}?",
-                    "answer": "This is a test card generated in fallback mode."
-                },
-                {
-                    "question": f"Explain the importance of {topic_title}.",
-                    "answer": "This is another test card generated in fallback mode."
-                }
-            ]
+# SQLSTATEs raised by apply_card_review and the responses they map to
+REVIEW_ERROR_STATUS = {
+    '22023': 400,  # quality out of range
+    '42501': 403,  # card or study session belongs to another user
+    'P0002': 404   # card not found
+}
 
 @api.route('/api/test', methods=['GET'])
 def test():
@@ -405,6 +157,10 @@ def delete_deck(deck_id):
             
         # Delete the deck
         supabase.table('decks').delete().eq('id', deck_id).execute()
+        invalidate_deck_snapshot(deck_id)
+        due_queue.invalidate(deck_id)
+        session_queues.invalidate(deck_id)
+        invalidate_deck_roles(deck_id)
         
         return jsonify({'message': 'Deck deleted successfully'})
         
@@ -515,7 +271,10 @@ def create_live_deck():
 @api.route('/api/live-decks/<live_deck_id>/cards', methods=['GET'])
 @requires_auth
 def get_live_deck_cards(live_deck_id):
-    """Get all cards for a live deck with their states"""
+    """
+    Get all cards for a live deck with their states, or with ?due=true only
+    the ones due now (up to ?limit reviews and as many new cards)
+    """
     try:
         # Check if user owns the live deck
         live_deck_result = supabase.table('live_decks').select('*').eq('id', live_deck_id).execute()
@@ -526,10 +285,12 @@ def get_live_deck_cards(live_deck_id):
         if live_deck['user_id'] != request.user['sub']:
             return jsonify({'error': 'Unauthorized'}), 403
             
-        # Get cards with their states
-        cards_result = supabase.table('user_card_states').select(
-            'card_id, is_active, next_review, interval, easiness, repetitions'
-        ).eq('live_deck_id', live_deck_id).execute()
+        # Cards without a state row yet come back as new, with the defaults
+        params = {'p_live_deck_id': live_deck_id}
+        if request.args.get('due', '').lower() in ('1', 'true'):
+            params['p_now'] = datetime.now(timezone.utc).isoformat()
+            params['p_limit'] = request.args.get('limit', type=int)
+        cards_result = supabase.rpc('get_live_deck_card_states', params).execute()
         
         return jsonify(cards_result.data)
         
@@ -556,16 +317,32 @@ def toggle_card_state(live_deck_id, card_id):
             'live_deck_id', live_deck_id
         ).eq('card_id', card_id).execute()
         
-        if not card_state_result.data:
-            return jsonify({'error': 'Card state not found'}), 404
-            
-        # Toggle the state
-        current_state = card_state_result.data[0]
-        new_state = not current_state['is_active']
-        
-        result = supabase.table('user_card_states').update({
-            'is_active': new_state
-        }).eq('live_deck_id', live_deck_id).eq('card_id', card_id).execute()
+        if card_state_result.data:
+            # Toggle the state
+            new_state = not card_state_result.data[0]['is_active']
+            supabase.table('user_card_states').update({
+                'is_active': new_state
+            }).eq('live_deck_id', live_deck_id).eq('card_id', card_id).execute()
+        else:
+            # First touch of the card: write its row, starting from the defaults
+            card_result = supabase.table('cards').select('id').eq('id', card_id).eq(
+                'deck_id', live_deck['deck_id']
+            ).execute()
+            if not card_result.data:
+                return jsonify({'error': 'Card not found'}), 404
+
+            new_state = False
+            supabase.table('user_card_states').upsert({
+                'id': str(uuid.uuid4()),
+                'user_id': live_deck['user_id'],
+                'live_deck_id': live_deck_id,
+                'card_id': card_id,
+                'is_active': new_state,
+                'easiness': 2.5,
+                'interval': 1,
+                'repetitions': 0,
+                'created_at': datetime.utcnow().isoformat()
+            }, on_conflict='live_deck_id,card_id', ignore_duplicates=True).execute()
         
         return jsonify({
             'card_id': card_id,
@@ -591,6 +368,51 @@ def get_learning_analytics():
         logger.error(f"Error getting learning analytics: {e}")
         return jsonify({"error": str(e)}), 500
 
+@api.route('/api/forecast', methods=['GET'])
+@requires_auth
+def get_review_forecast():
+    """Forecast the reviews per day for one of the user's decks, or all of them"""
+    try:
+        # Get user from database using Auth0 ID
+        user_id = current_user_id()
+        if not user_id:
+            logger.error(f"User not found in database for Auth0 ID: {request.user['sub']}")
+            return jsonify({'error': 'User not found in database'}), 404
+            
+        deck_id = request.args.get('deck_id')
+        days = request.args.get('days', DEFAULT_FORECAST_DAYS, type=int)
+        runs = request.args.get('runs', FORECAST_RUNS, type=int)
+        if not 1 <= days <= MAX_FORECAST_DAYS or not 1 <= runs <= MAX_FORECAST_RUNS:
+            return jsonify({'error': f'days must be 1-{MAX_FORECAST_DAYS} and runs 1-{MAX_FORECAST_RUNS}'}), 400
+        
+        today = day_start(datetime.now(timezone.utc))
+        result = supabase.rpc('get_forecast_card_states', {
+            'p_user_id': user_id,
+            'p_deck_id': deck_id,
+            'p_day_start': today.isoformat()
+        }).execute()
+        states = result.data[0]
+        
+        forecast = forecast_reviews(
+            states['easiness'], states['interval'], states['repetitions'], states['due_day'],
+            days=days, runs=runs
+        )
+        
+        return jsonify({
+            'deckId': deck_id,
+            'startDate': today.date().isoformat(),
+            'days': days,
+            'runs': runs,
+            'cards': len(states['due_day']),
+            'mean': forecast['mean'],
+            'p10': forecast['p10'],
+            'p90': forecast['p90']
+        })
+        
+    except Exception as e:
+        logger.error(f"Error forecasting reviews: {e}")
+        return jsonify({"error": str(e)}), 500
+
 @api.route('/api/achievements', methods=['GET'])
 @requires_auth
 def get_achievements():
@@ -648,6 +470,7 @@ def create_study_reminder():
         return jsonify({"error": str(e)}), 500
 
 @api.route('/api/analyze-textbook', methods=['POST'])
+@rate_limited()
 def analyze_textbook():
     """Analyze a textbook's title to determine subject area and requirements"""
     data = request.get_json()
@@ -656,7 +479,7 @@ def analyze_textbook():
     if not textbook_name:
         return jsonify({'error': 'textbook_name is required'}), 400
 
-    analyzer = TextbookAnalyzer()
+    analyzer = TextbookAnalyzer(use_cache=data.get('use_cache', True))
     try:
         analysis = analyzer.analyze_textbook(textbook_name)
         return jsonify(analysis)
@@ -679,9 +502,32 @@ def analyze_textbook():
         }
         return jsonify({"error": str(e), "fallback_analysis": default_analysis}), 500
 
+def _reserve_deck_generation(user_id):
+    """Reserve one deck generation for the user; return an error response if they may not generate one, else None"""
+    # Subscriptions belong to the database user; the entitlement is cached per user
+    db_user_id = user_id_for(user_id)
+    subscription = subscription_manager.get_current_subscription(db_user_id) if db_user_id else None
+    
+    if not subscription or subscription.status != SubscriptionStatus.ACTIVE:
+        return jsonify({'error': 'Active subscription required for deck generation'}), 403
+        
+    # Checked and counted in one step, so parallel requests can't all pass the check
+    if not subscription_manager.reserve_usage(db_user_id, 'deck_generation'):
+        return jsonify({'error': 'Monthly deck generation limit reached'}), 429
+    
+    return None
+
+def _refund_deck_generation(user_id):
+    """Give back the deck generation reserved for a request whose deck failed"""
+    try:
+        subscription_manager.refund_usage(user_id_for(user_id), 'deck_generation')
+    except Exception as e:
+        logger.error(f"Error refunding deck generation for {user_id}: {e}")
+
 @api.route('/api/generate-deck', methods=['POST'])
 @requires_auth
 @requires_permission(Permission.CREATE)
+@rate_limited()
 def generate_deck():
     """Generate a deck from a textbook name and save to PostgreSQL"""
     data = request.get_json()
@@ -693,184 +539,91 @@ def generate_deck():
     try:
         # Check subscription status and limits
         user_id = request.user['sub']
-        subscription = subscription_manager.get_current_subscription(user_id)
-        
-        if not subscription or subscription.status != SubscriptionStatus.ACTIVE:
-            return jsonify({'error': 'Active subscription required for deck generation'}), 403
-            
-        # Check usage limits
-        if not subscription_manager.check_usage_limit(user_id, 'deck_generation'):
-            return jsonify({'error': 'Monthly deck generation limit reached'}), 429
-        
-        # Initialize analyzer
-        analyzer = TextbookAnalyzer()
-        
-        # Step 1: Analyze textbook
-        logger.info("Analyzing textbook...")
-        analysis = analyzer.analyze_textbook(textbook_name)
-        
-        # Step 2: Generate structure
-        logger.info("Generating structure...")
-        structure = analyzer.generate_structure(textbook_name)
-        
-        # Step 3: Create database entries
-        logger.info("Creating database entries...")
-        
-        # Create or get primary subject category
-        primary_subject = analysis.get('primary_subject', 'general')
-        subject_result = supabase.table('subject_categories').select('*').eq('name', primary_subject).execute()
+        denied = _reserve_deck_generation(user_id)
+        if denied:
+            return denied
         
-        if not subject_result.data:
-            # Create new subject category
-            subject_category = SubjectCategories(
-                name=primary_subject,
-                description=f"Primary subject category for {primary_subject}",
-                level=1
-            )
-            subject_result = supabase.table('subject_categories').insert(subject_category.to_dict()).execute()
-            main_subject_id = subject_result.data[0]['id']
-        else:
-            main_subject_id = subject_result.data[0]['id']
-        
-        # Create or get subcategories
-        subcategory_ids = []
-        for subfield in analysis.get('subfields', []):
-            subcategory_result = supabase.table('subject_subcategories').select('*').eq('name', subfield).execute()
-            
-            if not subcategory_result.data:
-                # Create new subcategory
-                subcategory = SubjectSubcategories(
-                    category_id=main_subject_id,
-                    name=subfield,
-                    description=f"Subcategory of {primary_subject}"
-                )
-                subcategory_result = supabase.table('subject_subcategories').insert(subcategory.to_dict()).execute()
-                subcategory_ids.append(subcategory_result.data[0]['id'])
-            else:
-                subcategory_ids.append(subcategory_result.data[0]['id'])
-        
-        # Create deck with subject information
-        logger.info("Creating deck...")
-        deck = Decks(
-            user_id=user_id,
-            title=textbook_name,
-            created_at=datetime.utcnow(),
-            is_active=True,
-            last_modified=datetime.utcnow(),
-            main_subject_id=main_subject_id,
-            subcategory_ids=subcategory_ids
-        )
-        
-        # Insert deck into Supabase
-        deck_result = supabase.table('decks').insert(deck.to_dict()).execute()
-        if not deck_result.data:
-            raise Exception("Failed to create deck")
-        deck_id = deck_result.data[0]['id']
-        
-        all_cards = {}
-        # Create parts, chapters, topics
-        for part_idx, part_data in enumerate(structure['parts']):
-            logger.info(f"Creating part: {part_data['title']}")
-            part = Parts(
-                deck_id=deck_id,
-                title=part_data['title'],
-                order_index=part_idx,
-                is_active=True,
-                last_modified=datetime.utcnow()
-            )
-            
-            # Insert part into Supabase
-            part_result = supabase.table('parts').insert(part.to_dict()).execute()
-            if not part_result.data:
-                raise Exception("Failed to create part")
-            part_id = part_result.data[0]['id']
-
-            for chapter_idx, chapter_data in enumerate(part_data['chapters']):
-                logger.info(f"Creating chapter: {chapter_data['title']}")
-                chapter = Chapters(
-                    part_id=part_id,
-                    title=chapter_data['title'],
-                    order_index=chapter_idx,
-                    is_active=True,
-                    last_modified=datetime.utcnow()
-                )
-                
-                # Insert chapter into Supabase
-                chapter_result = supabase.table('chapters').insert(chapter.to_dict()).execute()
-                if not chapter_result.data:
-                    raise Exception("Failed to create chapter")
-                chapter_id = chapter_result.data[0]['id']
-
-                for topic_idx, topic_data in enumerate(chapter_data['topics']):
-                    logger.info(f"Creating topic: {topic_data['title']}")
-                    topic = Topics(
-                        chapter_id=chapter_id,
-                        title=topic_data['title'],
-                        order_index=topic_idx,
-                        is_active=True,
-                        last_modified=datetime.utcnow()
-                    )
-                    
-                    # Insert topic into Supabase
-                    topic_result = supabase.table('topics').insert(topic.to_dict()).execute()
-                    if not topic_result.data:
-                        raise Exception("Failed to create topic")
-                    topic_id = topic_result.data[0]['id']
-
-                    # Generate cards for this topic
-                    logger.info(f"Generating cards for topic: {topic_data['title']}")
-                    cards = analyzer.generate_cards_for_topic(
-                        topic_data['title'],
-                        topic_data.get('comment', ''),
-                        textbook_name,
-                        topic_data.get('card_count', 3)
-                    )
-                    
-                    # Store cards in database
-                    topic_cards = []
-                    for card_data in cards:
-                        card = Cards(
-                            topic_id=topic_id,
-                            front=card_data['question'],
-                            back=card_data['answer'],
-                            is_active=True,
-                            last_modified=datetime.utcnow()
-                        )
-                        
-                        # Insert card into Supabase
-                        card_result = supabase.table('cards').insert(card.to_dict()).execute()
-                        if not card_result.data:
-                            raise Exception("Failed to create card")
-                            
-                        topic_cards.append({
-                            'front': card.front,
-                            'back': card.back
-                        })
-                    all_cards[str(topic_id)] = topic_cards
-
-        # Update usage count
-        subscription_manager.increment_usage(user_id, 'deck_generation')
+        # Hand the pipeline to the deck workers; they refund the use if the job fails for good
+        try:
+            job = job_store.enqueue(user_id, {
+                'textbook_name': textbook_name,
+                'use_cache': data.get('use_cache', True)
+            })
+        except Exception:
+            _refund_deck_generation(user_id)
+            raise
         
         return jsonify({
-            'message': 'Deck generated successfully',
-            'deck': {
-                'id': str(deck_id),
-                'title': deck.title,
-                'user_id': user_id,
-                'main_subject_id': main_subject_id,
-                'subcategory_ids': subcategory_ids
-            },
-            'analysis': analysis,
-            'structure': structure,
-            'cards': all_cards
-        })
+            'message': 'Deck generation started',
+            'generation_id': job['id'],
+            'status': job['status'],
+            'status_url': f"/api/generations/{job['id']}"
+        }), 202
         
     except Exception as e:
         logger.error(f"Error generating deck: {e}")
         return jsonify({"error": str(e)}), 500
 
+@api.route('/api/generate-deck/stream', methods=['POST'])
+@requires_auth
+@requires_permission(Permission.CREATE)
+@rate_limited()
+def generate_deck_stream():
+    """Generate a deck and stream each step as Server-Sent Events"""
+    data = request.get_json()
+    textbook_name = data.get('textbook_name')
+    
+    if not textbook_name:
+        return jsonify({'error': 'textbook_name is required'}), 400
+        
+    try:
+        user_id = request.user['sub']
+        denied = _reserve_deck_generation(user_id)
+        if denied:
+            return denied
+    except Exception as e:
+        logger.error(f"Error generating deck: {e}")
+        return jsonify({"error": str(e)}), 500
+    
+    events = queue.Queue()
+    
+    def run():
+        # Runs outside the request; the deck is finished even if the client disconnects
+        try:
+            result = run_deck_pipeline(
+                textbook_name,
+                user_id,
+                use_cache=data.get('use_cache', True),
+                on_event=lambda event, payload: events.put((event, payload))
+            )
+            events.put(('complete', result))
+        except Exception as e:
+            logger.error(f"Error generating deck: {e}")
+            _refund_deck_generation(user_id)
+            events.put(('error', {'error': str(e)}))
+    
+    threading.Thread(target=run, name='deck-stream', daemon=True).start()
+    
+    def stream():
+        while True:
+            try:
+                event, payload = events.get(timeout=STREAM_KEEPALIVE_SECONDS)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            yield f"event: {event}\ndata: {json.dumps(payload, default=str)}\n\n"
+            if event in ('complete', 'error'):
+                return
+    
+    return Response(
+        stream_with_context(stream()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @api.route('/api/generate-textbook-structure', methods=['POST'])
 @requires_auth
+@rate_limited()
 def generate_textbook_structure():
     """Generate a structured outline for a textbook"""
     data = request.get_json()
@@ -882,7 +635,7 @@ def generate_textbook_structure():
     if not textbook_name:
         return jsonify({'error': 'textbook_name is required'}), 400
 
-    analyzer = TextbookAnalyzer()
+    analyzer = TextbookAnalyzer(use_cache=data.get('use_cache', True))
     try:
         structure = analyzer.generate_structure(textbook_name, test_mode)
         
@@ -993,6 +746,7 @@ def generate_textbook_structure():
         return jsonify({"error": str(e)}), 500
 
 @api.route('/api/generate-cards', methods=['POST'])
+@rate_limited()
 def generate_cards():
     """Generate flashcards for a specific topic"""
     data = request.get_json()
@@ -1026,7 +780,7 @@ def generate_cards():
         textbook = textbook_result.data[0]
         
         # Generate cards
-        analyzer = TextbookAnalyzer()
+        analyzer = TextbookAnalyzer(use_cache=data.get('use_cache', True))
         cards = analyzer.generate_cards_for_topic(
             topic['title'],
             topic['comment'],
@@ -1051,6 +805,9 @@ def generate_cards():
             }
             result = supabase.table('cards').insert(card_data).execute()
             created_cards.append(result.data[0])
+        invalidate_deck_snapshot(deck_id)
+        due_queue.invalidate(deck_id)
+        session_queues.invalidate(deck_id)
         
         return jsonify(created_cards)
         
@@ -1071,12 +828,11 @@ def create_study_session():
             return jsonify({'error': 'deck_id is required'}), 400
             
         # Get user from database using Auth0 ID
-        user_result = supabase.table('users').select('id').eq('auth0_id', request.user['sub']).execute()
-        if not user_result.data:
+        user_id = current_user_id()
+        if not user_id:
             logger.error(f"User not found in database for Auth0 ID: {request.user['sub']}")
             return jsonify({'error': 'User not found in database'}), 404
             
-        user_id = user_result.data[0]['id']
         logger.info(f"Found user ID: {user_id} for Auth0 ID: {request.user['sub']}")
         
         # Verify deck exists and user has access
@@ -1125,7 +881,18 @@ def create_study_session():
             return jsonify({'error': 'Failed to create study session'}), 500
             
         logger.info(f"Successfully created study session: {result.data[0]}")
-        return jsonify(result.data[0])
+        
+        # Queue the session's cards once, so each next card is a lookup
+        session = result.data[0]
+        try:
+            session_queues.build(session['id'], user_id, deck_id)
+            window = session_queues.window(session['id'], SESSION_QUEUE_PREFETCH + 1)
+            session['remaining'] = window['remaining']
+            session['cards'] = [_format_due_card(card) for card in window['cards']]
+        except Exception as e:
+            # The next-card endpoint builds the queue on demand
+            logger.error(f"Error queueing cards for study session {session['id']}: {e}")
+        return jsonify(session)
         
     except Exception as e:
         logger.error(f"Error creating study session: {e}")
@@ -1135,58 +902,98 @@ def create_study_session():
 @api.route('/api/study-sessions/<session_id>', methods=['PUT'])
 @requires_auth
 def end_study_session(session_id):
-    """End a study session and calculate statistics"""
+    """End a study session and return its statistics"""
     try:
         # Update session in Supabase
         update_data = {
             'ended_at': datetime.utcnow().isoformat()
         }
         
+        # The row carries the running totals of the session's reviews
         result = supabase.table('study_sessions').update(update_data).eq('id', session_id).execute()
         session = result.data[0]
-        
-        # Get reviews for statistics
-        reviews_result = supabase.table('card_reviews').select('*').eq('session_id', session_id).execute()
-        reviews = reviews_result.data
-        
-        # Calculate statistics
-        total_cards = len(reviews)
-        total_time = sum(r['time_taken'] for r in reviews if r['time_taken'])
-        avg_quality = sum(r['quality'] for r in reviews) / total_cards if total_cards else 0
-        
-        # Update session statistics
-        supabase.table('study_sessions').update({
-            'cards_studied': total_cards,
-            'correct_answers': sum(1 for r in reviews if r['quality'] >= 3)
-        }).eq('id', session_id).execute()
+        session_queues.drop(session_id)
         
         return jsonify({
             'sessionId': str(session['id']),
             'startedAt': session['started_at'],
             'endedAt': session['ended_at'],
-            'statistics': {
-                'totalCards': total_cards,
-                'totalTimeMs': total_time,
-                'averageQuality': avg_quality
-            }
+            'statistics': summarize_session(session)
         })
         
     except Exception as e:
         logger.error(f"Error ending study session: {e}")
         return jsonify({"error": str(e)}), 500
 
+@api.route('/api/study-sessions/<session_id>/next', methods=['GET'])
+@requires_auth
+def get_next_session_cards(session_id):
+    """Get the current card of a study session and the cards queued after it"""
+    try:
+        # Get user from database using Auth0 ID
+        user_id = current_user_id()
+        if not user_id:
+            logger.error(f"User not found in database for Auth0 ID: {request.user['sub']}")
+            return jsonify({'error': 'User not found in database'}), 404
+            
+        
+        prefetch = min(max(request.args.get('prefetch', SESSION_QUEUE_PREFETCH, type=int), 0), MAX_SESSION_QUEUE_PREFETCH)
+        window = session_queues.window(session_id, prefetch + 1)
+        
+        if window is None:
+            # Expired, evicted or invalidated since the session started
+            session_result = supabase.table('study_sessions').select('user_id, deck_id, ended_at').eq('id', session_id).execute()
+            if not session_result.data:
+                return jsonify({'error': 'Study session not found'}), 404
+            session = session_result.data[0]
+            if session['user_id'] != user_id:
+                logger.error(f"User {user_id} does not own study session {session_id}")
+                return jsonify({'error': 'Unauthorized'}), 403
+            if session.get('ended_at'):
+                return jsonify({'error': 'Study session has ended'}), 400
+            session_queues.build(session_id, user_id, session['deck_id'])
+            window = session_queues.window(session_id, prefetch + 1)
+        
+        if window['user_id'] != str(user_id):
+            logger.error(f"User {user_id} does not own study session {session_id}")
+            return jsonify({'error': 'Unauthorized'}), 403
+        
+        cards = [_format_due_card(card) for card in window['cards']]
+        return jsonify({
+            'sessionId': session_id,
+            'card': cards[0] if cards else None,
+            'prefetch': cards[1:],
+            'remaining': window['remaining']
+        })
+        
+    except Exception as e:
+        logger.error(f"Error getting next cards for study session {session_id}: {e}")
+        logger.error("Exception details:", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+def _format_due_card(card):
+    return {
+        'id': str(card['id']),
+        'front': card['front'],
+        'back': card['back'],
+        'nextReview': card['next_review'],
+        'interval': card['interval'],
+        'easiness': card['easiness'],
+        'repetitions': card['repetitions'],
+        'isNew': card['is_new']
+    }
+
 @api.route('/api/decks/<deck_id>/due-cards', methods=['GET'])
 @requires_auth
 def get_due_cards(deck_id):
     """Get cards that are due for review"""
     try:
         # Get user from database using Auth0 ID
-        user_result = supabase.table('users').select('id').eq('auth0_id', request.user['sub']).execute()
-        if not user_result.data:
+        user_id = current_user_id()
+        if not user_id:
             logger.error(f"User not found in database for Auth0 ID: {request.user['sub']}")
             return jsonify({'error': 'User not found in database'}), 404
             
-        user_id = user_result.data[0]['id']
         logger.info(f"Found user ID: {user_id} for Auth0 ID: {request.user['sub']}")
             
         # First verify the deck exists and user has access
@@ -1217,25 +1024,12 @@ def get_due_cards(deck_id):
             logger.error(f"User {user_id} does not have access to deck {deck_id}")
             return jsonify({'error': 'Unauthorized'}), 403
             
-        # Get all cards for the deck with their states
-        now = datetime.utcnow().isoformat()
-        result = supabase.table('cards').select(
-            'id, front, back, next_review, interval, easiness, repetitions'
-        ).eq('deck_id', deck_id).lte('next_review', now).execute()
+        # Most overdue cards first, then new cards, within the daily caps
+        limit = min(request.args.get('limit', DUE_QUEUE_LIMIT, type=int), MAX_DUE_QUEUE_LIMIT)
+        due_cards = due_queue.get(user_id, deck_id, limit=limit)
         
         # Format the response
-        cards = []
-        for card in result.data:
-            card_data = {
-                'id': str(card['id']),
-                'front': card['front'],
-                'back': card['back'],
-                'nextReview': card['next_review'],
-                'interval': card['interval'],
-                'easiness': card['easiness'],
-                'repetitions': card['repetitions']
-            }
-            cards.append(card_data)
+        cards = [_format_due_card(card) for card in due_cards]
             
         logger.info(f"Found {len(cards)} due cards for deck {deck_id}")
         return jsonify(cards)
@@ -1261,66 +1055,33 @@ def review_card():
             return jsonify({'error': 'card_id, session_id, and quality are required'}), 400
         
         # Get user from database using Auth0 ID
-        user_result = supabase.table('users').select('id').eq('auth0_id', request.user['sub']).execute()
-        if not user_result.data:
+        user_id = current_user_id()
+        if not user_id:
             logger.error(f"User not found in database for Auth0 ID: {request.user['sub']}")
             return jsonify({'error': 'User not found in database'}), 404
             
-        user_id = user_result.data[0]['id']
         logger.info(f"Found user ID: {user_id} for Auth0 ID: {request.user['sub']}")
         
-        # Get card data from Supabase
-        card_result = supabase.table('cards').select('*, decks!inner(*)').eq('id', card_id).execute()
-        if not card_result.data:
-            logger.error(f"Card not found: {card_id}")
-            return jsonify({'error': 'Card not found'}), 404
-            
-        card = card_result.data[0]
-        
-        # Verify user has access to the deck
-        if card['decks']['user_id'] != user_id:
-            logger.error(f"User {user_id} does not have access to card {card_id}")
-            return jsonify({'error': 'Unauthorized'}), 403
-        
-        # Apply SuperMemo2 algorithm
-        sm2 = SuperMemo2()
-        new_easiness, new_interval, new_repetitions = sm2.calculate_values(
-            quality,
-            card['easiness'],
-            card['interval'],
-            card['repetitions']
-        )
-        
-        # Update card in Supabase
-        update_data = {
-            'interval': new_interval,
-            'easiness': new_easiness,
-            'repetitions': new_repetitions,
-            'next_review': (datetime.utcnow() + timedelta(days=new_interval)).isoformat()
-        }
+        # Lock the card, apply SuperMemo2 and record the review in one transaction
+        try:
+            result = supabase.rpc('apply_card_review', {
+                'p_card_id': card_id,
+                'p_user_id': user_id,
+                'p_session_id': session_id,
+                'p_quality': quality,
+                'p_time_taken': time_taken,
+                'p_load_balance': LOAD_BALANCE_ENABLED
+            }).execute()
+        except Exception as e:
+            status = REVIEW_ERROR_STATUS.get(getattr(e, 'code', None))
+            if status is None:
+                raise
+            logger.error(f"Review of card {card_id} by user {user_id} refused: {e}")
+            return jsonify({'error': getattr(e, 'message', None) or str(e)}), status
         
-        logger.info(f"Updating card {card_id} with new values: {update_data}")
-        result = supabase.table('cards').update(update_data).eq('id', card_id).execute()
         updated_card = result.data[0]
-        
-        # Record the review
-        review_data = {
-            'id': str(uuid.uuid4()),
-            'session_id': session_id,
-            'card_id': card_id,
-            'quality': quality,
-            'time_taken': time_taken,
-            'created_at': datetime.utcnow().isoformat(),
-            'prev_easiness': card['easiness'],
-            'prev_interval': card['interval'],
-            'prev_repetitions': card['repetitions'],
-            'new_easiness': new_easiness,
-            'new_interval': new_interval,
-            'new_repetitions': new_repetitions
-        }
-        
-        logger.info(f"Recording review: {review_data}")
-        supabase.table('card_reviews').insert(review_data).execute()
+        due_queue.record_review(user_id, updated_card['deck_id'], card_id)
+        session_queues.record_review(user_id, updated_card['deck_id'], card_id)
         
         return jsonify({
             'cardId': str(updated_card['id']),
@@ -1335,6 +1096,42 @@ def review_card():
         logger.error("Exception details:", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
+@api.route('/api/reviews/batch', methods=['POST'])
+@requires_auth
+def review_cards_batch():
+    """Apply an ordered batch of reviews, e.g. from an offline study session"""
+    try:
+        data = request.get_json() or {}
+        
+        # Get user from database using Auth0 ID
+        user_id = current_user_id()
+        if not user_id:
+            logger.error(f"User not found in database for Auth0 ID: {request.user['sub']}")
+            return jsonify({'error': 'User not found in database'}), 404
+            
+        
+        try:
+            results = apply_review_batch(user_id, data.get('reviews'), client=supabase)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        for result in results:
+            if result['status'] == STATUS_APPLIED:
+                due_queue.record_review(user_id, result['deck_id'], result['card_id'])
+                session_queues.record_review(user_id, result['deck_id'], result['card_id'])
+        
+        return jsonify({
+            'results': results,
+            'applied': sum(1 for result in results if result['status'] == STATUS_APPLIED),
+            'duplicates': sum(1 for result in results if result['status'] == STATUS_DUPLICATE),
+            'rejected': sum(1 for result in results if result['status'] == STATUS_REJECTED)
+        })
+        
+    except Exception as e:
+        logger.error(f"Error applying review batch: {e}")
+        logger.error("Exception details:", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
 @api.route('/api/search-decks', methods=['GET'])
 @requires_auth
 def search_decks():
@@ -1590,65 +1387,12 @@ def get_deck_cards(deck_id):
             
         logger.info(f"User role for deck: {user_role.value}")
         
-        # Get all parts for the deck
-        parts_result = supabase.table('parts').select('*').eq('deck_id', deck_id).order('order_index').execute()
-        if not parts_result.data:
+        # Whole tree from the snapshot cache, or one embedded select on a miss
+        deck_structure = get_deck_snapshots().load(deck_id, deck.get('content_version'))
+        if not deck_structure or not deck_structure['parts']:
             logger.info(f"No parts found for deck {deck_id}")
             return jsonify([])
             
-        # Initialize the response structure
-        deck_structure = {
-            'id': deck_id,
-            'title': deck['title'],
-            'parts': []
-        }
-        
-        # For each part, get its chapters
-        for part in parts_result.data:
-            part_data = {
-                'id': part['id'],
-                'title': part['title'],
-                'chapters': []
-            }
-            
-            # Get chapters for this part
-            chapters_result = supabase.table('chapters').select('*').eq('part_id', part['id']).order('order_index').execute()
-            
-            for chapter in chapters_result.data:
-                chapter_data = {
-                    'id': chapter['id'],
-                    'title': chapter['title'],
-                    'topics': []
-                }
-                
-                # Get topics for this chapter
-                topics_result = supabase.table('topics').select('*').eq('chapter_id', chapter['id']).order('order_index').execute()
-                
-                for topic in topics_result.data:
-                    topic_data = {
-                        'id': topic['id'],
-                        'title': topic['title'],
-                        'cards': []
-                    }
-                    
-                    # Get cards for this topic
-                    cards_result = supabase.table('cards').select('*').eq('topic_id', topic['id']).execute()
-                    
-                    for card in cards_result.data:
-                        card_data = {
-                            'id': card['id'],
-                            'front': card['front'],
-                            'back': card['back'],
-                            'created_at': card['created_at']
-                        }
-                        topic_data['cards'].append(card_data)
-                    
-                    chapter_data['topics'].append(topic_data)
-                
-                part_data['chapters'].append(chapter_data)
-            
-            deck_structure['parts'].append(part_data)
-            
         logger.info(f"Successfully fetched deck structure with {len(deck_structure['parts'])} parts")
         return jsonify(deck_structure)
         
@@ -1859,6 +1603,7 @@ def delete_study_resource(resource_id):
 
 @api.route('/api/generate-resource', methods=['POST'])
 @requires_auth
+@rate_limited()
 def generate_study_resource():
     """Generate a study resource from course material using GPT"""
     try:
@@ -1922,12 +1667,12 @@ def generate_study_resource():
 def get_generation_status(generation_id):
     """Get the status of a resource generation"""
     try:
-        result = supabase.table('resource_generations').select('*').eq('id', generation_id).execute()
+        # Through the job store, which may be SQLite rather than resource_generations
+        generation = job_store.get(generation_id)
         
-        if not result.data:
+        if not generation:
             return jsonify({'error': 'Generation not found'}), 404
             
-        generation = result.data[0]
         if generation['user_id'] != request.user['sub']:
             return jsonify({'error': 'Unauthorized'}), 403
             
@@ -1937,6 +1682,47 @@ def get_generation_status(generation_id):
         logger.error(f"Error getting generation status: {e}")
         return jsonify({"error": str(e)}), 500
 
+@api.route('/api/generations/<generation_id>/retry', methods=['POST'])
+@requires_auth
+def retry_generation(generation_id):
+    """Put a failed deck generation back in the queue"""
+    try:
+        generation = job_store.get(generation_id)
+        
+        if not generation:
+            return jsonify({'error': 'Generation not found'}), 404
+            
+        if generation['user_id'] != request.user['sub']:
+            return jsonify({'error': 'Unauthorized'}), 403
+            
+        if generation['status'] != STATUS_FAILED:
+            return jsonify({'error': 'Only failed generations can be retried'}), 409
+        
+        # The failed run gave its use back, so the new one reserves another
+        denied = _reserve_deck_generation(request.user['sub'])
+        if denied:
+            return denied
+            
+        try:
+            job = job_store.retry(generation_id)
+        except Exception:
+            _refund_deck_generation(request.user['sub'])
+            raise
+        if not job:
+            _refund_deck_generation(request.user['sub'])
+            return jsonify({'error': 'Generation is no longer failed'}), 409
+            
+        return jsonify({
+            'message': 'Deck generation restarted',
+            'generation_id': job['id'],
+            'status': job['status'],
+            'status_url': f"/api/generations/{job['id']}"
+        }), 202
+        
+    except Exception as e:
+        logger.error(f"Error retrying generation: {e}")
+        return jsonify({"error": str(e)}), 500
+
 # Create subscription routes blueprint
 subscription_routes = Blueprint('subscription_routes', __name__)
 
@@ -1961,8 +1747,12 @@ def create_subscription():
         except ValueError:
             return jsonify({"error": "Invalid subscription tier"}), 400
             
+        user_id = current_user_id()
+        if not user_id:
+            return jsonify({"error": "User not found in database"}), 404
+            
         result = subscription_manager.create_subscription(
-            user_id=request.user['sub'],
+            user_id=user_id,
             tier=tier_enum,
             payment_method_id=payment_method_id
         )
@@ -2017,7 +1807,8 @@ def cancel_subscription(subscription_id):
 def get_current_subscription():
     """Get user's current subscription"""
     try:
-        subscription = subscription_manager.get_subscription(request.user['sub'])
+        user_id = current_user_id()
+        subscription = subscription_manager.get_subscription(user_id) if user_id else None
         if subscription:
             return jsonify(subscription)
         return jsonify({"tier": "free"})
@@ -2031,8 +1822,11 @@ def get_current_subscription():
 def get_subscription_features():
     """Get available features for user's subscription tier"""
     try:
-        tier = subscription_manager.get_subscription_tier(request.user['sub'])
-        features = subscription_manager.has_feature_access(request.user['sub'])
+        user_id = current_user_id()
+        if not user_id:
+            return jsonify({"error": "User not found in database"}), 404
+        tier = subscription_manager.get_subscription_tier(user_id)
+        features = subscription_manager.has_feature_access(user_id)
         return jsonify({
             "tier": tier.value,
             "features": features
@@ -12,13 +12,13 @@ import json
 import logging
 import urllib.parse
 from user_management import create_or_update_user, get_user_by_auth0_id
+from token_verification import verify_token, get_user_profile
 from api_routes import api
 from admin_routes import admin
-from datetime import datetime, timedelta
+from datetime import datetime
 from sqlalchemy import text, create_engine
 from flask_sqlalchemy import SQLAlchemy
 from models_proposed_dynamic import Users
-import threading
 
 # Configure logging first, before any other code
 logging.basicConfig(
@@ -111,38 +111,6 @@ logger.info(f"Auth0 Domain: {AUTH0_DOMAIN}")
 logger.info(f"Auth0 Client ID: {AUTH0_CLIENT_ID[:6]}...")  # Log only first 6 chars for security
 logger.info(f"Redirect URI: {REDIRECT_URI}")
 
-# Add after other global variables
-user_info_cache = {}
-cache_lock = threading.Lock()
-CACHE_DURATION = timedelta(minutes=5)
-
-def get_cached_user_info(token):
-    """Get user info from cache if available and not expired"""
-    with cache_lock:
-        if token in user_info_cache:
-            cached_data, timestamp = user_info_cache[token]
-            if datetime.now() - timestamp < CACHE_DURATION:
-                return cached_data
-        return None
-
-def set_cached_user_info(token, user_info):
-    """Cache user info with current timestamp"""
-    with cache_lock:
-        user_info_cache[token] = (user_info, datetime.now())
-        cleanup_cache()
-
-def cleanup_cache():
-    """Remove expired entries from the cache"""
-    current_time = datetime.now()
-    with cache_lock:
-        expired_tokens = [
-            token for token, (_, timestamp) in user_info_cache.items()
-            if current_time - timestamp >= CACHE_DURATION
-        ]
-        for token in expired_tokens:
-            del user_info_cache[token]
-            logger.debug(f"Removed expired cache entry for token ending in ...{token[-6:]}")
-
 def exchange_code_for_tokens(code):
     """Exchange authorization code for tokens"""
     token_url = f"https://{AUTH0_DOMAIN}/oauth/token"
@@ -256,24 +224,13 @@ def requires_auth(f):
         try:
             token = auth_header.split(' ')[1]
             
-            # Check cache first
-            cached_user_info = get_cached_user_info(token)
-            if cached_user_info:
-                request.user = cached_user_info
-                return f(*args, **kwargs)
-            
-            # If not in cache, get from Auth0
-            userinfo_url = f"https://{AUTH0_DOMAIN}/userinfo"
-            userinfo_response = requests.get(
-                userinfo_url,
-                headers={"Authorization": f"Bearer {token}"}
-            )
-            
-            if not userinfo_response.ok:
-                logger.error(f"Auth0 userinfo request failed: {userinfo_response.text}")
+            # Verify locally; /userinfo is only asked for profiles it hasn't seen recently
+            claims = verify_token(token)
+            try:
+                user_info = get_user_profile(token, claims)
+            except requests.exceptions.RequestException as e:
+                logger.error(f"Auth0 userinfo request failed: {str(e)}")
                 return jsonify({"error": "Failed to get user info from Auth0"}), 401
-                
-            user_info = userinfo_response.json()
             
             # Ensure required fields are present
             user_info.setdefault('picture', None)
@@ -281,9 +238,6 @@ def requires_auth(f):
             user_info.setdefault('email_verified', False)
             user_info.setdefault('updated_at', datetime.utcnow().isoformat())
             
-            # Cache the user info
-            set_cached_user_info(token, user_info)
-            
             # Add user info to request
             request.user = user_info
             return f(*args, **kwargs)
@@ -0,0 +1,79 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+import os
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Maximum number of topics sent to Claude at the same time
+CARD_GENERATION_CONCURRENCY = int(os.getenv('CARD_GENERATION_CONCURRENCY', '8'))
+
+def iter_topics(structure):
+    """Yield (part_idx, chapter_idx, topic_idx, topic) for every topic in a structure"""
+    for part_idx, part in enumerate(structure.get('parts', [])):
+        for chapter_idx, chapter in enumerate(part.get('chapters', [])):
+            for topic_idx, topic in enumerate(chapter.get('topics', [])):
+                yield part_idx, chapter_idx, topic_idx, topic
+
+def _generate_topic(analyzer, textbook_name, topic, on_card=None):
+    """Generate the cards for a single topic"""
+    return analyzer.generate_cards_for_topic(
+        topic['title'],
+        topic.get('comment', ''),
+        textbook_name,
+        topic.get('card_count', 3),
+        on_card=on_card
+    )
+
+def generate_cards_concurrently(analyzer, textbook_name, structure, max_workers=None, on_result=None, on_card=None):
+    """
+    Generate cards for every topic of a structure in parallel.
+
+    Args:
+        analyzer: TextbookAnalyzer (or anything with generate_cards_for_topic)
+        textbook_name: Title of the textbook
+        structure: Structure returned by generate_structure
+        max_workers: Concurrency limit, defaults to CARD_GENERATION_CONCURRENCY
+        on_result: Optional callback(key, result) called as each topic finishes
+        on_card: Optional callback(key, card) called from the worker threads
+                 as each card arrives
+
+    Returns:
+        dict: {(part_idx, chapter_idx, topic_idx): {'cards': [...], 'error': str or None}}
+              ordered by order_index regardless of completion order
+    """
+    topics = list(iter_topics(structure))
+    if not topics:
+        return {}
+
+    max_workers = max(1, min(max_workers or CARD_GENERATION_CONCURRENCY, len(topics)))
+    logger.info(f"Generating cards for {len(topics)} topics with {max_workers} workers")
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='card-gen') as executor:
+        futures = {
+            executor.submit(
+                _generate_topic,
+                analyzer,
+                textbook_name,
+                topic,
+                partial(on_card, (part_idx, chapter_idx, topic_idx)) if on_card else None
+            ): (part_idx, chapter_idx, topic_idx)
+            for part_idx, chapter_idx, topic_idx, topic in topics
+        }
+
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                result = {'cards': future.result() or [], 'error': None}
+            except Exception as e:
+                # A failing topic must not take the rest of the deck down with it
+                logger.error(f"Error generating cards for topic {key}: {e}")
+                result = {'cards': [], 'error': str(e)}
+
+            results[key] = result
+            if on_result:
+                on_result(key, result)
+
+    return {key: results[key] for key in sorted(results)}
@@ -0,0 +1,173 @@
+import logging
+import threading
+from collections import defaultdict
+from models_proposed_dynamic import SubjectCategories, SubjectSubcategories
+from supabase_config import supabase
+from textbook_analyzer import TextbookAnalyzer
+from card_generation import generate_cards_concurrently, iter_topics
+from deck_writer import DeckTree, write_deck_tree
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+def _get_or_create_subjects(analysis):
+    """Get or create the subject category and subcategories for an analysis"""
+    primary_subject = analysis.get('primary_subject', 'general')
+    subject_result = supabase.table('subject_categories').select('*').eq('name', primary_subject).execute()
+
+    if not subject_result.data:
+        subject_category = SubjectCategories(
+            name=primary_subject,
+            description=f"Primary subject category for {primary_subject}",
+            level=1
+        )
+        subject_result = supabase.table('subject_categories').insert(subject_category.to_dict()).execute()
+    main_subject_id = subject_result.data[0]['id']
+
+    subcategory_ids = []
+    for subfield in analysis.get('subfields', []):
+        subcategory_result = supabase.table('subject_subcategories').select('*').eq('name', subfield).execute()
+
+        if not subcategory_result.data:
+            subcategory = SubjectSubcategories(
+                category_id=main_subject_id,
+                name=subfield,
+                description=f"Subcategory of {primary_subject}"
+            )
+            subcategory_result = supabase.table('subject_subcategories').insert(subcategory.to_dict()).execute()
+        subcategory_ids.append(subcategory_result.data[0]['id'])
+
+    return main_subject_id, subcategory_ids
+
+def run_deck_pipeline(textbook_name, user_id, on_progress=None, analyzer=None, use_cache=True, on_event=None):
+    """
+    Run the analyze -> structure -> cards pipeline and store the deck.
+
+    The deck is assembled in memory with client-side ids as the structure and
+    cards arrive, then written in a single transaction, so a failure at any
+    point leaves no partial deck behind.
+
+    Args:
+        textbook_name: Title of the textbook
+        user_id: Owner of the generated deck
+        on_progress: Optional callback(topics_done, topics_total, tokens_used)
+        analyzer: Optional TextbookAnalyzer to use
+        use_cache: Whether repeated Claude prompts may be served from the LLM cache
+        on_event: Optional callback(event, data) for analysis, structure, deck,
+                  part, chapter, topic, card and cards events. card events are
+                  sent from the card generation threads. The ids in these
+                  events exist in the database once the pipeline returns.
+
+    Returns:
+        dict: The /api/generate-deck response payload
+    """
+    analyzer = analyzer or TextbookAnalyzer(use_cache=use_cache)
+
+    def report(topics_done, topics_total):
+        if on_progress:
+            on_progress(topics_done, topics_total, analyzer.tokens_used)
+
+    def emit(event, data):
+        if on_event:
+            on_event(event, data)
+
+    # Step 1: Analyze textbook
+    logger.info("Analyzing textbook...")
+    analysis = analyzer.analyze_textbook(textbook_name)
+    emit('analysis', analysis)
+
+    # Step 2: Generate structure
+    logger.info("Generating structure...")
+    structure = analyzer.generate_structure(textbook_name)
+    emit('structure', structure)
+    topics_total = sum(1 for _ in iter_topics(structure))
+    report(0, topics_total)
+
+    # Step 3: Lay out the deck
+    main_subject_id, subcategory_ids = _get_or_create_subjects(analysis)
+    tree = DeckTree(user_id, textbook_name, main_subject_id, subcategory_ids)
+    deck_info = {
+        'id': tree.deck_id,
+        'title': textbook_name,
+        'user_id': user_id,
+        'main_subject_id': main_subject_id,
+        'subcategory_ids': subcategory_ids
+    }
+    emit('deck', deck_info)
+
+    topic_ids = {}
+    for part_idx, part_data in enumerate(structure['parts']):
+        part = tree.add_part(part_data['title'], part_idx)
+        emit('part', {'id': part['id'], 'title': part['title'], 'order_index': part_idx})
+
+        for chapter_idx, chapter_data in enumerate(part_data['chapters']):
+            chapter = tree.add_chapter(part['id'], chapter_data['title'], chapter_idx)
+            emit('chapter', {
+                'id': chapter['id'],
+                'part_id': part['id'],
+                'title': chapter['title'],
+                'order_index': chapter_idx
+            })
+
+            for topic_idx, topic_data in enumerate(chapter_data['topics']):
+                topic = tree.add_topic(chapter['id'], topic_data['title'], topic_idx)
+                topic_ids[(part_idx, chapter_idx, topic_idx)] = topic['id']
+                emit('topic', {
+                    'id': topic['id'],
+                    'chapter_id': chapter['id'],
+                    'title': topic['title'],
+                    'order_index': topic_idx
+                })
+
+    # Step 4: Generate cards for all topics in parallel, adding each card as it streams in
+    logger.info("Generating cards...")
+    stored_cards = defaultdict(list)
+    topics_done = []
+    cards_lock = threading.Lock()
+
+    def add_card(key, card_data):
+        tree.add_card(topic_ids[key], card_data['question'], card_data['answer'])
+        card = {
+            'front': card_data['question'],
+            'back': card_data['answer']
+        }
+        with cards_lock:
+            stored_cards[key].append(card)
+        return card
+
+    def on_card(key, card_data):
+        card = add_card(key, card_data)
+        emit('card', {'topic_id': topic_ids[key], 'card': card})
+
+    def on_topic_done(key, generated):
+        topic_id = topic_ids[key]
+        if generated['error']:
+            logger.warning(f"Skipping cards for topic {topic_id}: {generated['error']}")
+
+        # Fallback cards are returned without being streamed
+        for card_data in generated['cards'][len(stored_cards[key]):]:
+            add_card(key, card_data)
+        topics_done.append(key)
+
+        report(len(topics_done), topics_total)
+        emit('cards', {
+            'topic_id': topic_id,
+            'cards': stored_cards[key],
+            'error': generated['error'],
+            'topics_done': len(topics_done),
+            'topics_total': topics_total
+        })
+
+    generate_cards_concurrently(analyzer, textbook_name, structure, on_result=on_topic_done, on_card=on_card)
+
+    # Step 5: Store the whole deck at once
+    logger.info("Creating database entries...")
+    write_deck_tree(tree)
+
+    return {
+        'message': 'Deck generated successfully',
+        'deck': deck_info,
+        'analysis': analysis,
+        'structure': structure,
+        'cards': {topic_ids[key]: stored_cards[key] for key in sorted(topics_done)}
+    }
@@ -0,0 +1,140 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Number of assembled deck trees kept per process
+DECK_SNAPSHOT_CACHE_SIZE = int(os.getenv('DECK_SNAPSHOT_CACHE_SIZE', '256'))
+
+# Whole deck in one PostgREST request using resource embedding
+DECK_TREE_SELECT = (
+    'id, title, content_version, '
+    'parts(id, title, order_index, '
+    'chapters(id, title, order_index, '
+    'topics(id, title, order_index, '
+    'cards(id, front, back, created_at))))'
+)
+
+def _by_order(rows):
+    return sorted(rows or [], key=lambda row: (row.get('order_index') is None, row.get('order_index')))
+
+def build_deck_tree(deck):
+    """Turn an embedded deck row into the /api/decks/<deck_id>/cards response"""
+    return {
+        'id': deck['id'],
+        'title': deck['title'],
+        'parts': [
+            {
+                'id': part['id'],
+                'title': part['title'],
+                'chapters': [
+                    {
+                        'id': chapter['id'],
+                        'title': chapter['title'],
+                        'topics': [
+                            {
+                                'id': topic['id'],
+                                'title': topic['title'],
+                                'cards': [
+                                    {
+                                        'id': card['id'],
+                                        'front': card['front'],
+                                        'back': card['back'],
+                                        'created_at': card['created_at']
+                                    }
+                                    for card in sorted(topic.get('cards') or [], key=lambda card: card['created_at'] or '')
+                                ]
+                            }
+                            for topic in _by_order(chapter.get('topics'))
+                        ]
+                    }
+                    for chapter in _by_order(part.get('chapters'))
+                ]
+            }
+            for part in _by_order(deck.get('parts'))
+        ]
+    }
+
+class DeckSnapshotCache:
+    """Assembled deck trees cached per deck and content_version"""
+
+    def __init__(self, client=None, max_entries=DECK_SNAPSHOT_CACHE_SIZE):
+        if client is None:
+            from supabase_config import supabase as client
+        self.supabase = client
+        self.max_entries = max_entries
+        self._snapshots = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, deck_id, version):
+        """Return the cached tree for this deck version, or None"""
+        if version is None:
+            return None
+        with self._lock:
+            entry = self._snapshots.get(deck_id)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._snapshots.move_to_end(deck_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, deck_id, version, tree):
+        # Without a version there is no way to tell when the tree goes stale
+        if version is None:
+            return
+        with self._lock:
+            current = self._snapshots.get(deck_id)
+            # Never replace a newer snapshot loaded by a concurrent request
+            if current is not None and current[0] > version:
+                return
+            self._snapshots[deck_id] = (version, tree)
+            self._snapshots.move_to_end(deck_id)
+            while len(self._snapshots) > self.max_entries:
+                self._snapshots.popitem(last=False)
+
+    def invalidate(self, deck_id):
+        """Drop the cached tree of a deck"""
+        with self._lock:
+            self._snapshots.pop(deck_id, None)
+
+    def load(self, deck_id, version):
+        """
+        Return the deck tree for a deck at the given content_version.
+
+        A cache hit costs no queries; a miss fetches the whole tree with one
+        embedded select.
+        """
+        tree = self.get(deck_id, version)
+        if tree is not None:
+            return tree
+
+        result = self.supabase.table('decks').select(DECK_TREE_SELECT).eq('id', deck_id).execute()
+        if not result.data:
+            return None
+
+        deck = result.data[0]
+        tree = build_deck_tree(deck)
+        self.put(deck_id, deck.get('content_version'), tree)
+        return tree
+
+_deck_snapshots = None
+_deck_snapshots_lock = threading.Lock()
+
+def get_deck_snapshots():
+    """Return the process-wide deck snapshot cache"""
+    global _deck_snapshots
+    with _deck_snapshots_lock:
+        if _deck_snapshots is None:
+            _deck_snapshots = DeckSnapshotCache()
+        return _deck_snapshots
+
+def invalidate_deck_snapshot(deck_id):
+    """Drop a deck's snapshot after writing to it in this process"""
+    if _deck_snapshots is not None:
+        _deck_snapshots.invalidate(deck_id)
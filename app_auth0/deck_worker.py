@@ -0,0 +1,148 @@
+import os
+import socket
+import signal
+import logging
+import argparse
+import threading
+import multiprocessing
+from dotenv import load_dotenv
+from generation_jobs import get_job_store, LEASE_SECONDS
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(processName)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+WORKER_PROCESSES = int(os.getenv('DECK_WORKER_PROCESSES', '2'))
+POLL_INTERVAL = float(os.getenv('DECK_WORKER_POLL_INTERVAL', '2'))
+
+class _Heartbeat(threading.Thread):
+    """Keeps a job's lease alive while the pipeline is busy with Claude"""
+
+    def __init__(self, store, job_id, worker_id, interval):
+        super().__init__(daemon=True)
+        self.store = store
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.interval = interval
+        self.progress = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def update(self, topics_done, topics_total, tokens_used):
+        with self.lock:
+            self.progress = {
+                'topics_done': topics_done,
+                'topics_total': topics_total,
+                'tokens_used': tokens_used
+            }
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            with self.lock:
+                progress = dict(self.progress)
+            try:
+                self.store.heartbeat(self.job_id, self.worker_id, **progress)
+            except Exception as e:
+                logger.error(f"Error sending heartbeat for job {self.job_id}: {e}")
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+def process_job(store, job, worker_id, pipeline=None):
+    """Run one claimed job to completion or failure"""
+    if pipeline is None:
+        from deck_pipeline import run_deck_pipeline as pipeline
+
+    logger.info(f"Worker {worker_id} running job {job['id']} (attempt {job['attempts']})")
+    heartbeat = _Heartbeat(store, job['id'], worker_id, max(1, LEASE_SECONDS // 4))
+    heartbeat.start()
+    try:
+        payload = job.get('payload') or {}
+        result = pipeline(
+            payload['textbook_name'],
+            job['user_id'],
+            on_progress=heartbeat.update,
+            use_cache=payload.get('use_cache', True)
+        )
+    except Exception as e:
+        heartbeat.stop()
+        logger.error(f"Job {job['id']} failed: {e}")
+        if store.fail(job['id'], worker_id, str(e)) and job['attempts'] >= job['max_attempts']:
+            _refund_usage(job)
+        return False
+
+    heartbeat.stop()
+    with heartbeat.lock:
+        progress = dict(heartbeat.progress)
+    store.heartbeat(job['id'], worker_id, **progress)
+    if not store.complete(job['id'], worker_id, result):
+        logger.warning(f"Job {job['id']} was taken over by another worker before completing")
+        return False
+    return True
+
+def _refund_usage(job):
+    """Give back the deck generation reserved when a job that failed for good was accepted"""
+    try:
+        from identity import user_id_for
+        from subscription_management import SubscriptionManager
+        # Jobs carry the Auth0 id; usage is metered against the database user
+        db_user_id = user_id_for(job['user_id'])
+        if db_user_id:
+            SubscriptionManager().refund_usage(db_user_id, 'deck_generation')
+    except Exception as e:
+        logger.error(f"Error refunding usage for job {job['id']}: {e}")
+
+def run_worker(worker_id=None, store=None, poll_interval=POLL_INTERVAL, stop_event=None):
+    """Claim and run jobs until stop_event is set, or until SIGTERM when none is given"""
+    if stop_event is None:
+        stop_event = threading.Event()
+        # Finish the current job, then leave the loop so buffered usage is flushed
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    store = store or get_job_store()
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    logger.info(f"Deck worker {worker_id} started")
+
+    while not stop_event.is_set():
+        try:
+            job = store.claim(worker_id)
+        except Exception as e:
+            logger.error(f"Error claiming job: {e}")
+            job = None
+
+        if job is None:
+            stop_event.wait(poll_interval)
+            continue
+
+        process_job(store, job, worker_id)
+
+    logger.info(f"Deck worker {worker_id} stopped")
+    # Worker processes exit without running atexit hooks
+    from usage_metering import flush_usage
+    flush_usage()
+
+def main():
+    parser = argparse.ArgumentParser(description='Run deck generation workers')
+    parser.add_argument('--processes', type=int, default=WORKER_PROCESSES)
+    args = parser.parse_args()
+
+    # Each process builds its own store and HTTP clients after it starts
+    workers = [
+        multiprocessing.Process(target=run_worker, name=f'deck-worker-{i}')
+        for i in range(args.processes)
+    ]
+    for worker in workers:
+        worker.start()
+    # Pass a stop on to the workers and wait for them to flush
+    signal.signal(signal.SIGTERM, lambda signum, frame: [worker.terminate() for worker in workers])
+    for worker in workers:
+        worker.join()
+
+if __name__ == "__main__":
+    main()
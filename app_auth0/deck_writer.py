@@ -0,0 +1,116 @@
+import uuid
+import logging
+import threading
+from datetime import datetime
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class DeckTree:
+    """A generated deck held in memory until it is written in one transaction"""
+
+    def __init__(self, user_id, title, main_subject_id=None, subcategory_ids=None):
+        self.now = datetime.utcnow().isoformat()
+        self.deck = {
+            'id': str(uuid.uuid4()),
+            'user_id': user_id,
+            'title': title,
+            'created_at': self.now,
+            'is_active': True,
+            'last_modified': self.now,
+            'main_subject_id': main_subject_id,
+            'subcategory_ids': subcategory_ids or []
+        }
+        self.parts = []
+        self.chapters = []
+        self.topics = []
+        self.cards = []
+        self._lock = threading.Lock()
+
+    @property
+    def deck_id(self):
+        return self.deck['id']
+
+    def add_part(self, title, order_index):
+        """Add a part to the deck and return its row"""
+        part = {
+            'id': str(uuid.uuid4()),
+            'deck_id': self.deck_id,
+            'title': title,
+            'order_index': order_index,
+            'is_active': True,
+            'last_modified': self.now
+        }
+        self.parts.append(part)
+        return part
+
+    def add_chapter(self, part_id, title, order_index):
+        """Add a chapter under a part and return its row"""
+        chapter = {
+            'id': str(uuid.uuid4()),
+            'part_id': part_id,
+            'title': title,
+            'order_index': order_index,
+            'is_active': True,
+            'last_modified': self.now
+        }
+        self.chapters.append(chapter)
+        return chapter
+
+    def add_topic(self, chapter_id, title, order_index):
+        """Add a topic under a chapter and return its row"""
+        topic = {
+            'id': str(uuid.uuid4()),
+            'chapter_id': chapter_id,
+            'title': title,
+            'order_index': order_index,
+            'is_active': True,
+            'last_modified': self.now
+        }
+        self.topics.append(topic)
+        return topic
+
+    def add_card(self, topic_id, front, back):
+        """Add a card under a topic; safe to call from several threads"""
+        card = {
+            'id': str(uuid.uuid4()),
+            'deck_id': self.deck_id,
+            'topic_id': topic_id,
+            'front': front,
+            'back': back,
+            'is_active': True,
+            'last_modified': self.now
+        }
+        with self._lock:
+            self.cards.append(card)
+        return card
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'deck': self.deck,
+                'parts': list(self.parts),
+                'chapters': list(self.chapters),
+                'topics': list(self.topics),
+                'cards': list(self.cards)
+            }
+
+def write_deck_tree(tree, client=None):
+    """
+    Insert a whole deck in one round trip and one transaction.
+
+    insert_deck_tree() either stores the deck with every part, chapter,
+    topic and card or raises and stores nothing.
+    """
+    if client is None:
+        from supabase_config import supabase as client
+
+    payload = tree.to_dict()
+    logger.info(
+        f"Writing deck {tree.deck_id}: {len(payload['parts'])} parts, {len(payload['chapters'])} chapters, "
+        f"{len(payload['topics'])} topics, {len(payload['cards'])} cards"
+    )
+    result = client.rpc('insert_deck_tree', {'p_tree': payload}).execute()
+    if result.data is None:
+        raise Exception("Failed to create deck")
+    return tree.deck_id
@@ -0,0 +1,151 @@
+import os
+import time
+import heapq
+import logging
+import threading
+from datetime import datetime, timezone
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Cards returned per request, and the daily caps per user and deck
+DUE_QUEUE_LIMIT = int(os.getenv('DUE_QUEUE_LIMIT', '50'))
+DAILY_REVIEW_CAP = int(os.getenv('DAILY_REVIEW_CAP', '200'))
+DAILY_NEW_CARD_CAP = int(os.getenv('DAILY_NEW_CARD_CAP', '20'))
+
+# The in-process queue cache is off by default: with several workers a review
+# handled by another process is only seen once the cached queue expires
+DUE_QUEUE_CACHE_ENABLED = os.getenv('DUE_QUEUE_CACHE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+DUE_QUEUE_CACHE_TTL_SECONDS = int(os.getenv('DUE_QUEUE_CACHE_TTL_SECONDS', '300'))
+# Cards fetched ahead when filling the cache
+DUE_QUEUE_WINDOW = int(os.getenv('DUE_QUEUE_WINDOW', '200'))
+
+def day_start(now):
+    """Midnight UTC of the day containing now"""
+    return now.astimezone(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+
+def _parse_time(value):
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+class _CachedQueue:
+    """One user's queue for one deck: a min-heap of due reviews plus new cards in order"""
+
+    def __init__(self, rows, complete, day, expires_at):
+        self.reviews = {}
+        self.heap = []
+        self.new_cards = []
+        for row in rows:
+            if row['is_new']:
+                self.new_cards.append(row)
+            else:
+                self.reviews[row['id']] = row
+                self.heap.append((_parse_time(row['next_review']), row['id']))
+        heapq.heapify(self.heap)
+        # False when the window was full, so more cards may be waiting in the database
+        self.complete = complete
+        self.day = day
+        self.expires_at = expires_at
+
+    def take(self, limit):
+        due = [self.reviews[card_id] for _, card_id in heapq.nsmallest(limit, self.heap)]
+        return due + self.new_cards[:limit - len(due)]
+
+    def remove(self, card_id):
+        if self.reviews.pop(card_id, None) is not None:
+            self.heap = [entry for entry in self.heap if entry[1] != card_id]
+            heapq.heapify(self.heap)
+            return
+        self.new_cards = [card for card in self.new_cards if card['id'] != card_id]
+
+    def size(self):
+        return len(self.heap) + len(self.new_cards)
+
+class DueQueue:
+    """
+    Per-user study queue: the most overdue reviews first, then new cards,
+    within the user's daily review and new-card caps.
+    """
+
+    def __init__(self, client=None, review_cap=DAILY_REVIEW_CAP, new_cap=DAILY_NEW_CARD_CAP,
+                 use_cache=DUE_QUEUE_CACHE_ENABLED, window=DUE_QUEUE_WINDOW,
+                 ttl_seconds=DUE_QUEUE_CACHE_TTL_SECONDS):
+        if client is None:
+            from supabase_config import supabase as client
+        self.supabase = client
+        self.review_cap = review_cap
+        self.new_cap = new_cap
+        self.use_cache = use_cache
+        self.window = window
+        self.ttl_seconds = ttl_seconds
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def fetch(self, user_id, deck_id, limit, now=None):
+        """Query the queue with a single RPC"""
+        now = now or datetime.now(timezone.utc)
+        result = self.supabase.rpc('get_due_queue', {
+            'p_user_id': user_id,
+            'p_deck_id': deck_id,
+            'p_now': now.isoformat(),
+            'p_day_start': day_start(now).isoformat(),
+            'p_limit': limit,
+            'p_review_cap': self.review_cap,
+            'p_new_cap': self.new_cap
+        }).execute()
+        return result.data or []
+
+    def get(self, user_id, deck_id, limit=DUE_QUEUE_LIMIT, now=None):
+        """Return up to limit cards to study, most overdue first"""
+        if not self.use_cache:
+            return self.fetch(user_id, deck_id, limit, now)
+
+        now = now or datetime.now(timezone.utc)
+        key = (user_id, deck_id)
+        with self._lock:
+            queue = self._queues.get(key)
+            if queue is not None and (
+                queue.expires_at <= time.monotonic()
+                or queue.day != day_start(now)
+                or (queue.size() < limit and not queue.complete)
+            ):
+                queue = None
+            if queue is not None:
+                return queue.take(limit)
+
+        window = max(limit, self.window)
+        rows = self.fetch(user_id, deck_id, window, now)
+        queue = _CachedQueue(rows, len(rows) < window, day_start(now), time.monotonic() + self.ttl_seconds)
+        with self._lock:
+            self._queues[key] = queue
+            return queue.take(limit)
+
+    def record_review(self, user_id, deck_id, card_id):
+        """
+        Drop a reviewed card from the cached queue.
+
+        SM-2 never schedules a card less than a day ahead, so a reviewed card
+        can't be due again before the cached queue is rebuilt.
+        """
+        with self._lock:
+            queue = self._queues.get((user_id, deck_id))
+            if queue is not None:
+                queue.remove(card_id)
+
+    def invalidate(self, deck_id):
+        """Forget every cached queue of a deck after its cards change"""
+        with self._lock:
+            for key in [key for key in self._queues if key[1] == deck_id]:
+                del self._queues[key]
+
+_due_queue = None
+_due_queue_lock = threading.Lock()
+
+def get_due_queue():
+    """Return the process-wide due queue"""
+    global _due_queue
+    with _due_queue_lock:
+        if _due_queue is None:
+            _due_queue = DueQueue()
+        return _due_queue
@@ -0,0 +1,289 @@
+import os
+import json
+import uuid
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timedelta
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Job statuses stored in resource_generations.status
+STATUS_PENDING = 'pending'
+STATUS_RUNNING = 'running'
+STATUS_COMPLETED = 'completed'
+STATUS_FAILED = 'failed'
+
+DECK_GENERATION_TYPE = 'deck'
+
+# A running job whose heartbeat is older than this is considered abandoned
+LEASE_SECONDS = int(os.getenv('GENERATION_JOB_LEASE_SECONDS', '120'))
+MAX_ATTEMPTS = int(os.getenv('GENERATION_JOB_MAX_ATTEMPTS', '3'))
+
+def _now():
+    return datetime.utcnow().isoformat()
+
+class SupabaseJobStore:
+    """Deck generation jobs stored in the resource_generations table"""
+
+    def __init__(self, client=None, lease_seconds=LEASE_SECONDS):
+        if client is None:
+            from supabase_config import supabase as client
+        self.supabase = client
+        self.lease_seconds = lease_seconds
+
+    def enqueue(self, user_id, payload, max_attempts=MAX_ATTEMPTS):
+        """Create a pending deck generation job"""
+        job = {
+            'id': str(uuid.uuid4()),
+            'user_id': user_id,
+            'status': STATUS_PENDING,
+            'generation_type': DECK_GENERATION_TYPE,
+            'prompt': payload.get('textbook_name', ''),
+            'payload': payload,
+            'topics_done': 0,
+            'topics_total': 0,
+            'tokens_used': 0,
+            'attempts': 0,
+            'max_attempts': max_attempts,
+            'created_at': _now(),
+            'updated_at': _now()
+        }
+        result = self.supabase.table('resource_generations').insert(job).execute()
+        return result.data[0]
+
+    def get(self, job_id):
+        """Get a job by id"""
+        result = self.supabase.table('resource_generations').select('*').eq('id', job_id).execute()
+        return result.data[0] if result.data else None
+
+    def claim(self, worker_id):
+        """Atomically take the oldest pending or abandoned job, or None"""
+        result = self.supabase.rpc('claim_generation_job', {
+            'p_worker_id': worker_id,
+            'p_generation_type': DECK_GENERATION_TYPE,
+            'p_lease_seconds': self.lease_seconds
+        }).execute()
+        return result.data[0] if result.data else None
+
+    def _update_owned(self, job_id, worker_id, data):
+        """Update a job only while this worker still holds it"""
+        data['updated_at'] = _now()
+        result = self.supabase.table('resource_generations').update(data).eq(
+            'id', job_id
+        ).eq('locked_by', worker_id).eq('status', STATUS_RUNNING).execute()
+        return bool(result.data)
+
+    def heartbeat(self, job_id, worker_id, topics_done=None, topics_total=None, tokens_used=None):
+        """Extend the lease of a running job and record its progress"""
+        data = {'heartbeat_at': _now()}
+        if topics_done is not None:
+            data['topics_done'] = topics_done
+        if topics_total is not None:
+            data['topics_total'] = topics_total
+        if tokens_used is not None:
+            data['tokens_used'] = tokens_used
+        return self._update_owned(job_id, worker_id, data)
+
+    def complete(self, job_id, worker_id, result):
+        """Mark a job as completed with its result"""
+        return self._update_owned(job_id, worker_id, {
+            'status': STATUS_COMPLETED,
+            'result': result,
+            'error': None,
+            'finished_at': _now()
+        })
+
+    def fail(self, job_id, worker_id, error):
+        """Release a failed job for another attempt, or fail it for good"""
+        job = self.get(job_id)
+        if not job:
+            return False
+        exhausted = job['attempts'] >= job['max_attempts']
+        return self._update_owned(job_id, worker_id, {
+            'status': STATUS_FAILED if exhausted else STATUS_PENDING,
+            'error': error,
+            'locked_by': worker_id if exhausted else None,
+            'finished_at': _now() if exhausted else None
+        })
+
+    def retry(self, job_id):
+        """Put a failed job back in the queue with a fresh attempt budget"""
+        result = self.supabase.table('resource_generations').update({
+            'status': STATUS_PENDING,
+            'attempts': 0,
+            'error': None,
+            'locked_by': None,
+            'finished_at': None,
+            'updated_at': _now()
+        }).eq('id', job_id).eq('status', STATUS_FAILED).execute()
+        return result.data[0] if result.data else None
+
+class SQLiteJobStore:
+    """Local stand-in for SupabaseJobStore backed by a SQLite file"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS resource_generations (
+            id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            resource_id TEXT,
+            status TEXT NOT NULL,
+            generation_type TEXT NOT NULL,
+            prompt TEXT NOT NULL,
+            payload TEXT,
+            result TEXT,
+            error TEXT,
+            topics_done INTEGER DEFAULT 0,
+            topics_total INTEGER DEFAULT 0,
+            tokens_used INTEGER DEFAULT 0,
+            attempts INTEGER DEFAULT 0,
+            max_attempts INTEGER DEFAULT 3,
+            locked_by TEXT,
+            heartbeat_at TEXT,
+            started_at TEXT,
+            finished_at TEXT,
+            created_at TEXT,
+            updated_at TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_resource_generations_queue
+            ON resource_generations(generation_type, status, created_at);
+    """
+
+    def __init__(self, path, lease_seconds=LEASE_SECONDS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(self.SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def _row(self, row):
+        if row is None:
+            return None
+        job = dict(row)
+        for key in ('payload', 'result'):
+            if job[key] is not None:
+                job[key] = json.loads(job[key])
+        return job
+
+    def enqueue(self, user_id, payload, max_attempts=MAX_ATTEMPTS):
+        """Create a pending deck generation job"""
+        job_id = str(uuid.uuid4())
+        conn = self._connect()
+        conn.execute(
+            """INSERT INTO resource_generations
+               (id, user_id, status, generation_type, prompt, payload, max_attempts, created_at, updated_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (job_id, user_id, STATUS_PENDING, DECK_GENERATION_TYPE, payload.get('textbook_name', ''),
+             json.dumps(payload), max_attempts, _now(), _now())
+        )
+        return self.get(job_id)
+
+    def get(self, job_id):
+        """Get a job by id"""
+        row = self._connect().execute('SELECT * FROM resource_generations WHERE id = ?', (job_id,)).fetchone()
+        return self._row(row)
+
+    def claim(self, worker_id):
+        """Atomically take the oldest pending or abandoned job, or None"""
+        conn = self._connect()
+        stale_before = (datetime.utcnow() - timedelta(seconds=self.lease_seconds)).isoformat()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Abandoned jobs that already used every attempt are failed instead of retried
+            conn.execute(
+                """UPDATE resource_generations
+                   SET status = ?, error = 'Worker lost while running job', finished_at = ?, updated_at = ?
+                   WHERE generation_type = ? AND status = ? AND heartbeat_at < ? AND attempts >= max_attempts""",
+                (STATUS_FAILED, _now(), _now(), DECK_GENERATION_TYPE, STATUS_RUNNING, stale_before)
+            )
+            row = conn.execute(
+                """SELECT id FROM resource_generations
+                   WHERE generation_type = ? AND attempts < max_attempts
+                     AND (status = ? OR (status = ? AND heartbeat_at < ?))
+                   ORDER BY created_at LIMIT 1""",
+                (DECK_GENERATION_TYPE, STATUS_PENDING, STATUS_RUNNING, stale_before)
+            ).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+            conn.execute(
+                """UPDATE resource_generations
+                   SET status = ?, locked_by = ?, heartbeat_at = ?, attempts = attempts + 1,
+                       started_at = COALESCE(started_at, ?), updated_at = ?
+                   WHERE id = ?""",
+                (STATUS_RUNNING, worker_id, _now(), _now(), _now(), row['id'])
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return self.get(row['id'])
+
+    def _update_owned(self, job_id, worker_id, data):
+        data['updated_at'] = _now()
+        columns = ', '.join(f'{key} = ?' for key in data)
+        values = [json.dumps(v) if key in ('payload', 'result') and v is not None else v for key, v in data.items()]
+        cursor = self._connect().execute(
+            f'UPDATE resource_generations SET {columns} WHERE id = ? AND locked_by = ? AND status = ?',
+            values + [job_id, worker_id, STATUS_RUNNING]
+        )
+        return cursor.rowcount > 0
+
+    def heartbeat(self, job_id, worker_id, topics_done=None, topics_total=None, tokens_used=None):
+        """Extend the lease of a running job and record its progress"""
+        data = {'heartbeat_at': _now()}
+        if topics_done is not None:
+            data['topics_done'] = topics_done
+        if topics_total is not None:
+            data['topics_total'] = topics_total
+        if tokens_used is not None:
+            data['tokens_used'] = tokens_used
+        return self._update_owned(job_id, worker_id, data)
+
+    def complete(self, job_id, worker_id, result):
+        """Mark a job as completed with its result"""
+        return self._update_owned(job_id, worker_id, {
+            'status': STATUS_COMPLETED,
+            'result': result,
+            'error': None,
+            'finished_at': _now()
+        })
+
+    def fail(self, job_id, worker_id, error):
+        """Release a failed job for another attempt, or fail it for good"""
+        job = self.get(job_id)
+        if not job:
+            return False
+        exhausted = job['attempts'] >= job['max_attempts']
+        return self._update_owned(job_id, worker_id, {
+            'status': STATUS_FAILED if exhausted else STATUS_PENDING,
+            'error': error,
+            'locked_by': worker_id if exhausted else None,
+            'finished_at': _now() if exhausted else None
+        })
+
+    def retry(self, job_id):
+        """Put a failed job back in the queue with a fresh attempt budget"""
+        cursor = self._connect().execute(
+            """UPDATE resource_generations
+               SET status = ?, attempts = 0, error = NULL, locked_by = NULL, finished_at = NULL, updated_at = ?
+               WHERE id = ? AND status = ?""",
+            (STATUS_PENDING, _now(), job_id, STATUS_FAILED)
+        )
+        return self.get(job_id) if cursor.rowcount else None
+
+def get_job_store():
+    """Return the job store configured by GENERATION_JOB_STORE"""
+    location = os.getenv('GENERATION_JOB_STORE', 'supabase')
+    if location.startswith('sqlite:///'):
+        return SQLiteJobStore(location[len('sqlite:///'):])
+    return SupabaseJobStore()
@@ -0,0 +1,71 @@
+"""
+Request identity.
+
+Routes know the caller by their Auth0 id (request.user['sub']), while the
+database keys everything on the users row id. current_user_id() resolves
+it once per request and keeps it on flask.g, backed by a process-wide TTL
+cache, so the decorators and the route of one request share one lookup
+and most requests need none.
+
+Only hits are cached. user_management.create_or_update_user drops a
+user's entry whenever it writes their row, so a row deleted and created
+again is seen at the next login; the admin update route drops the cache
+when it reassigns an auth0_id, and the TTL bounds anything done by hand.
+"""
+import os
+import logging
+from flask import g, has_request_context, request
+from ttl_cache import TTLCache
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+USER_CACHE_TTL_SECONDS = int(os.getenv('USER_CACHE_TTL_SECONDS', '300'))
+USER_CACHE_MAX_ENTRIES = int(os.getenv('USER_CACHE_MAX_ENTRIES', '50000'))
+
+_user_ids = TTLCache(USER_CACHE_TTL_SECONDS, max_entries=USER_CACHE_MAX_ENTRIES)
+
+def _load_user_id(auth0_id, client):
+    if client is None:
+        from supabase_config import supabase as client
+    result = client.table('users').select('id').eq('auth0_id', auth0_id).execute()
+    return result.data[0]['id'] if result.data else None
+
+def _is_caller(auth0_id):
+    return has_request_context() and (getattr(request, 'user', None) or {}).get('sub') == auth0_id
+
+def user_id_for(auth0_id, client=None):
+    """
+    Database id of the user with this Auth0 id, or None if they have no
+    users row yet. Misses aren't cached, so a new signup is found on
+    their next request.
+    """
+    if not auth0_id:
+        return None
+    caller = _is_caller(auth0_id)
+    if caller and 'identity_user_id' in g:
+        return g.identity_user_id
+
+    user_id = _user_ids.get(auth0_id)
+    if user_id is None:
+        user_id = _load_user_id(auth0_id, client)
+        if user_id is not None:
+            _user_ids.set(auth0_id, user_id)
+
+    if caller:
+        g.identity_user_id = user_id
+    return user_id
+
+def current_user_id(client=None):
+    """Database id of the authenticated caller, resolved once per request"""
+    return user_id_for(request.user['sub'], client)
+
+def invalidate_user(auth0_id):
+    """Forget the cached id after the user's row was written"""
+    _user_ids.invalidate(auth0_id)
+    if _is_caller(auth0_id):
+        g.pop('identity_user_id', None)
+
+def invalidate_all_users():
+    """Forget every cached id, e.g. after an auth0_id was reassigned"""
+    _user_ids.clear()
@@ -0,0 +1,72 @@
+import json
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class JSONArrayStream:
+    """
+    Incremental parser for a streamed JSON array of objects.
+
+    Text is fed in arbitrary chunks (code fences and prose around the array
+    are skipped) and every object is returned as soon as its closing brace
+    arrives, so a reply cut off mid-array still yields its complete objects.
+    """
+
+    def __init__(self):
+        self.started = False
+        self.finished = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._element = []
+
+    def feed(self, text):
+        """Consume a chunk of text and return the objects it completed"""
+        completed = []
+        for ch in text:
+            if self.finished:
+                break
+
+            if not self.started:
+                if ch == '[':
+                    self.started = True
+                    self._depth = 1
+                continue
+
+            if self._depth == 1:
+                # Between elements of the top-level array
+                if ch == '{':
+                    self._element = [ch]
+                    self._depth = 2
+                elif ch == ']':
+                    self.finished = True
+                continue
+
+            self._element.append(ch)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in '{[':
+                self._depth += 1
+            elif ch in '}]':
+                self._depth -= 1
+                if self._depth == 1:
+                    element = ''.join(self._element)
+                    self._element = []
+                    try:
+                        completed.append(json.loads(element))
+                    except ValueError as e:
+                        logger.warning(f"Skipping malformed array element: {e}")
+        return completed
+
+    @property
+    def truncated(self):
+        """True if the array was opened but never closed"""
+        return self.started and not self.finished
@@ -1,11 +1,11 @@
 from functools import wraps
 from flask import request, jsonify
 import jwt
-from jwt.algorithms import RSAAlgorithm
 import requests
 import os
 from dotenv import load_dotenv
 import logging
+from token_verification import verify_token, get_bearer_token
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -31,55 +31,36 @@ def get_auth0_public_key():
 
 def get_token_auth_header():
     """Obtains the Access Token from the Authorization Header"""
-    auth = request.headers.get("Authorization", None)
-    if not auth:
-        return None
+    return get_bearer_token(request.headers.get("Authorization", None))
 
-    parts = auth.split()
-    if parts[0].lower() != "bearer":
-        return None
-    elif len(parts) == 1:
-        return None
-    elif len(parts) > 2:
-        return None
+def _verify_request_token():
+    """Verify the bearer token of the current request and return (claims, error response)"""
+    token = get_token_auth_header()
+    if not token:
+        return None, (jsonify({"error": "No authorization token provided"}), 401)
 
-    return parts[1]
+    try:
+        return verify_token(token), None
+    except jwt.ExpiredSignatureError:
+        return None, (jsonify({"error": "Token has expired"}), 401)
+    except (jwt.InvalidAudienceError, jwt.InvalidIssuerError, jwt.MissingRequiredClaimError) as e:
+        logger.error(f"JWT Claims Error: {str(e)}")
+        return None, (jsonify({"error": "Invalid claims"}), 401)
+    except Exception as e:
+        logger.error(f"Error verifying token: {str(e)}")
+        return None, (jsonify({"error": "Invalid token"}), 401)
 
 def requires_auth(f):
     """Decorator to require authentication for routes"""
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = get_token_auth_header()
-        if not token:
-            return jsonify({"error": "No authorization token provided"}), 401
-
-        try:
-            # Get Auth0 public key
-            jwks_url = f'https://{AUTH0_DOMAIN}/.well-known/jwks.json'
-            jwks_client = jwt.PyJWKClient(jwks_url)
-            signing_key = jwks_client.get_signing_key_from_jwt(token)
-
-            # Verify the token
-            payload = jwt.decode(
-                token,
-                signing_key.key,
-                algorithms=["RS256"],
-                audience=AUTH0_AUDIENCE,
-                issuer=f"https://{AUTH0_DOMAIN}/"
-            )
-
-            # Add user info to request
-            request.user = payload
-            return f(*args, **kwargs)
+        payload, error = _verify_request_token()
+        if error:
+            return error
 
-        except jwt.ExpiredSignatureError:
-            return jsonify({"error": "Token has expired"}), 401
-        except jwt.JWTClaimsError as e:
-            logger.error(f"JWT Claims Error: {str(e)}")
-            return jsonify({"error": "Invalid claims"}), 401
-        except Exception as e:
-            logger.error(f"Error verifying token: {str(e)}")
-            return jsonify({"error": "Invalid token"}), 401
+        # Add user info to request
+        request.user = payload
+        return f(*args, **kwargs)
 
     return decorated
 
@@ -88,42 +69,18 @@ def requires_scope(required_scope):
     def decorator(f):
         @wraps(f)
         def decorated(*args, **kwargs):
-            token = get_token_auth_header()
-            if not token:
-                return jsonify({"error": "No authorization token provided"}), 401
-
-            try:
-                # Get Auth0 public key
-                jwks_url = f'https://{AUTH0_DOMAIN}/.well-known/jwks.json'
-                jwks_client = jwt.PyJWKClient(jwks_url)
-                signing_key = jwks_client.get_signing_key_from_jwt(token)
-
-                # Verify the token
-                payload = jwt.decode(
-                    token,
-                    signing_key.key,
-                    algorithms=["RS256"],
-                    audience=AUTH0_AUDIENCE,
-                    issuer=f"https://{AUTH0_DOMAIN}/"
-                )
-
-                # Check for required scope
-                token_scopes = payload.get("scope", "").split()
-                if required_scope not in token_scopes:
-                    return jsonify({"error": f"Required scope '{required_scope}' not found"}), 403
+            payload, error = _verify_request_token()
+            if error:
+                return error
 
-                # Add user info to request
-                request.user = payload
-                return f(*args, **kwargs)
+            # Check for required scope
+            token_scopes = payload.get("scope", "").split()
+            if required_scope not in token_scopes:
+                return jsonify({"error": f"Required scope '{required_scope}' not found"}), 403
 
-            except jwt.ExpiredSignatureError:
-                return jsonify({"error": "Token has expired"}), 401
-            except jwt.JWTClaimsError as e:
-                logger.error(f"JWT Claims Error: {str(e)}")
-                return jsonify({"error": "Invalid claims"}), 401
-            except Exception as e:
-                logger.error(f"Error verifying token: {str(e)}")
-                return jsonify({"error": "Invalid token"}), 401
+            # Add user info to request
+            request.user = payload
+            return f(*args, **kwargs)
 
         return decorated
-    return decorator 
\ No newline at end of file
+    return decorator
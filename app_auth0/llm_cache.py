@@ -0,0 +1,178 @@
+import os
+import time
+import zlib
+import json
+import sqlite3
+import hashlib
+import logging
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', 'true').lower() == 'true'
+LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'llm_cache.db'))
+LLM_CACHE_TTL_SECONDS = int(os.getenv('LLM_CACHE_TTL_SECONDS', str(30 * 24 * 3600)))
+LLM_CACHE_MAX_BYTES = int(os.getenv('LLM_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+
+def cache_key(model, system, prompt, temperature):
+    """Hash the inputs that determine a Claude response"""
+    material = json.dumps([model, system, prompt, temperature], ensure_ascii=False)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+def _compress(text):
+    data = text.encode('utf-8')
+    if zstandard is not None:
+        return 'zstd', zstandard.ZstdCompressor(level=6).compress(data)
+    return 'zlib', zlib.compress(data, 6)
+
+def _decompress(codec, blob):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ValueError("zstandard is required to read this cache entry")
+        return zstandard.ZstdDecompressor().decompress(blob).decode('utf-8')
+    return zlib.decompress(blob).decode('utf-8')
+
+class LLMCache:
+    """Compressed Claude responses in SQLite with TTL and LRU size eviction"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS llm_responses (
+            key TEXT PRIMARY KEY,
+            codec TEXT NOT NULL,
+            body BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            accessed_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_llm_responses_accessed ON llm_responses(accessed_at);
+    """
+
+    def __init__(self, path=LLM_CACHE_PATH, ttl_seconds=LLM_CACHE_TTL_SECONDS, max_bytes=LLM_CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._stats_lock = threading.Lock()
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(self.SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def get(self, key):
+        """Return the cached response text for key, or None"""
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute('SELECT codec, body, created_at FROM llm_responses WHERE key = ?', (key,)).fetchone()
+
+        if row is None:
+            self._count('misses')
+            return None
+
+        codec, body, created_at = row
+        if now - created_at > self.ttl_seconds:
+            conn.execute('DELETE FROM llm_responses WHERE key = ?', (key,))
+            self._count('misses')
+            return None
+
+        try:
+            text = _decompress(codec, body)
+        except Exception as e:
+            logger.error(f"Error reading LLM cache entry {key}: {e}")
+            self._count('misses')
+            return None
+
+        conn.execute('UPDATE llm_responses SET accessed_at = ? WHERE key = ?', (now, key))
+        self._count('hits')
+        return text
+
+    def put(self, key, text):
+        """Store a response and evict least recently used entries over the size cap"""
+        codec, body = _compress(text)
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            """INSERT OR REPLACE INTO llm_responses (key, codec, body, size, created_at, accessed_at)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            (key, codec, body, len(body), now, now)
+        )
+        self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            expired = conn.execute(
+                'DELETE FROM llm_responses WHERE created_at < ?', (now - self.ttl_seconds,)
+            ).rowcount
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM llm_responses').fetchone()[0]
+            evicted = 0
+            if total > self.max_bytes:
+                for key, size in conn.execute(
+                    'SELECT key, size FROM llm_responses ORDER BY accessed_at'
+                ).fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    conn.execute('DELETE FROM llm_responses WHERE key = ?', (key,))
+                    total -= size
+                    evicted += 1
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        if expired or evicted:
+            self._count('evictions', expired + evicted)
+
+    def clear(self):
+        """Remove every cached response"""
+        self._connect().execute('DELETE FROM llm_responses')
+
+    def stats(self):
+        """Return hit/miss/eviction counters and the cache size"""
+        entries, size = self._connect().execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_responses'
+        ).fetchone()
+        with self._stats_lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': entries,
+                'bytes': size
+            }
+
+_llm_cache = None
+_llm_cache_lock = threading.Lock()
+
+def get_llm_cache():
+    """Return the process-wide LLM cache, or None when caching is disabled"""
+    global _llm_cache
+    if not LLM_CACHE_ENABLED:
+        return None
+    with _llm_cache_lock:
+        if _llm_cache is None:
+            try:
+                _llm_cache = LLMCache()
+            except Exception as e:
+                logger.error(f"Error opening LLM cache: {e}")
+                return None
+        return _llm_cache
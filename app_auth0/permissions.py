@@ -21,6 +21,9 @@ if not SUPABASE_URL or not SUPABASE_SERVICE_KEY:
 
 supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
 
+# Deck nodes and the table holding them
+NODE_TABLES = {'part': 'parts', 'chapter': 'chapters', 'topic': 'topics', 'card': 'cards'}
+
 def get_user_permissions(user_id, resource_type, resource_id):
     """Get user's permissions for a specific resource"""
     try:
@@ -53,46 +56,12 @@ def get_user_permissions(user_id, resource_type, resource_id):
             
             return {'owner': False, 'can_edit': False, 'can_share': False, 'can_delete': False}
             
-        elif resource_type in ['part', 'chapter', 'topic', 'card']:
-            # Get the parent deck ID
-            if resource_type == 'part':
-                part_result = supabase.table('parts').select('deck_id').eq('id', resource_id).execute()
-                if not part_result.data:
-                    return None
-                deck_id = part_result.data[0]['deck_id']
-            elif resource_type == 'chapter':
-                chapter_result = supabase.table('chapters').select('part_id').eq('id', resource_id).execute()
-                if not chapter_result.data:
-                    return None
-                part_result = supabase.table('parts').select('deck_id').eq('id', chapter_result.data[0]['part_id']).execute()
-                if not part_result.data:
-                    return None
-                deck_id = part_result.data[0]['deck_id']
-            elif resource_type == 'topic':
-                topic_result = supabase.table('topics').select('chapter_id').eq('id', resource_id).execute()
-                if not topic_result.data:
-                    return None
-                chapter_result = supabase.table('chapters').select('part_id').eq('id', topic_result.data[0]['chapter_id']).execute()
-                if not chapter_result.data:
-                    return None
-                part_result = supabase.table('parts').select('deck_id').eq('id', chapter_result.data[0]['part_id']).execute()
-                if not part_result.data:
-                    return None
-                deck_id = part_result.data[0]['deck_id']
-            else:  # card
-                card_result = supabase.table('cards').select('topic_id').eq('id', resource_id).execute()
-                if not card_result.data:
-                    return None
-                topic_result = supabase.table('topics').select('chapter_id').eq('id', card_result.data[0]['topic_id']).execute()
-                if not topic_result.data:
-                    return None
-                chapter_result = supabase.table('chapters').select('part_id').eq('id', topic_result.data[0]['chapter_id']).execute()
-                if not chapter_result.data:
-                    return None
-                part_result = supabase.table('parts').select('deck_id').eq('id', chapter_result.data[0]['part_id']).execute()
-                if not part_result.data:
-                    return None
-                deck_id = part_result.data[0]['deck_id']
+        elif resource_type in NODE_TABLES:
+            # Every node carries its deck_id, so the parent deck is one read away
+            node_result = supabase.table(NODE_TABLES[resource_type]).select('deck_id').eq('id', resource_id).execute()
+            if not node_result.data:
+                return None
+            deck_id = node_result.data[0]['deck_id']
             
             # Get permissions for the parent deck
             return get_user_permissions(user_id, 'deck', deck_id)
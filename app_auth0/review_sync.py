@@ -0,0 +1,243 @@
+import os
+import uuid
+import logging
+from datetime import date, datetime, timedelta, timezone
+
+from study.sm2 import sm2_step, AUTH0
+from study.load_balancer import balance_interval, fuzz_days, LOAD_BALANCE_ENABLED
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Largest number of reviews accepted in one sync request
+MAX_REVIEW_BATCH_SIZE = int(os.getenv('MAX_REVIEW_BATCH_SIZE', '500'))
+# How many times reviews of cards changed by a concurrent review are computed again
+MAX_REVIEW_CONFLICT_RETRIES = int(os.getenv('MAX_REVIEW_CONFLICT_RETRIES', '2'))
+# Ids sent per lookup; PostgREST takes them in the query string, so a full
+# batch in one request would make a URL of tens of kilobytes
+REVIEW_LOOKUP_CHUNK_SIZE = int(os.getenv('REVIEW_LOOKUP_CHUNK_SIZE', '100'))
+
+STATUS_APPLIED = 'applied'
+STATUS_DUPLICATE = 'duplicate'
+STATUS_REJECTED = 'rejected'
+
+def _parse_reviewed_at(value, now):
+    if not value:
+        return now
+    reviewed_at = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if reviewed_at.tzinfo is None:
+        reviewed_at = reviewed_at.replace(tzinfo=timezone.utc)
+    # Offline clocks drift; a review can't have happened in the future
+    return min(reviewed_at, now)
+
+def validate_reviews(reviews, now):
+    """Check and normalise the submitted reviews; raises ValueError on bad input"""
+    if not isinstance(reviews, list) or not reviews:
+        raise ValueError('reviews must be a non-empty list')
+    if len(reviews) > MAX_REVIEW_BATCH_SIZE:
+        raise ValueError(f'At most {MAX_REVIEW_BATCH_SIZE} reviews per batch')
+
+    normalised = []
+    for index, review in enumerate(reviews):
+        if not isinstance(review, dict):
+            raise ValueError(f'Review {index} must be an object')
+        missing = [field for field in ('idempotency_key', 'card_id', 'session_id', 'quality') if review.get(field) in (None, '')]
+        if missing:
+            raise ValueError(f"Review {index} is missing {', '.join(missing)}")
+        quality = review['quality']
+        if isinstance(quality, bool) or not isinstance(quality, int) or not 0 <= quality <= 5:
+            raise ValueError(f'Review {index} has an invalid quality')
+        try:
+            reviewed_at = _parse_reviewed_at(review.get('reviewed_at'), now)
+        except (AttributeError, ValueError):
+            raise ValueError(f'Review {index} has an invalid reviewed_at')
+
+        normalised.append({
+            'idempotency_key': str(review['idempotency_key']),
+            'card_id': str(review['card_id']),
+            'session_id': str(review['session_id']),
+            'quality': quality,
+            'time_taken': review.get('time_taken'),
+            'reviewed_at': reviewed_at
+        })
+    return normalised
+
+def _select_in(client, table, columns, column, values):
+    """Rows of table whose column is one of values, read REVIEW_LOOKUP_CHUNK_SIZE values at a time"""
+    rows = []
+    for start in range(0, len(values), REVIEW_LOOKUP_CHUNK_SIZE):
+        chunk = values[start:start + REVIEW_LOOKUP_CHUNK_SIZE]
+        rows.extend(client.table(table).select(columns).in_(column, chunk).execute().data or [])
+    return rows
+
+def _due_date(card):
+    """UTC day the card is counted on in deck_due_counts, or None while it isn't scheduled"""
+    if not card.get('first_reviewed_at') or not card.get('next_review'):
+        return None
+    next_review = datetime.fromisoformat(card['next_review'].replace('Z', '+00:00'))
+    if next_review.tzinfo is None:
+        next_review = next_review.replace(tzinfo=timezone.utc)
+    return next_review.astimezone(timezone.utc).date()
+
+def apply_review_batch(user_id, reviews, client=None, now=None, load_balance=LOAD_BALANCE_ENABLED,
+                       retries=MAX_REVIEW_CONFLICT_RETRIES):
+    """
+    Apply an ordered list of reviews for a user.
+
+    Reviews of the same card are applied in the order given. Reviews whose
+    idempotency_key was already stored are reported as duplicates and
+    change nothing. Costs four round trips for up to REVIEW_LOOKUP_CHUNK_SIZE
+    reviews, two more for each further chunk, and one more with load
+    balancing. Reviews of a card that another review changed in
+    the meantime are computed again from its new state, up to retries times.
+
+    Returns one result per submitted review, in order.
+    """
+    if client is None:
+        from supabase_config import supabase as client
+    now = now or datetime.now(timezone.utc)
+    submitted = reviews
+    reviews = validate_reviews(reviews, now)
+
+    keys = list({review['idempotency_key'] for review in reviews})
+    stored = _select_in(client, 'card_reviews', 'idempotency_key', 'idempotency_key', keys)
+    seen = {row['idempotency_key'] for row in stored}
+
+    card_ids = list({review['card_id'] for review in reviews})
+    cards_result = _select_in(
+        client, 'cards', 'id, deck_id, interval, easiness, repetitions, next_review, first_reviewed_at, decks!inner(user_id)',
+        'id', card_ids
+    )
+    cards = {str(card['id']): card for card in cards_result}
+
+    # Fitted interval modifiers, the user's under None and any per deck
+    fitted = client.table('scheduler_parameters').select('deck_id, interval_modifier').eq('user_id', user_id).execute()
+    modifiers = {row['deck_id'] and str(row['deck_id']): row['interval_modifier'] for row in fitted.data or []}
+
+    # The user's due cards per day, updated as this batch moves cards
+    load = {}
+    if load_balance:
+        first_day = min(review['reviewed_at'] for review in reviews).astimezone(timezone.utc).date()
+        stored_load = client.rpc('get_user_due_load', {
+            'p_user_id': user_id,
+            'p_from': first_day.isoformat()
+        }).execute()
+        load = {date.fromisoformat(day): count for day, count in (stored_load.data or {}).items()}
+
+    results = []
+    card_updates = {}
+    review_rows = []
+    for review in reviews:
+        key = review['idempotency_key']
+        result = {'idempotency_key': key, 'card_id': review['card_id']}
+        results.append(result)
+
+        if key in seen:
+            result['status'] = STATUS_DUPLICATE
+            continue
+        seen.add(key)
+
+        card = cards.get(review['card_id'])
+        if card is None:
+            result.update(status=STATUS_REJECTED, error='Card not found')
+            continue
+        if card['decks']['user_id'] != user_id:
+            result.update(status=STATUS_REJECTED, error='Unauthorized')
+            continue
+
+        # Later reviews of the same card start from the state the earlier ones left
+        state = card_updates.get(card['id'], card)
+        modifier = modifiers.get(str(card['deck_id']), modifiers.get(None, 1.0))
+        new_easiness, new_interval, new_repetitions = sm2_step(
+            review['quality'], state['easiness'], state['interval'], state['repetitions'], AUTH0, modifier
+        )
+        if load_balance:
+            review_day = review['reviewed_at'].astimezone(timezone.utc).date()
+            # The card leaves the day it was due on
+            old_due_date = _due_date(state)
+            if old_due_date in load:
+                load[old_due_date] -= 1
+            fuzz = fuzz_days(new_interval)
+            new_interval = balance_interval(new_interval, {
+                days: load.get(review_day + timedelta(days=days), 0)
+                for days in range(new_interval - fuzz, new_interval + fuzz + 1)
+            })
+            new_due_date = review_day + timedelta(days=new_interval)
+            load[new_due_date] = load.get(new_due_date, 0) + 1
+        reviewed_at = review['reviewed_at'].isoformat()
+        next_review = (review['reviewed_at'] + timedelta(days=new_interval)).isoformat()
+
+        card_updates[card['id']] = {
+            'id': card['id'],
+            'interval': new_interval,
+            'easiness': new_easiness,
+            'repetitions': new_repetitions,
+            'next_review': next_review,
+            'first_reviewed_at': state.get('first_reviewed_at') or reviewed_at,
+            # The card is only written while it is still as it was read
+            'expected_repetitions': card['repetitions'],
+            'expected_interval': card['interval'],
+            'expected_next_review': card['next_review']
+        }
+        review_rows.append({
+            'id': str(uuid.uuid4()),
+            'session_id': review['session_id'],
+            'card_id': card['id'],
+            'quality': review['quality'],
+            'time_taken': review['time_taken'],
+            'created_at': reviewed_at,
+            'prev_easiness': state['easiness'],
+            'prev_interval': state['interval'],
+            'prev_repetitions': state['repetitions'],
+            'new_easiness': new_easiness,
+            'new_interval': new_interval,
+            'new_repetitions': new_repetitions,
+            'idempotency_key': key
+        })
+        result.update(
+            status=STATUS_APPLIED,
+            deck_id=card['deck_id'],
+            interval=new_interval,
+            easiness=new_easiness,
+            repetitions=new_repetitions,
+            nextReview=next_review
+        )
+
+    if review_rows:
+        written = client.rpc('apply_review_batch', {
+            'p_user_id': user_id,
+            'p_cards': list(card_updates.values()),
+            'p_reviews': review_rows
+        }).execute()
+        statuses = {row['idempotency_key']: row['status'] for row in written.data or []}
+
+        stale = []
+        for index, result in enumerate(results):
+            if result['status'] != STATUS_APPLIED:
+                continue
+            status = statuses.get(result['idempotency_key'])
+            if status == STATUS_APPLIED:
+                continue
+            for field in ('deck_id', 'interval', 'easiness', 'repetitions', 'nextReview'):
+                result.pop(field)
+            if status == 'unauthorized':
+                result.update(status=STATUS_REJECTED, error='Study session not found for this user')
+            elif status == 'stale':
+                stale.append(index)
+            else:
+                # Stored by a concurrent resubmission
+                result['status'] = STATUS_DUPLICATE
+
+        if stale and retries > 0:
+            retried = apply_review_batch(
+                user_id, [submitted[index] for index in stale], client, now, load_balance, retries - 1
+            )
+            for index, result in zip(stale, retried):
+                results[index] = result
+        else:
+            for index in stale:
+                results[index].update(status=STATUS_REJECTED, error='Card was changed by another review, resubmit')
+
+    applied = sum(1 for result in results if result['status'] == STATUS_APPLIED)
+    logger.info(f"Applied {applied} of {len(reviews)} reviews for user {user_id}")
+    return results
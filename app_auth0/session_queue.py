@@ -0,0 +1,199 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+SESSION_QUEUE_PATH = os.getenv('SESSION_QUEUE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'session_queues.db'))
+# Cards queued when a session starts; the daily caps usually stop it earlier
+SESSION_QUEUE_SIZE = int(os.getenv('SESSION_QUEUE_SIZE', '250'))
+# Cards sent after the current one, so the client can render them without a round trip
+SESSION_QUEUE_PREFETCH = int(os.getenv('SESSION_QUEUE_PREFETCH', '5'))
+# Idle queues are dropped after this long, and the least recently used beyond the cap
+SESSION_QUEUE_TTL_SECONDS = int(os.getenv('SESSION_QUEUE_TTL_SECONDS', str(6 * 3600)))
+SESSION_QUEUE_MAX_SESSIONS = int(os.getenv('SESSION_QUEUE_MAX_SESSIONS', '10000'))
+
+class SessionQueueStore:
+    """
+    The ordered cards of each running study session, built once from the
+    due queue and kept in SQLite so every worker on the host shares them.
+
+    Reviewed cards are removed as reviews come in, so the next card is
+    always the first row left and never needs the due query again.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS session_queues (
+            session_id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            deck_id TEXT NOT NULL,
+            remaining INTEGER NOT NULL,
+            accessed_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_session_queues_user_deck ON session_queues(user_id, deck_id);
+        CREATE INDEX IF NOT EXISTS idx_session_queues_deck ON session_queues(deck_id);
+        CREATE INDEX IF NOT EXISTS idx_session_queues_accessed ON session_queues(accessed_at);
+
+        CREATE TABLE IF NOT EXISTS session_queue_cards (
+            session_id TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            card_id TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            PRIMARY KEY (session_id, position)
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_session_queue_cards_card ON session_queue_cards(session_id, card_id);
+    """
+
+    def __init__(self, due_queue=None, path=SESSION_QUEUE_PATH, size=SESSION_QUEUE_SIZE,
+                 ttl_seconds=SESSION_QUEUE_TTL_SECONDS, max_sessions=SESSION_QUEUE_MAX_SESSIONS):
+        if due_queue is None:
+            from due_queue import get_due_queue
+            due_queue = get_due_queue()
+        self.due_queue = due_queue
+        self.path = path
+        self.size = size
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(self.SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def _delete(self, conn, session_ids):
+        for session_id in session_ids:
+            conn.execute('DELETE FROM session_queue_cards WHERE session_id = ?', (session_id,))
+            conn.execute('DELETE FROM session_queues WHERE session_id = ?', (session_id,))
+
+    def build(self, session_id, user_id, deck_id, now=None):
+        """Queue the due cards of a new session; returns how many were queued"""
+        cards = self.due_queue.fetch(user_id, deck_id, self.size, now)
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._delete(conn, [session_id])
+            conn.execute(
+                'INSERT INTO session_queues (session_id, user_id, deck_id, remaining, accessed_at) VALUES (?, ?, ?, ?, ?)',
+                (session_id, str(user_id), str(deck_id), len(cards), time.time())
+            )
+            conn.executemany(
+                'INSERT INTO session_queue_cards (session_id, position, card_id, payload) VALUES (?, ?, ?, ?)',
+                [(session_id, position, str(card['id']), json.dumps(card)) for position, card in enumerate(cards)]
+            )
+            self._evict(conn)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        logger.info(f"Queued {len(cards)} cards for study session {session_id}")
+        return len(cards)
+
+    def window(self, session_id, size):
+        """
+        Return the next size cards of a session with its owner and the number
+        of cards left, or None when the queue is unknown or has expired.
+        """
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute(
+            'SELECT user_id, deck_id, remaining, accessed_at FROM session_queues WHERE session_id = ?', (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        user_id, deck_id, remaining, accessed_at = row
+        if now - accessed_at > self.ttl_seconds:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._delete(conn, [session_id])
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            return None
+
+        conn.execute('UPDATE session_queues SET accessed_at = ? WHERE session_id = ?', (now, session_id))
+        payloads = conn.execute(
+            'SELECT payload FROM session_queue_cards WHERE session_id = ? ORDER BY position LIMIT ?', (session_id, size)
+        ).fetchall()
+        return {
+            'user_id': user_id,
+            'deck_id': deck_id,
+            'remaining': remaining,
+            'cards': [json.loads(payload) for payload, in payloads]
+        }
+
+    def record_review(self, user_id, deck_id, card_id):
+        """Drop a reviewed card from the user's queued sessions of the deck"""
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            session_ids = [row[0] for row in conn.execute(
+                'SELECT session_id FROM session_queues WHERE user_id = ? AND deck_id = ?', (str(user_id), str(deck_id))
+            )]
+            for session_id in session_ids:
+                removed = conn.execute(
+                    'DELETE FROM session_queue_cards WHERE session_id = ? AND card_id = ?', (session_id, str(card_id))
+                ).rowcount
+                if removed:
+                    conn.execute('UPDATE session_queues SET remaining = remaining - 1 WHERE session_id = ?', (session_id,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def invalidate(self, deck_id):
+        """Forget the queued sessions of a deck after its cards change; they are rebuilt on demand"""
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._delete(conn, [row[0] for row in conn.execute(
+                'SELECT session_id FROM session_queues WHERE deck_id = ?', (str(deck_id),)
+            )])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def drop(self, session_id):
+        """Forget the queue of an ended session"""
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._delete(conn, [session_id])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _evict(self, conn):
+        expired = [row[0] for row in conn.execute(
+            'SELECT session_id FROM session_queues WHERE accessed_at < ?', (time.time() - self.ttl_seconds,)
+        )]
+        self._delete(conn, expired)
+        excess = conn.execute('SELECT COUNT(*) FROM session_queues').fetchone()[0] - self.max_sessions
+        if excess > 0:
+            self._delete(conn, [row[0] for row in conn.execute(
+                'SELECT session_id FROM session_queues ORDER BY accessed_at LIMIT ?', (excess,)
+            )])
+
+_session_queues = None
+_session_queues_lock = threading.Lock()
+
+def get_session_queues():
+    """Return the process-wide session queue store"""
+    global _session_queues
+    with _session_queues_lock:
+        if _session_queues is None:
+            _session_queues = SessionQueueStore()
+        return _session_queues
@@ -0,0 +1,91 @@
+"""
+Review workload forecast.
+
+Simulates the reviews of every scheduled card over the coming days with the
+batch SM-2 core. Each round reviews the next due review of every card still
+inside the horizon at once, drawing the answer quality from a fixed
+distribution, so the Python loop runs once per review of the busiest card
+rather than once per card or day. Several independent runs are simulated
+side by side to get a spread as well as a mean.
+"""
+import os
+
+import numpy as np
+
+from .sm2 import sm2_batch, AUTH0
+
+DEFAULT_FORECAST_DAYS = 30
+MAX_FORECAST_DAYS = 365
+FORECAST_RUNS = int(os.getenv('FORECAST_RUNS', '10'))
+MAX_FORECAST_RUNS = 100
+
+# Share of reviews answered with quality 0..5, about 90% recall
+DEFAULT_QUALITY_PROBABILITIES = tuple(
+    float(p) for p in os.getenv('FORECAST_QUALITY_PROBABILITIES', '0.03,0.03,0.04,0.15,0.45,0.30').split(',')
+)
+
+def _cumulative(quality_probabilities):
+    probabilities = np.asarray(quality_probabilities, dtype=np.float64)
+    if probabilities.shape != (6,) or (probabilities < 0).any() or probabilities.sum() <= 0:
+        raise ValueError('quality_probabilities must be six non-negative weights for qualities 0-5')
+    cumulative = np.cumsum(probabilities)
+    return cumulative / cumulative[-1]
+
+def simulate_reviews(easiness, interval, repetitions, due_day, days=DEFAULT_FORECAST_DAYS, runs=FORECAST_RUNS,
+                     quality_probabilities=DEFAULT_QUALITY_PROBABILITIES, variant=AUTH0, seed=None):
+    """
+    Simulate the reviews of a set of cards.
+
+    Args:
+        easiness, interval, repetitions: current SM-2 state per card
+        due_day: days from today until each card is due; overdue cards are due today
+        days: forecast horizon
+        runs: independent Monte Carlo runs
+
+    Returns:
+        np.ndarray: (runs, days) int64 array of reviews per run and day
+    """
+    if not 1 <= days <= MAX_FORECAST_DAYS:
+        raise ValueError(f'days must be between 1 and {MAX_FORECAST_DAYS}')
+    if not 1 <= runs <= MAX_FORECAST_RUNS:
+        raise ValueError(f'runs must be between 1 and {MAX_FORECAST_RUNS}')
+    cumulative = _cumulative(quality_probabilities)
+    rng = np.random.default_rng(seed)
+
+    cards = len(due_day)
+    e = np.tile(np.asarray(easiness, dtype=np.float64), runs)
+    i = np.tile(np.asarray(interval, dtype=np.int64), runs)
+    r = np.tile(np.asarray(repetitions, dtype=np.int64), runs)
+    due = np.tile(np.maximum(np.asarray(due_day, dtype=np.int64), 0), runs)
+    run = np.repeat(np.arange(runs, dtype=np.int64), cards)
+
+    counts = np.zeros(runs * days, dtype=np.int64)
+    while True:
+        inside = due < days
+        e, i, r, due, run = e[inside], i[inside], r[inside], due[inside], run[inside]
+        if not due.size:
+            break
+        counts += np.bincount(run * days + due, minlength=runs * days)
+
+        quality = np.minimum(np.searchsorted(cumulative, rng.random(due.size), side='right'), 5)
+        e, i, r = sm2_batch(quality, e, i, r, variant)
+        due = due + i
+
+    return counts.reshape(runs, days)
+
+def forecast_reviews(easiness, interval, repetitions, due_day, days=DEFAULT_FORECAST_DAYS, runs=FORECAST_RUNS,
+                     quality_probabilities=DEFAULT_QUALITY_PROBABILITIES, variant=AUTH0, seed=None):
+    """
+    Expected reviews per day over the horizon.
+
+    Returns:
+        dict: 'mean', 'p10' and 'p90' lists of length days
+    """
+    counts = simulate_reviews(easiness, interval, repetitions, due_day, days, runs,
+                              quality_probabilities, variant, seed)
+    p10, p90 = np.percentile(counts, [10, 90], axis=0)
+    return {
+        'mean': counts.mean(axis=0).tolist(),
+        'p10': p10.tolist(),
+        'p90': p90.tolist()
+    }
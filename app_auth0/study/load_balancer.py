@@ -0,0 +1,45 @@
+"""
+Due date load balancing.
+
+Plain SM-2 sends every card reviewed on the same day with the same state to
+the same future day, so decks studied in bulk keep coming back as spikes.
+With load balancing on, a new interval may move by a few days (its fuzz) to
+whichever day in that window has the fewest of the user's cards due.
+
+apply_card_review in migrations/add_due_load.py does the same in SQL; keep
+the two in step.
+"""
+import math
+import os
+
+LOAD_BALANCE_ENABLED = os.getenv('LOAD_BALANCE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+
+def fuzz_days(interval):
+    """
+    How far an interval may move either way: none below three days, then
+    15% of the days up to a week, 10% up to twenty days and 5% beyond.
+    """
+    if interval < 3:
+        return 0
+    return math.floor(
+        1.0
+        + 0.15 * (min(interval, 7) - 2.5)
+        + 0.1 * (min(max(interval, 7), 20) - 7)
+        + 0.05 * (max(interval, 20) - 20)
+    )
+
+def balance_interval(interval, load):
+    """
+    Pick the interval within the fuzz window whose due day is least loaded.
+
+    Args:
+        interval: interval chosen by SM-2, in days
+        load: dict of days from the review day to the number of cards due then
+
+    Ties go to the day closest to the SM-2 interval, then the earlier one.
+    """
+    fuzz = fuzz_days(interval)
+    return min(
+        range(interval - fuzz, interval + fuzz + 1),
+        key=lambda days: (load.get(days, 0), abs(days - interval), days)
+    )
@@ -0,0 +1,167 @@
+"""
+Scheduler parameter fitting.
+
+Fits a logistic recall model per user (or per deck) from the review log:
+
+    P(pass) = sigmoid(w . [1, log(prev_interval), prev_easiness - 2.5, log1p(prev_repetitions)])
+
+The review log is streamed as columnar chunks. Each pass over it
+accumulates the gradient and Hessian of the log loss for every group with
+bincounts, then takes one Newton step for all groups at once, so memory
+stays at one chunk plus a few floats per group however long the log is.
+A ridge penalty pulls each group towards the pooled weights, so sparse
+histories stay close to the population.
+
+The scheduler doesn't evaluate the model; it reads one number from it, the
+interval modifier that moves a group's typical review to the target
+retention (see interval_modifier).
+"""
+import os
+
+import numpy as np
+
+N_FEATURES = 4
+INTERVAL_FEATURE = 1
+
+TARGET_RETENTION = float(os.getenv('SCHEDULER_TARGET_RETENTION', '0.9'))
+MIN_INTERVAL_MODIFIER = 0.5
+MAX_INTERVAL_MODIFIER = 2.5
+# Strength of the pull towards the pooled weights, in reviews
+PRIOR_REVIEWS = 50
+
+def review_features(prev_interval, prev_easiness, prev_repetitions):
+    """Feature matrix for review rows given as arrays; prev_interval must be at least 1"""
+    prev_interval = np.asarray(prev_interval, dtype=np.float64)
+    x = np.empty((prev_interval.shape[0], N_FEATURES))
+    x[:, 0] = 1.0
+    x[:, 1] = np.log(prev_interval)
+    x[:, 2] = np.asarray(prev_easiness, dtype=np.float64) - 2.5
+    x[:, 3] = np.log1p(np.asarray(prev_repetitions, dtype=np.float64))
+    return x
+
+def _sigmoid(z):
+    return 1.0 / (1.0 + np.exp(-np.clip(z, -30, 30)))
+
+def interval_modifier(weights, mean_features, target_retention=TARGET_RETENTION):
+    """
+    Factor for SM-2 intervals that brings a group's typical review to the
+    target retention. 1.0 when recall doesn't fall with the interval.
+    """
+    slope = weights[INTERVAL_FEATURE]
+    if slope >= -1e-3:
+        return 1.0
+    target = np.log(target_retention / (1.0 - target_retention))
+    modifier = np.exp((target - weights @ mean_features) / slope)
+    return float(np.clip(modifier, MIN_INTERVAL_MODIFIER, MAX_INTERVAL_MODIFIER))
+
+_PAIRS = [(j, k) for j in range(N_FEATURES) for k in range(j, N_FEATURES)]
+
+class RecallModelFitter:
+    """
+    Fits the recall model for many groups at once. For each pass over the
+    review log call start_epoch, partial_fit per chunk, then end_epoch.
+    """
+
+    def __init__(self, prior_reviews=PRIOR_REVIEWS):
+        self.prior_reviews = prior_reviews
+        self.groups = {}
+        self.pooled = np.zeros(N_FEATURES)
+        self.epochs = 0
+        self._weights = np.zeros((0, N_FEATURES))
+        self._counts = np.zeros(0)
+        self._feature_sums = np.zeros((0, N_FEATURES))
+        self.start_epoch()
+
+    def _index(self, keys):
+        unique, inverse = np.unique(np.asarray(keys, dtype=object).astype(str), return_inverse=True)
+        unique = unique.tolist()
+        for key in unique:
+            if key not in self.groups:
+                self.groups[key] = len(self.groups)
+        grown = len(self.groups) - len(self._counts)
+        if grown:
+            # New groups start from the pooled weights
+            self._weights = np.vstack([self._weights, np.tile(self.pooled, (grown, 1))])
+            self._counts = np.concatenate([self._counts, np.zeros(grown)])
+            self._feature_sums = np.vstack([self._feature_sums, np.zeros((grown, N_FEATURES))])
+            self._gradient = np.vstack([self._gradient, np.zeros((grown, N_FEATURES))])
+            self._hessian = np.concatenate([self._hessian, np.zeros((grown, N_FEATURES, N_FEATURES))])
+            self._losses = np.concatenate([self._losses, np.zeros(grown)])
+        return np.array([self.groups[key] for key in unique], dtype=np.int64)[inverse]
+
+    def start_epoch(self):
+        """Reset the per-pass sums"""
+        n = len(self._counts)
+        self._gradient = np.zeros((n, N_FEATURES))
+        self._hessian = np.zeros((n, N_FEATURES, N_FEATURES))
+        self._losses = np.zeros(n)
+        self._pooled_gradient = np.zeros(N_FEATURES)
+        self._pooled_hessian = np.zeros((N_FEATURES, N_FEATURES))
+
+    def partial_fit(self, keys, features, passed):
+        """
+        Add a chunk of reviews to the current pass.
+
+        Args:
+            keys: group key (user or deck id) per review
+            features: review_features() of the chunk
+            passed: whether each review had quality 3 or more
+        """
+        group = self._index(keys)
+        y = np.asarray(passed, dtype=np.float64)
+        n = len(self._counts)
+
+        p = _sigmoid(np.einsum('ij,ij->i', self._weights[group], features))
+        self._losses += np.bincount(
+            group, weights=-(y * np.log(np.maximum(p, 1e-12)) + (1 - y) * np.log(np.maximum(1 - p, 1e-12))), minlength=n
+        )
+        if self.epochs == 0:
+            self._counts += np.bincount(group, minlength=n)
+            for j in range(N_FEATURES):
+                self._feature_sums[:, j] += np.bincount(group, weights=features[:, j], minlength=n)
+
+        error = p - y
+        curvature = p * (1 - p)
+        for j in range(N_FEATURES):
+            self._gradient[:, j] += np.bincount(group, weights=error * features[:, j], minlength=n)
+        for j, k in _PAIRS:
+            self._hessian[:, j, k] += np.bincount(group, weights=curvature * features[:, j] * features[:, k], minlength=n)
+
+        pooled_p = _sigmoid(features @ self.pooled)
+        self._pooled_gradient += (pooled_p - y) @ features
+        self._pooled_hessian += (features * (pooled_p * (1 - pooled_p))[:, None]).T @ features
+
+    def end_epoch(self):
+        """Take the Newton step of the finished pass"""
+        # Only the upper triangle was accumulated
+        hessian = self._hessian + np.triu(self._hessian, 1).transpose(0, 2, 1)
+        # A ridge worth prior_reviews reviews at the steepest part of the curve
+        ridge = self.prior_reviews * 0.25
+        gradient = self._gradient + ridge * (self._weights - self.pooled)
+        step = np.linalg.solve(hessian + ridge * np.eye(N_FEATURES), gradient[..., None])[..., 0]
+        self._weights = self._weights - step
+
+        pooled_ridge = 1e-6 * np.eye(N_FEATURES)
+        self.pooled = self.pooled - np.linalg.solve(self._pooled_hessian + pooled_ridge, self._pooled_gradient)
+        self.epochs += 1
+
+    def loss(self):
+        """Mean log loss of the current pass so far"""
+        return float(self._losses.sum() / max(self._counts.sum(), 1))
+
+    def parameters(self, target_retention=TARGET_RETENTION):
+        """
+        Fitted parameters per group key: weights, interval_modifier,
+        review_count and the mean log loss of the last pass.
+        """
+        results = {}
+        for key, index in self.groups.items():
+            count = self._counts[index]
+            weights = self._weights[index]
+            results[key] = {
+                'weights': weights.tolist(),
+                'interval_modifier': interval_modifier(weights, self._feature_sums[index] / max(count, 1), target_retention),
+                'review_count': int(count),
+                'log_loss': float(self._losses[index] / max(count, 1))
+            }
+        return results
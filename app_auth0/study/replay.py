@@ -0,0 +1,112 @@
+"""
+Card state replay.
+
+card_reviews records every scheduling transition, and cards holds the
+result in place. fold_reviews rebuilds each card's state from the log so
+the two can be compared (see replay_card_states.py).
+
+By default the fold trusts the state each review recorded (new_easiness,
+new_interval, new_repetitions), which already includes load balancing and
+the interval modifier in force at the time, and only computes a transition
+where the log has none. With recompute=True every review goes through the
+SM-2 core again from the first review's previous state, which is how
+schedules are moved over after a scheduler change. Load balancing depends
+on what else was due that day and isn't replayed.
+"""
+from collections import namedtuple
+from datetime import timedelta, timezone
+from itertools import chain, groupby
+
+from study.sm2 import sm2_step, AUTH0
+
+# Column defaults of a card that was never reviewed
+DEFAULT_STATE = (2.5, 1, 0)
+
+ReplayedCard = namedtuple('ReplayedCard', [
+    'card_id',
+    'easiness',
+    'interval',
+    'repetitions',
+    'next_review',
+    'first_reviewed_at',
+    'reviews',   # reviews folded
+    'breaks'     # reviews whose previous state isn't what the review before left
+])
+
+STATE_FIELDS = ('easiness', 'interval', 'repetitions', 'next_review', 'first_reviewed_at')
+DATE_FIELDS = ('next_review', 'first_reviewed_at')
+
+# review_card used to read the clock separately for next_review and for the
+# review's created_at, so dates a few microseconds apart still agree
+DATE_TOLERANCE = timedelta(seconds=1)
+
+def _utc(value):
+    # card_reviews.created_at has no time zone and is written in UTC
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+def _recorded(review, prefix):
+    state = (review.get(f'{prefix}_easiness'), review.get(f'{prefix}_interval'), review.get(f'{prefix}_repetitions'))
+    return None if None in state else state
+
+def replay_card(card_id, reviews, recompute=False, interval_modifier=1.0, variant=AUTH0):
+    """
+    Fold one card's reviews, oldest first, into its current state.
+
+    Args:
+        reviews: mappings with created_at, quality and the prev_/new_ state columns
+        recompute: run every review through SM-2 instead of trusting the log
+        interval_modifier: fitted modifier applied when recomputing
+    """
+    state = None
+    first_reviewed_at = reviewed_at = None
+    count = breaks = 0
+    for review in reviews:
+        # Old rows may have no created_at; they still count, but don't move the dates
+        if review['created_at'] is not None:
+            reviewed_at = _utc(review['created_at'])
+            if first_reviewed_at is None:
+                first_reviewed_at = reviewed_at
+        previous = _recorded(review, 'prev')
+        if state is None:
+            state = previous or DEFAULT_STATE
+        elif previous is not None and previous != state:
+            breaks += 1
+
+        recorded = None if recompute else _recorded(review, 'new')
+        state = recorded or sm2_step(review['quality'], *state, variant, interval_modifier)
+        count += 1
+
+    if state is None:
+        return None
+    easiness, interval, repetitions = state
+    return ReplayedCard(
+        card_id, easiness, interval, repetitions,
+        reviewed_at + timedelta(days=interval) if reviewed_at else None, first_reviewed_at, count, breaks
+    )
+
+def fold_reviews(rows, recompute=False, variant=AUTH0):
+    """
+    Replay a review log ordered by card_id, then created_at.
+
+    Rows are consumed one card at a time, so memory doesn't grow with the
+    log. An interval_modifier column, if present, is used when recomputing.
+    Yields (ReplayedCard, first row of the card) pairs.
+    """
+    for card_id, reviews in groupby(rows, key=lambda row: row['card_id']):
+        first = next(reviews)
+        modifier = first.get('interval_modifier') or 1.0
+        replayed = replay_card(card_id, chain([first], reviews), recompute, modifier, variant)
+        yield replayed, first
+
+def _same(field, stored, replayed):
+    if field not in DATE_FIELDS:
+        return stored == replayed
+    if stored is None or replayed is None:
+        return stored is replayed
+    return abs(_utc(stored) - replayed) < DATE_TOLERANCE
+
+def drifted_fields(replayed, stored):
+    """Names of the state fields where the stored card differs from the replay"""
+    return [field for field in STATE_FIELDS if not _same(field, stored.get(field), getattr(replayed, field))]
@@ -0,0 +1,71 @@
+"""
+Study session statistics.
+
+study_sessions keeps running totals of its reviews: count, correct
+answers, quality sum, total time and a histogram of response times. A
+trigger on card_reviews updates them in the same transaction as every
+review (migrations/add_session_statistics.py), so a session's statistics
+are a read of one row however many reviews it had.
+"""
+from bisect import bisect_right
+
+# Upper bounds of the response time buckets, in ms; the last bucket is open.
+# The trigger has the same list.
+TIME_BUCKET_BOUNDS_MS = (500, 1000, 2000, 4000, 8000, 16000, 32000, 64000)
+
+def time_bucket(time_taken):
+    """Histogram bucket of a response time in ms"""
+    return bisect_right(TIME_BUCKET_BOUNDS_MS, time_taken)
+
+def session_totals(reviews):
+    """
+    The running totals of a session computed from its (quality, time_taken)
+    pairs, for databases without the trigger, e.g. the Flask-SQLAlchemy apps
+    built with db.create_all()
+    """
+    histogram = [0] * (len(TIME_BUCKET_BOUNDS_MS) + 1)
+    for _, time_taken in reviews:
+        if time_taken and time_taken > 0:
+            histogram[time_bucket(time_taken)] += 1
+    return {
+        'cards_studied': len(reviews),
+        'correct_answers': sum(1 for quality, _ in reviews if quality >= 3),
+        'quality_sum': sum(quality for quality, _ in reviews),
+        'total_time_ms': sum(time_taken for _, time_taken in reviews if time_taken and time_taken > 0),
+        'time_histogram': histogram
+    }
+
+def estimate_percentile(histogram, fraction):
+    """Response time below which the given fraction of timed reviews fell, interpolated within its bucket"""
+    total = sum(histogram)
+    if not total:
+        return None
+    target = fraction * total
+    seen = 0
+    for bucket, count in enumerate(histogram):
+        if count and seen + count >= target:
+            low = TIME_BUCKET_BOUNDS_MS[bucket - 1] if bucket else 0
+            if bucket == len(TIME_BUCKET_BOUNDS_MS):
+                return low
+            return low + (TIME_BUCKET_BOUNDS_MS[bucket] - low) * (target - seen) / count
+        seen += count
+    return TIME_BUCKET_BOUNDS_MS[-1]
+
+def summarize_session(session):
+    """API statistics of a study_sessions row, given as a dict"""
+    total_cards = session.get('cards_studied') or 0
+    total_time = session.get('total_time_ms') or 0
+    histogram = list(session.get('time_histogram') or [0] * (len(TIME_BUCKET_BOUNDS_MS) + 1))
+    timed = sum(histogram)
+    return {
+        'totalCards': total_cards,
+        'correctAnswers': session.get('correct_answers') or 0,
+        'totalTimeMs': total_time,
+        'averageQuality': (session.get('quality_sum') or 0) / total_cards if total_cards else 0,
+        'averageTimeMs': total_time / timed if timed else 0,
+        'medianTimeMs': estimate_percentile(histogram, 0.5),
+        'timeHistogram': [
+            {'upToMs': bound, 'count': count}
+            for bound, count in zip(TIME_BUCKET_BOUNDS_MS + (None,), histogram)
+        ]
+    }
@@ -0,0 +1,105 @@
+"""
+SuperMemo 2 scheduling core.
+
+Every SM-2 implementation in the project delegates here. The implementations
+historically disagreed in small ways, and each of those behaviours is kept as
+a named variant so existing schedules do not change:
+
+- CLASSIC: root supermemo2 and app/study/supermemo2. Easiness is updated on
+  every review and the interval grows with the previous easiness, rounded.
+- STUDY_API: study_api.calculate_next_review. Like CLASSIC, but the interval
+  grows with the updated easiness.
+- AUTH0: app_auth0/study/supermemo2. Easiness is left alone on failed
+  reviews and the interval grows with the updated easiness, rounded up.
+
+sm2_step schedules one card with plain Python numbers; sm2_batch schedules
+whole arrays of card states at once and returns identical results.
+"""
+import math
+from collections import namedtuple
+
+import numpy as np
+
+MIN_EASINESS = 1.3
+PASSING_QUALITY = 3
+
+SM2Variant = namedtuple('SM2Variant', [
+    'name',
+    'easiness_on_failure',         # update easiness when quality < 3
+    'interval_from_new_easiness',  # grow the interval with the updated easiness
+    'rounding'                     # 'round' or 'ceil' for the grown interval
+])
+
+CLASSIC = SM2Variant('classic', easiness_on_failure=True, interval_from_new_easiness=False, rounding='round')
+STUDY_API = SM2Variant('study_api', easiness_on_failure=True, interval_from_new_easiness=True, rounding='round')
+AUTH0 = SM2Variant('auth0', easiness_on_failure=False, interval_from_new_easiness=True, rounding='ceil')
+
+VARIANTS = {variant.name: variant for variant in (CLASSIC, STUDY_API, AUTH0)}
+
+# Easiness change per quality, computed with the same float operations as sm2_step
+_LAPSE = 5 - np.arange(6, dtype=np.int64)
+_EASINESS_DELTA = 0.1 - _LAPSE * (0.08 + _LAPSE * 0.02)
+
+def sm2_step(quality, easiness, interval, repetitions, variant=CLASSIC, interval_modifier=1.0):
+    """
+    Schedule a single review.
+
+    interval_modifier scales grown intervals (from the third review on),
+    e.g. a user's fitted value from study/param_optimizer.py.
+
+    Returns:
+        tuple: (new_easiness, new_interval, new_repetitions)
+    """
+    # Keep the exact operation order of the original implementations so the
+    # floats match them bit for bit
+    updated_easiness = max(MIN_EASINESS, easiness + (0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02)))
+
+    if quality < PASSING_QUALITY:
+        new_easiness = updated_easiness if variant.easiness_on_failure else easiness
+        return new_easiness, 1, 0
+
+    if repetitions == 0:
+        new_interval = 1
+    elif repetitions == 1:
+        new_interval = 6
+    else:
+        growth = updated_easiness if variant.interval_from_new_easiness else easiness
+        grown = interval * growth * interval_modifier
+        new_interval = math.ceil(grown) if variant.rounding == 'ceil' else round(grown)
+
+    return updated_easiness, new_interval, repetitions + 1
+
+def sm2_batch(quality, easiness, interval, repetitions, variant=CLASSIC, interval_modifier=1.0):
+    """
+    Schedule many reviews at once.
+
+    Takes array-likes of equal shape (interval_modifier may also be one) and returns
+    (new_easiness float64, new_interval int64, new_repetitions int64) arrays.
+    """
+    quality = np.asarray(quality, dtype=np.int64)
+    easiness = np.asarray(easiness, dtype=np.float64)
+    interval = np.asarray(interval, dtype=np.float64)
+    repetitions = np.asarray(repetitions, dtype=np.int64)
+    # Negative qualities would otherwise index _EASINESS_DELTA from the end
+    if quality.size and (quality.min() < 0 or quality.max() > 5):
+        raise ValueError("quality must be between 0 and 5")
+
+    updated_easiness = np.maximum(MIN_EASINESS, easiness + _EASINESS_DELTA[quality])
+    passed = quality >= PASSING_QUALITY
+
+    if variant.easiness_on_failure:
+        new_easiness = updated_easiness
+    else:
+        new_easiness = np.where(passed, updated_easiness, easiness)
+
+    grown = interval * (updated_easiness if variant.interval_from_new_easiness else easiness) * interval_modifier
+    # np.round rounds halves to even, like the built-in round()
+    grown = np.ceil(grown) if variant.rounding == 'ceil' else np.round(grown)
+
+    new_interval = grown.astype(np.int64)
+    new_interval[repetitions == 0] = 1
+    new_interval[repetitions == 1] = 6
+    new_interval[~passed] = 1
+    new_repetitions = np.where(passed, repetitions + 1, 0)
+
+    return new_easiness, new_interval, new_repetitions
@@ -1,5 +1,5 @@
 from datetime import datetime, timedelta
-import math
+from .sm2 import sm2_step, AUTH0
 
 class SuperMemo2:
     def __init__(self, easiness=2.5, interval=1, repetitions=0):
@@ -8,26 +8,22 @@ class SuperMemo2:
         self.repetitions = repetitions
         self.next_review = datetime.utcnow()
 
+    @staticmethod
+    def calculate_values(quality, prev_easiness, prev_interval, prev_repetitions):
+        """
+        Calculate new SuperMemo 2 values without touching any state
+        Returns (new_easiness, new_interval, new_repetitions)
+        """
+        return sm2_step(quality, prev_easiness, prev_interval, prev_repetitions, AUTH0)
+
     def calculate_next_review(self, quality):
         """
         Calculate the next review interval using the SuperMemo 2 algorithm
         quality: 0-5 rating of how well the card was remembered
         """
-        if quality < 3:  # If the card was not remembered well
-            self.repetitions = 0
-            self.interval = 1
-        else:
-            self.easiness = max(1.3, self.easiness + (0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02)))
-            
-            if self.repetitions == 0:
-                self.interval = 1
-            elif self.repetitions == 1:
-                self.interval = 6
-            else:
-                self.interval = math.ceil(self.interval * self.easiness)
-            
-            self.repetitions += 1
-
+        self.easiness, self.interval, self.repetitions = self.calculate_values(
+            quality, self.easiness, self.interval, self.repetitions
+        )
         self.next_review = datetime.utcnow() + timedelta(days=self.interval)
         return self.next_review
 
@@ -6,6 +6,9 @@ import os
 from dotenv import load_dotenv
 import logging
 from typing import Optional, Dict, List
+from collections import namedtuple
+from ttl_cache import TTLCache
+from usage_metering import get_usage_meter
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -40,6 +43,7 @@ TIER_FEATURES = {
     SubscriptionTier.FREE: {
         'max_decks': 3,
         'max_cards_per_deck': 50,
+        'max_deck_generations_per_month': 0,
         'can_create_live_decks': False,
         'can_edit_live_decks': False,
         'can_share_decks': False,
@@ -54,6 +58,7 @@ TIER_FEATURES = {
     SubscriptionTier.BASIC: {
         'max_decks': 10,
         'max_cards_per_deck': 200,
+        'max_deck_generations_per_month': 10,
         'can_create_live_decks': True,
         'can_edit_live_decks': False,
         'can_share_decks': True,
@@ -68,6 +73,7 @@ TIER_FEATURES = {
     SubscriptionTier.PRO: {
         'max_decks': 50,
         'max_cards_per_deck': 1000,
+        'max_deck_generations_per_month': 100,
         'can_create_live_decks': True,
         'can_edit_live_decks': True,
         'can_share_decks': True,
@@ -82,6 +88,7 @@ TIER_FEATURES = {
     SubscriptionTier.ENTERPRISE: {
         'max_decks': float('inf'),
         'max_cards_per_deck': float('inf'),
+        'max_deck_generations_per_month': float('inf'),
         'can_create_live_decks': True,
         'can_edit_live_decks': True,
         'can_share_decks': True,
@@ -95,6 +102,44 @@ TIER_FEATURES = {
     }
 }
 
+# One bit per boolean feature, so an entitlement check is a mask test
+FEATURE_BITS = {
+    feature: 1 << bit
+    for bit, feature in enumerate(
+        feature for feature, value in TIER_FEATURES[SubscriptionTier.FREE].items() if isinstance(value, bool)
+    )
+}
+TIER_FEATURE_MASKS = {
+    tier: sum(FEATURE_BITS[feature] for feature, value in features.items() if value is True)
+    for tier, features in TIER_FEATURES.items()
+}
+
+def feature_bit(feature: str) -> int:
+    """Bit of a feature given as 'can_use_media', 'use_media' or 'media'; 0 if unknown"""
+    for name in (feature, f'can_{feature}', f'can_use_{feature}'):
+        if name in FEATURE_BITS:
+            return FEATURE_BITS[name]
+    return 0
+
+# Metered features and the TIER_FEATURES entry holding their monthly limit
+USAGE_LIMITS = {
+    'deck_generation': 'max_deck_generations_per_month'
+}
+
+_SUBSCRIPTION_STATUSES = {status.value: status for status in SubscriptionStatus}
+
+# What a user's subscription currently allows; status is None without a
+# subscription or for Stripe statuses not listed in SubscriptionStatus
+Entitlement = namedtuple('Entitlement', ['user_id', 'tier', 'status', 'features', 'subscription'])
+
+# Webhooks and the subscription methods below invalidate a user's entry as soon as
+# it changes; the TTL only covers changes made outside this process
+ENTITLEMENT_CACHE_TTL_SECONDS = int(os.getenv('ENTITLEMENT_CACHE_TTL_SECONDS', '300'))
+_entitlements = TTLCache(ENTITLEMENT_CACHE_TTL_SECONDS, max_entries=100000)
+
+def invalidate_entitlement(user_id: str):
+    _entitlements.invalidate(str(user_id))
+
 # Stripe product IDs for each tier
 STRIPE_PRODUCTS = {
     SubscriptionTier.BASIC: os.getenv('STRIPE_BASIC_PRODUCT_ID'),
@@ -137,6 +182,7 @@ class SubscriptionManager:
             }
             
             result = self.supabase.table('subscriptions').insert(subscription_data).execute()
+            invalidate_entitlement(user_id)
             
             return {
                 'subscription_id': subscription.id,
@@ -167,6 +213,7 @@ class SubscriptionManager:
             }
             
             result = self.supabase.table('subscriptions').update(subscription_data).eq('id', subscription_id).execute()
+            self._invalidate_rows(result.data)
             
             return result.data[0]
             
@@ -188,6 +235,7 @@ class SubscriptionManager:
             }
             
             result = self.supabase.table('subscriptions').update(subscription_data).eq('id', subscription_id).execute()
+            self._invalidate_rows(result.data)
             
             return result.data[0]
             
@@ -198,27 +246,90 @@ class SubscriptionManager:
     def get_subscription(self, user_id: str) -> Optional[Dict]:
         """Get user's current subscription"""
         try:
-            result = self.supabase.table('subscriptions').select('*').eq('user_id', user_id).eq('status', SubscriptionStatus.ACTIVE.value).execute()
-            
-            if result.data:
-                return result.data[0]
+            entitlement = self.get_entitlement(user_id)
+            if entitlement.status == SubscriptionStatus.ACTIVE:
+                return entitlement.subscription
             return None
             
         except Exception as e:
             logger.error(f"Error getting subscription: {e}")
             return None
 
+    def get_entitlement(self, user_id: str) -> Entitlement:
+        """The user's tier and feature bits, read from the subscriptions table at most once per TTL"""
+        user_id = str(user_id)
+        entitlement = _entitlements.get(user_id)
+        if entitlement is None:
+            entitlement = self._load_entitlement(user_id)
+            _entitlements.set(user_id, entitlement)
+        return entitlement
+
+    def _load_entitlement(self, user_id: str) -> Entitlement:
+        result = self.supabase.table('subscriptions').select('*').eq('user_id', user_id).order('updated_at', desc=True).execute()
+        subscriptions = result.data or []
+        # An active subscription decides the tier; otherwise the latest one only reports its status
+        subscription = next(
+            (row for row in subscriptions if row.get('status') == SubscriptionStatus.ACTIVE.value),
+            subscriptions[0] if subscriptions else None
+        )
+        if subscription and subscription.get('status') == SubscriptionStatus.ACTIVE.value:
+            tier = SubscriptionTier(subscription['tier'])
+        else:
+            tier = SubscriptionTier.FREE
+        status = _SUBSCRIPTION_STATUSES.get(subscription['status']) if subscription else None
+        return Entitlement(user_id, tier, status, TIER_FEATURE_MASKS[tier], subscription)
+
+    def get_current_subscription(self, user_id: str) -> Optional[Entitlement]:
+        """The user's cached entitlement, or None if they never subscribed"""
+        entitlement = self.get_entitlement(user_id)
+        return entitlement if entitlement.subscription else None
+
     def get_subscription_tier(self, user_id: str) -> SubscriptionTier:
         """Get user's current subscription tier"""
-        subscription = self.get_subscription(user_id)
-        if subscription:
-            return SubscriptionTier(subscription['tier'])
-        return SubscriptionTier.FREE
+        return self.get_entitlement(user_id).tier
+
+    def has_feature_access(self, user_id: str, feature: Optional[str] = None):
+        """Check if user has access to a specific feature, or list the features of their tier"""
+        entitlement = self.get_entitlement(user_id)
+        if feature is None:
+            return dict(TIER_FEATURES[entitlement.tier])
+        return bool(entitlement.features & feature_bit(feature))
+
+    def check_usage_limit(self, user_id: str, feature: str) -> bool:
+        """Whether the user has uses of a metered feature left this month"""
+        limit = TIER_FEATURES[self.get_subscription_tier(user_id)].get(USAGE_LIMITS.get(feature))
+        if limit is None:
+            return True
+        return get_usage_meter(self.supabase).within_limit(user_id, feature, limit)
+
+    def reserve_usage(self, user_id: str, feature: str) -> bool:
+        """Count a use of a metered feature if the user has one left this month"""
+        meter = get_usage_meter(self.supabase)
+        limit = TIER_FEATURES[self.get_subscription_tier(user_id)].get(USAGE_LIMITS.get(feature))
+        if limit is None:
+            meter.increment(user_id, feature)
+            return True
+        return meter.reserve(user_id, feature, limit)
+
+    def increment_usage(self, user_id: str, feature: str, amount: int = 1):
+        """Count a use of a metered feature; buffered and written in the background"""
+        get_usage_meter(self.supabase).increment(user_id, feature, amount)
+
+    def refund_usage(self, user_id: str, feature: str):
+        """Give back a reserved use after the work it was reserved for failed"""
+        self.increment_usage(user_id, feature, -1)
+
+    def _invalidate_rows(self, rows):
+        for row in rows or []:
+            if row.get('user_id'):
+                invalidate_entitlement(row['user_id'])
 
-    def has_feature_access(self, user_id: str, feature: str) -> bool:
-        """Check if user has access to a specific feature"""
-        tier = self.get_subscription_tier(user_id)
-        return TIER_FEATURES[tier].get(feature, False)
+    def _invalidate_stripe_subscription(self, stripe_subscription_id):
+        """Drop the entitlements of the users a Stripe subscription belongs to"""
+        if not stripe_subscription_id:
+            return
+        result = self.supabase.table('subscriptions').select('user_id').eq('stripe_subscription_id', stripe_subscription_id).execute()
+        self._invalidate_rows(result.data)
 
     def _get_or_create_stripe_customer(self, user_id: str) -> stripe.Customer:
         """Get or create a Stripe customer for a user"""
@@ -257,18 +368,25 @@ class SubscriptionManager:
         try:
             event_type = event['type']
             
-            if event_type == 'customer.subscription.updated':
-                subscription = event['data']['object']
-                self._update_subscription_status(subscription)
-            elif event_type == 'customer.subscription.deleted':
-                subscription = event['data']['object']
-                self._cancel_subscription(subscription)
-            elif event_type == 'invoice.payment_succeeded':
-                invoice = event['data']['object']
-                self._handle_successful_payment(invoice)
-            elif event_type == 'invoice.payment_failed':
-                invoice = event['data']['object']
-                self._handle_failed_payment(invoice)
+            try:
+                if event_type == 'customer.subscription.updated':
+                    subscription = event['data']['object']
+                    self._update_subscription_status(subscription)
+                elif event_type == 'customer.subscription.deleted':
+                    subscription = event['data']['object']
+                    self._cancel_subscription(subscription)
+                elif event_type == 'invoice.payment_succeeded':
+                    invoice = event['data']['object']
+                    self._handle_successful_payment(invoice)
+                elif event_type == 'invoice.payment_failed':
+                    invoice = event['data']['object']
+                    self._handle_failed_payment(invoice)
+            finally:
+                # Even a failed handler may have written part of the change
+                if event_type.startswith('customer.subscription.'):
+                    self._invalidate_stripe_subscription(event['data']['object'].get('id'))
+                elif event_type.startswith('invoice.'):
+                    self._invalidate_stripe_subscription(event['data']['object'].get('subscription'))
             
             return {'status': 'success'}
             
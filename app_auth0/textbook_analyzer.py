@@ -0,0 +1,413 @@
+from anthropic import Anthropic
+import os
+import json
+import logging
+import threading
+from llm_cache import get_llm_cache, cache_key
+from json_stream import JSONArrayStream
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+CARDS_MODEL = "claude-3-5-sonnet-20240620"
+CARDS_MAX_TOKENS = 2000
+CARDS_TEMPERATURE = 0.3
+CARDS_SYSTEM_PROMPT = "You are an expert in creating educational flashcards. Respond with valid JSON only."
+
+# Extra calls allowed per topic to fill in cards lost to a truncated reply
+MAX_CARD_FOLLOW_UPS = 2
+
+class TextbookAnalyzer:
+    def __init__(self, use_cache=True):
+        self.client = None
+        self.tokens_used = 0
+        self.use_cache = use_cache
+        self.cache = get_llm_cache()
+        self._usage_lock = threading.Lock()
+        self._initialize_client()
+
+    def _initialize_client(self):
+        """Initialize the Anthropic client with API key"""
+        if not hasattr(self, 'client') or self.client is None:
+            api_key = os.getenv('ANTHROPIC_API_KEY')
+            try:
+                self.client = Anthropic(api_key=api_key)
+            except Exception as e:
+                logger.error(f"Error initializing Anthropic client: {e}")
+                raise
+
+    def _record_usage(self, response):
+        """Add the tokens of a Claude response to the running total"""
+        usage = getattr(response, 'usage', None)
+        if usage is None:
+            return
+        with self._usage_lock:
+            self.tokens_used += (usage.input_tokens or 0) + (usage.output_tokens or 0)
+
+    def _strip_code_fence(self, content):
+        """Remove a ```json fence around a Claude response"""
+        if content.startswith("```json") and content.endswith("```"):
+            return content[7:-3]
+        if content.startswith("```") and content.endswith("```"):
+            return content[3:-3]
+        return content
+
+    def _request_json(self, model, max_tokens, temperature, system, prompt, use_cache=None, client=None):
+        """
+        Ask Claude for a JSON reply, serving identical requests from the LLM cache.
+
+        With use_cache=False the cache is not read, but the fresh response
+        still replaces the cached one.
+        """
+        if use_cache is None:
+            use_cache = self.use_cache
+        key = cache_key(model, system, prompt, temperature)
+
+        if use_cache and self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return json.loads(cached)
+
+        response = (client or self.client).messages.create(
+            model=model,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            system=system,
+            messages=[
+                {"role": "user", "content": prompt}
+            ]
+        )
+        self._record_usage(response)
+
+        content = self._strip_code_fence(response.content[0].text)
+        result = json.loads(content)
+
+        # Never cache a reply that was cut off at max_tokens
+        if self.cache is not None and getattr(response, 'stop_reason', None) != 'max_tokens':
+            try:
+                self.cache.put(key, content)
+            except Exception as e:
+                logger.error(f"Error writing LLM cache: {e}")
+        return result
+
+    def analyze_textbook(self, textbook_name, client=None, use_cache=None):
+        """Analyze textbook title to determine subject area and requirements"""
+        logger.info(f"Analyzing subject area for: {textbook_name}")
+        
+        if client is None:
+            client = self.client
+        
+        if client is None:
+            api_key = os.getenv('ANTHROPIC_API_KEY')
+            client = Anthropic(api_key=api_key)
+        
+        analysis_prompt = f"""
+        Based solely on this textbook title: "{textbook_name}", please:
+        
+        1. Identify the primary subject area (e.g., mathematics, physics, economics, biology)
+        2. Identify any specialized subfields (e.g., organic chemistry, linear algebra, microeconomics)
+        3. Determine if this subject typically requires:
+        - Mathematical notation (equations, formulas, symbols)
+        - Chemical formulas or reactions
+        - Biological processes or diagrams
+        - Code snippets
+        - Historical context
+        - Conceptual frameworks
+        - Theoretical models
+        - Examples or case studies
+        - Quotations from key figures
+        
+        Return your analysis as a JSON object with the following structure:
+        {{
+            "primary_subject": "subject name",
+            "subfields": ["subfield1", "subfield2"],
+            "requires_math": true/false,
+            "requires_chemistry_notation": true/false,
+            "requires_biology_notation": true/false,
+            "benefits_from_code": true/false,
+            "benefits_from_history": true/false,
+            "benefits_from_concepts": true/false,
+            "benefits_from_theory": true/false,
+            "benefits_from_examples": true/false,
+            "benefits_from_quotes": true/false,
+            "recommended_focus_areas": ["focus1", "focus2", "focus3"],
+            "special_notation_needs": ["need1", "need2"]
+        }}
+        """
+        
+        try:
+            analysis = self._request_json(
+                model="claude-3-5-sonnet-20240620",
+                max_tokens=1000,
+                temperature=0.2,
+                system="You are an expert in academic subjects who can identify the subject area and learning requirements of a textbook based on its title. Respond with valid JSON only.",
+                prompt=analysis_prompt,
+                use_cache=use_cache,
+                client=client
+            )
+            logger.info(f"Successfully analyzed textbook: {textbook_name}")
+            return analysis
+            
+        except Exception as e:
+            logger.error(f"Error analyzing textbook: {e}")
+            return {
+                "primary_subject": "general",
+                "subfields": [],
+                "requires_math": True,
+                "requires_chemistry_notation": False,
+                "requires_biology_notation": False,
+                "benefits_from_code": False,
+                "benefits_from_history": True,
+                "benefits_from_concepts": True,
+                "benefits_from_theory": True,
+                "benefits_from_examples": True,
+                "benefits_from_quotes": True,
+                "recommended_focus_areas": ["core concepts", "critical thinking", "applications"],
+                "special_notation_needs": []
+            }
+
+    def generate_structure(self, textbook_name, test_mode=False, use_cache=None):
+        """Generate textbook structure using Claude"""
+        try:
+            structure_prompt = f"""
+            Create a detailed structure for the textbook "{textbook_name}".
+            
+            CRITICAL FORMATTING REQUIREMENTS:
+            1. Title Format:
+               - Parts must be exactly "Part I: [Title]", "Part II: [Title]", etc.
+               - Chapters must be exactly "Chapter 1: [Title]", "Chapter 2: [Title]", etc.
+               - DO NOT double-number chapters (NO "Chapter 1: Chapter 3: Title")
+               - Keep chapter numbers sequential within each part
+               - Topics should have clear titles without numbers
+
+            Example of correct formatting:
+            {{
+                "parts": [
+                    {{
+                        "title": "Part I: Fundamentals",
+                        "chapters": [
+                            {{
+                                "title": "Chapter 1: Introduction",
+                                "topics": [...]
+                            }},
+                            {{
+                                "title": "Chapter 2: Basic Concepts",
+                                "topics": [...]
+                            }}
+                        ]
+                    }}
+                ]
+            }}
+
+            Requirements:
+            1. Include 2-3 main parts
+            2. Each part should have 2-3 chapters
+            3. Each chapter should have 2-4 topics
+            4. Every topic must have:
+               - A clear title
+               - A comment explaining its importance
+               - A card_count between 5-10
+               - requires_latex flag indicating if LaTeX is needed
+               - latex_type specifying the type of notation needed
+            """
+
+            structure = self._request_json(
+                model="claude-3-5-sonnet-20240620",
+                max_tokens=2000,
+                temperature=0.3,
+                system="""You are an expert in textbook organization. 
+                         Respond with valid JSON only. 
+                         Ensure parts use Roman numerals (I, II, III).
+                         Ensure chapters use continuous Arabic numerals (1, 2, 3, 4...).
+                         Never double-number chapters.
+                         Maintain consistent formatting throughout.""",
+                prompt=structure_prompt,
+                use_cache=use_cache
+            )
+
+            # Fix and verify formatting
+            chapter_counter = 1
+            for i, part in enumerate(structure['parts']):
+                if not part['title'].startswith(f"Part {self._to_roman(i+1)}:"):
+                    part['title'] = f"Part {self._to_roman(i+1)}: {part['title'].split(':', 1)[-1].strip()}"
+                
+                for chapter in part['chapters']:
+                    if "Chapter" in chapter['title'].split(":", 1)[-1]:
+                        actual_title = chapter['title'].split(":")[-1].strip()
+                        chapter['title'] = f"Chapter {chapter_counter}: {actual_title}"
+                    else:
+                        chapter['title'] = f"Chapter {chapter_counter}: {chapter['title'].split(':', 1)[-1].strip()}"
+                    
+                    chapter_counter += 1
+                    
+                    for topic in chapter['topics']:
+                        if 'requires_latex' not in topic:
+                            topic['requires_latex'] = False
+                        if 'latex_type' not in topic:
+                            topic['latex_type'] = 'none'
+
+            return structure
+
+        except Exception as e:
+            logger.error(f"Error generating structure: {e}")
+            if test_mode:
+                return {
+                    'parts': [
+                        {
+                            'title': 'Part I: Fundamentals',
+                            'chapters': [
+                                {
+                                    'title': 'Chapter 1: Introduction',
+                                    'topics': [
+                                        {
+                                            'title': 'Basic Concepts',
+                                            'comment': 'Foundation of the subject',
+                                            'card_count': 5,
+                                            'requires_latex': False,
+                                            'latex_type': 'none'
+                                        }
+                                    ]
+                                }
+                            ]
+                        }
+                    ]
+                }
+            raise
+
+    def _to_roman(self, num):
+        """Helper method to convert numbers to Roman numerals"""
+        roman_nums = [
+            ('X', 10),
+            ('IX', 9),
+            ('V', 5),
+            ('IV', 4),
+            ('I', 1)
+        ]
+        result = ''
+        for roman, value in roman_nums:
+            while num >= value:
+                result += roman
+                num -= value
+        return result
+
+    def _cards_prompt(self, topic_title, topic_comment, textbook_name, card_count, existing_questions=None):
+        """Build the flashcard prompt for a topic"""
+        cards_prompt = f"""
+            Create {card_count} Anki flashcards for the topic "{topic_title}" from the textbook "{textbook_name}".
+            Topic context: {topic_comment}
+            
+            Return as JSON array of cards:
+            [
+                {{
+                    "question": "Clear, specific question",
+                    "answer": "Comprehensive answer"
+                }}
+            ]
+            """
+        if existing_questions:
+            listed = "\n".join(f"- {question}" for question in existing_questions)
+            cards_prompt += f"""
+            These cards already exist, do not repeat them:
+            {listed}
+            """
+        return cards_prompt
+
+    def _stream_cards(self, cards_prompt, cards, on_card=None):
+        """
+        Stream a JSON array of cards from Claude, appending each complete
+        card to cards as it arrives, so the caller keeps them even if the
+        stream fails later.
+
+        Returns:
+            bool: True if the reply was cut off
+        """
+        parser = JSONArrayStream()
+        with self.client.messages.stream(
+            model=CARDS_MODEL,
+            max_tokens=CARDS_MAX_TOKENS,
+            temperature=CARDS_TEMPERATURE,
+            system=CARDS_SYSTEM_PROMPT,
+            messages=[
+                {"role": "user", "content": cards_prompt}
+            ]
+        ) as stream:
+            for text in stream.text_stream:
+                for card in parser.feed(text):
+                    if not isinstance(card, dict) or 'question' not in card or 'answer' not in card:
+                        logger.warning(f"Skipping malformed card: {card}")
+                        continue
+                    cards.append(card)
+                    if on_card:
+                        on_card(card)
+            message = stream.get_final_message()
+        self._record_usage(message)
+
+        if not parser.started:
+            raise ValueError("Reply did not contain a JSON array")
+        return parser.truncated or message.stop_reason == 'max_tokens'
+
+    def generate_cards_for_topic(self, topic_title, topic_comment, textbook_name, card_count, use_cache=None, on_card=None):
+        """
+        Generate flashcards for a specific topic using Claude.
+
+        Cards are streamed and handed to on_card(card) as each one completes.
+        If the reply is cut off, the complete cards are kept and only the
+        missing ones are requested again.
+        """
+        if use_cache is None:
+            use_cache = self.use_cache
+        cards_prompt = self._cards_prompt(topic_title, topic_comment, textbook_name, card_count)
+        key = cache_key(CARDS_MODEL, CARDS_SYSTEM_PROMPT, cards_prompt, CARDS_TEMPERATURE)
+
+        if use_cache and self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                cards = json.loads(cached)
+                if on_card:
+                    for card in cards:
+                        on_card(card)
+                return cards
+
+        cards = []
+        try:
+            truncated = self._stream_cards(cards_prompt, cards, on_card)
+
+            follow_ups = 0
+            while truncated and len(cards) < card_count and follow_ups < MAX_CARD_FOLLOW_UPS:
+                follow_ups += 1
+                missing = card_count - len(cards)
+                logger.info(f"Cards for {topic_title} were truncated, requesting {missing} more")
+                received_before = len(cards)
+                truncated = self._stream_cards(
+                    self._cards_prompt(
+                        topic_title, topic_comment, textbook_name, missing,
+                        existing_questions=[card['question'] for card in cards]
+                    ),
+                    cards,
+                    on_card
+                )
+                if len(cards) == received_before:
+                    break
+
+        except Exception as e:
+            logger.error(f"Error generating cards: {e}")
+            # Cards already handed to on_card are kept; fallback cards would be stored after them
+            if cards:
+                return cards
+            return [
+                {
+                    "question": f"What is {topic_title}?",
+                    "answer": "This is a test card generated in fallback mode."
+                },
+                {
+                    "question": f"Explain the importance of {topic_title}.",
+                    "answer": "This is another test card generated in fallback mode."
+                }
+            ]
+
+        if self.cache is not None and (not truncated or len(cards) >= card_count):
+            try:
+                self.cache.put(key, json.dumps(cards))
+            except Exception as e:
+                logger.error(f"Error writing LLM cache: {e}")
+        return cards
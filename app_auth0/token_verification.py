@@ -0,0 +1,177 @@
+import os
+import time
+import logging
+import threading
+import requests
+import jwt
+from dotenv import load_dotenv
+from ttl_cache import TTLCache
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+AUTH0_DOMAIN = os.getenv("AUTH0_DOMAIN")
+AUTH0_AUDIENCE = os.getenv("AUTH0_AUDIENCE", "http://localhost:5002/api")
+AUTH0_CLIENT_ID = os.getenv("AUTH0_CLIENT_ID")
+JWKS_URL = os.getenv("AUTH0_JWKS_URL", f"https://{AUTH0_DOMAIN}/.well-known/jwks.json")
+
+# Background refresh period of the key set
+JWKS_REFRESH_SECONDS = int(os.getenv("JWKS_REFRESH_SECONDS", "600"))
+# Unknown kids trigger a refresh at most this often, so junk tokens can't hammer Auth0
+JWKS_MIN_REFRESH_SECONDS = int(os.getenv("JWKS_MIN_REFRESH_SECONDS", "30"))
+# Profiles fetched from /userinfo for tokens without profile claims
+USER_PROFILE_TTL_SECONDS = int(os.getenv("USER_PROFILE_TTL_SECONDS", "3600"))
+USER_PROFILE_CACHE_MAX_BYTES = int(os.getenv("USER_PROFILE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+ALGORITHMS = ["RS256"]
+PROFILE_CLAIMS = ('email', 'email_verified', 'name', 'nickname', 'picture', 'updated_at')
+
+class JWKSCache:
+    """Signing keys from a JWKS endpoint, refreshed in the background and on unknown kids"""
+
+    def __init__(self, jwks_url=JWKS_URL, refresh_seconds=JWKS_REFRESH_SECONDS,
+                 min_refresh_seconds=JWKS_MIN_REFRESH_SECONDS, timeout=5):
+        self.jwks_url = jwks_url
+        self.refresh_seconds = refresh_seconds
+        self.min_refresh_seconds = min_refresh_seconds
+        self.timeout = timeout
+        self._keys = {}
+        self._fetched_at = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._prefetcher = None
+
+    def refresh(self, force=False):
+        """Fetch the key set; returns False if skipped because of the rate limit"""
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._fetched_at is not None and now - self._fetched_at < self.min_refresh_seconds:
+                return False
+            self._fetched_at = now
+
+            response = requests.get(self.jwks_url, timeout=self.timeout)
+            response.raise_for_status()
+
+            keys = {}
+            for jwk in response.json().get('keys', []):
+                if jwk.get('use', 'sig') != 'sig' or 'kid' not in jwk:
+                    continue
+                try:
+                    keys[jwk['kid']] = jwt.PyJWK(jwk).key
+                except jwt.PyJWKError as e:
+                    logger.warning(f"Skipping unusable JWKS key {jwk.get('kid')}: {e}")
+
+            # Swap the whole dict so readers never see a half-built key set
+            self._keys = keys
+            logger.info(f"Loaded {len(keys)} signing keys from {self.jwks_url}")
+            return True
+
+    def get_key(self, kid):
+        """Return the signing key for a kid, refreshing once if it is unknown"""
+        key = self._keys.get(kid)
+        if key is not None:
+            return key
+
+        # Auth0 rotated its keys, or nothing has been fetched yet
+        try:
+            self.refresh()
+        except requests.RequestException as e:
+            logger.error(f"Error fetching JWKS: {e}")
+        key = self._keys.get(kid)
+        if key is None:
+            raise jwt.InvalidTokenError(f"Unknown signing key: {kid}")
+        return key
+
+    def start_prefetch(self):
+        """Keep the key set warm from a daemon thread"""
+        if self._prefetcher is not None:
+            return
+        self._prefetcher = threading.Thread(target=self._prefetch_loop, name='jwks-prefetch', daemon=True)
+        self._prefetcher.start()
+
+    def _prefetch_loop(self):
+        while True:
+            try:
+                self.refresh(force=True)
+            except Exception as e:
+                logger.error(f"Error prefetching JWKS: {e}")
+            if self._stop.wait(self.refresh_seconds):
+                return
+
+    def stop_prefetch(self):
+        self._stop.set()
+
+_jwks_cache = None
+_jwks_cache_lock = threading.Lock()
+
+def get_jwks_cache():
+    """Return the process-wide JWKS cache, starting its prefetch thread on first use"""
+    global _jwks_cache
+    with _jwks_cache_lock:
+        if _jwks_cache is None:
+            _jwks_cache = JWKSCache()
+            _jwks_cache.start_prefetch()
+        return _jwks_cache
+
+def _audiences():
+    return [audience for audience in (AUTH0_AUDIENCE, AUTH0_CLIENT_ID) if audience]
+
+def verify_token(token, audience=None, issuer=None, jwks_cache=None):
+    """
+    Verify an Auth0 RS256 token locally and return its claims.
+
+    Raises a jwt.InvalidTokenError subclass if the token is not valid.
+    """
+    header = jwt.get_unverified_header(token)
+    if header.get('alg') not in ALGORITHMS:
+        raise jwt.InvalidAlgorithmError(f"Unsupported algorithm: {header.get('alg')}")
+
+    key = (jwks_cache or get_jwks_cache()).get_key(header.get('kid'))
+    return jwt.decode(
+        token,
+        key,
+        algorithms=ALGORITHMS,
+        audience=audience or _audiences(),
+        issuer=issuer or f"https://{AUTH0_DOMAIN}/",
+        options={"require": ["exp", "sub"]}
+    )
+
+_profiles = TTLCache(USER_PROFILE_TTL_SECONDS, max_entries=100000,
+                     max_bytes=USER_PROFILE_CACHE_MAX_BYTES, hash_keys=True)
+
+def get_user_profile(token, claims):
+    """
+    Return the claims merged with the user's profile.
+
+    Access tokens usually carry no profile claims; those are fetched from
+    /userinfo once per user and cached, instead of once per request.
+    """
+    if claims.get('email'):
+        return dict(claims)
+
+    sub = claims['sub']
+    cached = _profiles.get(sub)
+    if cached is not None:
+        return {**cached, **claims}
+
+    response = requests.get(
+        f"https://{AUTH0_DOMAIN}/userinfo",
+        headers={"Authorization": f"Bearer {token}"},
+        timeout=5
+    )
+    response.raise_for_status()
+    profile = {claim: value for claim, value in response.json().items() if claim in PROFILE_CLAIMS}
+    _profiles.set(sub, profile)
+    return {**profile, **claims}
+
+def get_bearer_token(auth_header):
+    """Return the token of a 'Bearer <token>' header, or None"""
+    if not auth_header:
+        return None
+    parts = auth_header.split()
+    if len(parts) != 2 or parts[0].lower() != 'bearer':
+        return None
+    return parts[1]
@@ -0,0 +1,167 @@
+import sys
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+_MISSING = object()
+
+# Expiry is tracked in this many slots per ttl
+WHEEL_SLOTS_PER_TTL = 64
+
+def approximate_size(value):
+    """Rough size in bytes of a value made of dicts, lists, tuples and scalars"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(approximate_size(key) + approximate_size(item) for key, item in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(approximate_size(item) for item in value)
+    return size
+
+def hash_key(key):
+    """Fixed size digest of a key, so secrets such as bearer tokens aren't held in memory"""
+    data = key.encode() if isinstance(key, str) else repr(key).encode()
+    return hashlib.sha256(data).digest()
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries expire after ttl_seconds.
+
+    Entries are bounded by count and, with max_bytes, by their approximate
+    size; the least recently used go first. Expired entries are swept by a
+    timing wheel on every write, so memory is given back even for keys that
+    are never read again, at O(1) amortized cost per write. With hash_keys
+    the cache keeps a digest of each key instead of the key itself.
+    """
+
+    def __init__(self, ttl_seconds, max_entries=10000, clock=time.monotonic,
+                 max_bytes=None, sizeof=approximate_size, hash_keys=False):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._hash_keys = hash_keys
+        self._clock = clock
+        self._entries = OrderedDict()
+        # Timing wheel: tick -> keys expiring during that tick
+        self._tick_seconds = max(ttl_seconds / WHEEL_SLOTS_PER_TTL, 1e-3)
+        self._wheel = {}
+        self._swept_tick = self._tick(clock())
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _key(self, key):
+        return hash_key(key) if self._hash_keys else key
+
+    def _tick(self, at):
+        return int(at // self._tick_seconds)
+
+    def _remove(self, key):
+        _, _, size, tick = self._entries.pop(key)
+        slot = self._wheel[tick]
+        slot.discard(key)
+        if not slot:
+            del self._wheel[tick]
+        self._bytes -= size
+
+    def _sweep(self, now):
+        """Drop the entries of every slot the clock has moved past"""
+        current = self._tick(now)
+        if current <= self._swept_tick:
+            return
+        if current - self._swept_tick <= len(self._wheel):
+            ticks = range(self._swept_tick, current)
+        else:
+            # Idle for longer than the wheel holds; visit only the occupied slots
+            ticks = [tick for tick in self._wheel if tick < current]
+        for tick in ticks:
+            for key in self._wheel.pop(tick, ()):
+                _, _, size, _ = self._entries.pop(key)
+                self._bytes -= size
+                self.expirations += 1
+        self._swept_tick = current
+
+    def get(self, key, default=None):
+        """Return the cached value, or default if it is missing or expired"""
+        key = self._key(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at, _, _ = entry
+            if expires_at <= self._clock():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl_seconds=None):
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        key = self._key(key)
+        size = self._sizeof(value) if self.max_bytes is not None else 0
+        with self._lock:
+            now = self._clock()
+            self._sweep(now)
+            if key in self._entries:
+                self._remove(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                # Would evict everything else and still not fit
+                self.evictions += 1
+                return
+            expires_at = now + ttl
+            # Never behind the sweep, or the slot would only be visited after an idle spell
+            tick = max(self._tick(expires_at), self._swept_tick)
+            self._entries[key] = (value, expires_at, size, tick)
+            self._wheel.setdefault(tick, set()).add(key)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or (
+                    self.max_bytes is not None and self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def get_or_load(self, key, loader):
+        """Return the cached value, calling loader() and caching its result on a miss"""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = loader()
+            self.set(key, value)
+        return value
+
+    def invalidate(self, key):
+        key = self._key(key)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def invalidate_where(self, predicate):
+        """Drop every entry whose key matches predicate(key); with hash_keys it sees the digests"""
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._wheel.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations
+        }
@@ -0,0 +1,235 @@
+"""
+Usage metering.
+
+Quota counters live in subscription_usage, one row per user, feature and
+month. Increments are buffered in the process and flushed as one
+aggregated upsert (increment_subscription_usage, see
+migrations/add_usage_metering.py) every USAGE_FLUSH_SECONDS, so counting
+a use costs no database write. A use is reserved when the request is
+accepted, checking and counting it in one step, and refunded with a
+negative increment if the work fails. A quota check adds the buffered
+count to the persisted one, which is cached for USAGE_CACHE_TTL_SECONDS;
+across processes a user can overshoot a quota by what the others haven't
+flushed or by what this one hasn't reread yet.
+
+Per-user token buckets rate-limit the expensive AI endpoints.
+"""
+import os
+import time
+import atexit
+import logging
+import threading
+from datetime import datetime, timezone
+from functools import wraps
+from flask import request, jsonify
+from ttl_cache import TTLCache
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+USAGE_FLUSH_SECONDS = float(os.getenv('USAGE_FLUSH_SECONDS', '5'))
+# Flush early once this many increments are buffered
+USAGE_FLUSH_MAX_PENDING = int(os.getenv('USAGE_FLUSH_MAX_PENDING', '1000'))
+USAGE_CACHE_TTL_SECONDS = int(os.getenv('USAGE_CACHE_TTL_SECONDS', '30'))
+
+AI_RATE_LIMIT_PER_MINUTE = float(os.getenv('AI_RATE_LIMIT_PER_MINUTE', '6'))
+AI_RATE_LIMIT_BURST = int(os.getenv('AI_RATE_LIMIT_BURST', '10'))
+
+def period_start(now=None):
+    """First day of the (UTC) month a use is counted in"""
+    now = now or datetime.now(timezone.utc)
+    return now.date().replace(day=1).isoformat()
+
+class UsageMeter:
+    """Buffered usage counters, flushed to subscription_usage"""
+
+    def __init__(self, client=None, cache_ttl_seconds=USAGE_CACHE_TTL_SECONDS,
+                 flush_seconds=USAGE_FLUSH_SECONDS, max_pending=USAGE_FLUSH_MAX_PENDING, now=None):
+        if client is None:
+            from supabase_config import supabase as client
+        self.supabase = client
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self._now = now or (lambda: datetime.now(timezone.utc))
+        # (user_id, feature, period) -> count not yet flushed
+        self._pending = {}
+        self._flushing = {}
+        self._pending_total = 0
+        self._lock = threading.Lock()
+        # Flushes run one at a time, so a failed one can be merged back in order
+        self._flush_lock = threading.Lock()
+        self._persisted = TTLCache(cache_ttl_seconds, max_entries=100000)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._flusher = None
+
+    def _key(self, user_id, feature):
+        return (str(user_id), feature, period_start(self._now()))
+
+    def increment(self, user_id, feature, amount=1):
+        """Count a use; written to the database by the next flush"""
+        key = self._key(user_id, feature)
+        with self._lock:
+            self._pending[key] = self._pending.get(key, 0) + amount
+            self._pending_total += amount
+            full = self._pending_total >= self.max_pending
+        if full:
+            self._wake.set()
+
+    def _persisted_count(self, key):
+        count = self._persisted.get(key)
+        if count is None:
+            user_id, feature, period = key
+            result = self.supabase.table('subscription_usage').select('usage_count').eq(
+                'user_id', user_id
+            ).eq('feature', feature).eq('period_start', period).execute()
+            count = (result.data[0].get('usage_count') or 0) if result.data else 0
+            self._persisted.set(key, count)
+        return count
+
+    def usage(self, user_id, feature):
+        """This month's uses, flushed or not"""
+        key = self._key(user_id, feature)
+        persisted = self._persisted_count(key)
+        with self._lock:
+            return persisted + self._pending.get(key, 0) + self._flushing.get(key, 0)
+
+    def within_limit(self, user_id, feature, limit):
+        """Whether another use fits in this month's limit"""
+        return self.usage(user_id, feature) < limit
+
+    def reserve(self, user_id, feature, limit):
+        """
+        Count a use if it fits in this month's limit; returns whether it did.
+        The check and the count are one step, so concurrent requests in this
+        process can't all pass the check before any of them is counted.
+        """
+        key = self._key(user_id, feature)
+        persisted = self._persisted_count(key)
+        with self._lock:
+            if persisted + self._pending.get(key, 0) + self._flushing.get(key, 0) >= limit:
+                return False
+            self._pending[key] = self._pending.get(key, 0) + 1
+            self._pending_total += 1
+            full = self._pending_total >= self.max_pending
+        if full:
+            self._wake.set()
+        return True
+
+    def flush(self):
+        """Write the buffered counts in one statement; returns how many rows it touched"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending, self._pending_total = self._pending, {}, 0
+                # Still counted by usage() until the new totals are cached
+                self._flushing = pending
+            if not pending:
+                return 0
+            rows = [
+                {'user_id': user_id, 'feature': feature, 'period_start': period, 'amount': amount}
+                for (user_id, feature, period), amount in pending.items()
+                # A refund cancelling an unflushed reservation
+                if amount
+            ]
+            if not rows:
+                with self._lock:
+                    self._flushing = {}
+                return 0
+            try:
+                result = self.supabase.rpc('increment_subscription_usage', {'p_rows': rows}).execute()
+            except Exception:
+                # Keep the counts for the next flush rather than losing them
+                with self._lock:
+                    for key, amount in pending.items():
+                        self._pending[key] = self._pending.get(key, 0) + amount
+                        self._pending_total += amount
+                    self._flushing = {}
+                raise
+            for row in result.data or []:
+                key = (str(row['user_id']), row['feature'], str(row['period_start']))
+                self._persisted.set(key, row['usage_count'])
+            with self._lock:
+                self._flushing = {}
+            return len(rows)
+
+    def start(self):
+        """Flush in a background thread every flush_seconds, and once more at exit"""
+        if self._flusher is not None:
+            return
+        self._flusher = threading.Thread(target=self._flush_loop, name='usage-flush', daemon=True)
+        self._flusher.start()
+        atexit.register(self.stop)
+
+    def _flush_loop(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing usage counters: {e}")
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Error flushing usage counters: {e}")
+
+_meter = None
+_meter_lock = threading.Lock()
+
+def get_usage_meter(client=None):
+    """Return the process-wide meter, starting its flush thread on first use"""
+    global _meter
+    with _meter_lock:
+        if _meter is None:
+            _meter = UsageMeter(client)
+            _meter.start()
+        return _meter
+
+def flush_usage():
+    """Write this process's buffered usage now, e.g. before a worker process exits"""
+    if _meter is not None:
+        _meter.stop()
+
+class TokenBucketLimiter:
+    """Per-key token buckets holding up to burst tokens, refilled at rate_per_minute"""
+
+    def __init__(self, rate_per_minute=AI_RATE_LIMIT_PER_MINUTE, burst=AI_RATE_LIMIT_BURST, clock=time.monotonic):
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self._clock = clock
+        # A bucket left alone until it is full again is the same as no bucket
+        self._buckets = TTLCache(burst / self.rate, max_entries=100000, clock=clock)
+        self._lock = threading.Lock()
+
+    def acquire(self, key, cost=1):
+        """Take cost tokens; returns 0 if allowed, else the seconds until they are available"""
+        with self._lock:
+            now = self._clock()
+            tokens, updated_at = self._buckets.get(key) or (self.burst, now)
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            if tokens >= cost:
+                self._buckets.set(key, (tokens - cost, now))
+                return 0
+            self._buckets.set(key, (tokens, now))
+            return (cost - tokens) / self.rate
+
+ai_rate_limiter = TokenBucketLimiter()
+
+def rate_limited(limiter=None):
+    """Decorator answering 429 once the caller has used up their tokens; goes below requires_auth"""
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            user = getattr(request, 'user', None) or {}
+            wait = (limiter or ai_rate_limiter).acquire(user.get('sub') or request.remote_addr)
+            if wait:
+                response = jsonify({'error': 'Too many requests, please slow down'})
+                response.headers['Retry-After'] = str(int(wait) + 1)
+                return response, 429
+            return f(*args, **kwargs)
+        return decorated
+    return decorator
@@ -4,6 +4,7 @@ from dotenv import load_dotenv
 import logging
 import uuid
 from datetime import datetime
+from identity import invalidate_user
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -62,6 +63,7 @@ def create_or_update_user(auth0_user):
                 logger.info(f"Added picture for new user: {user_data['email']}")
             
             result = supabase.table('users').insert(user_data).execute()
+            invalidate_user(auth0_user['sub'])
             if not result.data:
                 logger.error("Failed to create user in Supabase")
                 return None
@@ -89,6 +91,7 @@ def create_or_update_user(auth0_user):
                 update_data['picture'] = user_data['picture']
             
             result = supabase.table('users').update(update_data).eq('id', existing_id).execute()
+            invalidate_user(auth0_user['sub'])
             
             if not result.data:
                 logger.error("Failed to update user in Supabase")
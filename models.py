@@ -1,6 +1,6 @@
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.dialects.postgresql import UUID, ARRAY
 from sqlalchemy import event, text
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -183,6 +183,15 @@ class StudySession(db.Model):
     started_at = db.Column(db.DateTime, default=datetime.utcnow)
     ended_at = db.Column(db.DateTime)
     
+    # Running totals of the reviews, kept by a trigger on card_reviews where
+    # app_auth0/migrations/add_session_statistics.py ran; db.create_all()
+    # doesn't install it, so the API here counts the reviews instead
+    cards_studied = db.Column(db.Integer, default=0)
+    correct_answers = db.Column(db.Integer, default=0)
+    quality_sum = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    total_time_ms = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
+    time_histogram = db.Column(ARRAY(db.Integer), nullable=False, server_default='{0,0,0,0,0,0,0,0,0}')
+    
     # Relationships
     reviews = db.relationship('CardReview', backref='session', lazy=True, cascade='all, delete-orphan')
 
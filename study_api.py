@@ -1,6 +1,7 @@
 from flask import Blueprint, request, jsonify
 from datetime import datetime, timedelta
 import uuid
+from app_auth0.study.sm2 import sm2_step, STUDY_API
 from models_with_states import (
     db, User, Deck, Card, UserCardState, StudySession,
     Part, Chapter, Topic
@@ -16,24 +17,7 @@ def calculate_next_review(quality, prev_interval, prev_easiness, prev_repetition
     if quality < 0 or quality > 5:
         raise ValueError("Quality must be between 0 and 5")
 
-    # Update easiness factor
-    easiness = prev_easiness + (0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
-    easiness = max(1.3, easiness)  # Minimum easiness factor is 1.3
-
-    # Update interval
-    if quality < 3:
-        # If quality is poor, reset repetitions and start over
-        interval = 1
-        repetitions = 0
-    else:
-        # Calculate new interval based on previous performance
-        if prev_repetitions == 0:
-            interval = 1
-        elif prev_repetitions == 1:
-            interval = 6
-        else:
-            interval = round(prev_interval * easiness)
-        repetitions = prev_repetitions + 1
+    easiness, interval, repetitions = sm2_step(quality, prev_easiness, prev_interval, prev_repetitions, STUDY_API)
 
     return {
         'interval': interval,
@@ -83,22 +67,26 @@ def get_next_cards():
         return jsonify({'error': 'user_id and deck_id are required'}), 400
     
     try:
-        # Get active cards that are due for review
+        # Most overdue active cards first, with their titles in the same query;
+        # served by the (user_id, next_review) index on user_card_states
         now = datetime.utcnow()
-        card_states = UserCardState.query.join(Card).filter(
+        rows = db.session.query(UserCardState, Card, Topic, Chapter, Part).join(
+            Card, Card.id == UserCardState.card_id
+        ).join(
+            Topic, Topic.id == Card.topic_id
+        ).join(
+            Chapter, Chapter.id == Topic.chapter_id
+        ).join(
+            Part, Part.id == Chapter.part_id
+        ).filter(
             UserCardState.user_id == user_id,
             Card.deck_id == deck_id,
             UserCardState.is_active == True,
             UserCardState.next_review <= now
-        ).limit(limit).all()
+        ).order_by(UserCardState.next_review).limit(limit).all()
         
         cards_data = []
-        for state in card_states:
-            card = Card.query.get(state.card_id)
-            topic = Topic.query.get(card.topic_id)
-            chapter = Chapter.query.get(topic.chapter_id)
-            part = Part.query.get(chapter.part_id)
-            
+        for state, card, topic, chapter, part in rows:
             cards_data.append({
                 'card_id': str(card.id),
                 'front': card.front,
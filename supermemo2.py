@@ -1,4 +1,5 @@
 from datetime import datetime, timedelta
+from app_auth0.study.sm2 import sm2_step, CLASSIC
 
 def calculate_sm2_values(quality: int, prev_easiness: float, prev_interval: int, prev_repetitions: int) -> tuple:
     """
@@ -13,26 +14,7 @@ def calculate_sm2_values(quality: int, prev_easiness: float, prev_interval: int,
     Returns:
         tuple: (new_easiness, new_interval, new_repetitions)
     """
-    if quality < 3:
-        # If quality is less than 3, reset repetitions and interval
-        new_repetitions = 0
-        new_interval = 1
-    else:
-        new_repetitions = prev_repetitions + 1
-        if new_repetitions == 1:
-            new_interval = 1
-        elif new_repetitions == 2:
-            new_interval = 6
-        else:
-            new_interval = round(prev_interval * prev_easiness)
-    
-    # Calculate new easiness factor
-    new_easiness = prev_easiness + (0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
-    
-    # Ensure easiness doesn't go below 1.3
-    new_easiness = max(1.3, new_easiness)
-    
-    return new_easiness, new_interval, new_repetitions
+    return sm2_step(quality, prev_easiness, prev_interval, prev_repetitions, CLASSIC)
 
 def get_next_review_date(interval: int) -> datetime:
     """Calculate the next review date based on the interval."""
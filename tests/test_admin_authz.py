@@ -0,0 +1,67 @@
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app_auth0'))
+
+from admin_authz import (
+    compile_admin_authz, get_admin_authz, invalidate_admin_authz,
+    is_admin_user, has_admin_permission, admin_roles_of, SUPER_ADMIN_USER_ID
+)
+
+class FakeAdminTables:
+    """The four admin tables, counting the queries made"""
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.queries = 0
+
+    def table(self, name):
+        self.name = name
+        return self
+
+    def select(self, columns):
+        return self
+
+    def execute(self):
+        self.queries += 1
+        return SimpleNamespace(data=self.tables[self.name])
+
+def admin_tables():
+    return FakeAdminTables({
+        'admin_permissions': [{'id': 'p1', 'name': 'manage_users'}, {'id': 'p2', 'name': 'manage_roles'},
+                              {'id': 'p3', 'name': 'view_analytics'}],
+        'admin_roles': [{'id': 'r1', 'name': 'support'}, {'id': 'r2', 'name': 'analyst'}, {'id': 'r3', 'name': 'empty'}],
+        'admin_role_permissions': [{'role_id': 'r1', 'permission_id': 'p1'}, {'role_id': 'r2', 'permission_id': 'p3'},
+                                   {'role_id': 'gone', 'permission_id': 'p2'}],
+        'user_admin_roles': [{'user_id': 'alice', 'role_id': 'r1'}, {'user_id': 'alice', 'role_id': 'r2'},
+                             {'user_id': 'bob', 'role_id': 'r3'}, {'user_id': 'carol', 'role_id': 'gone'}]
+    })
+
+def test_compiled_masks_combine_the_roles_of_each_user():
+    authz = compile_admin_authz(admin_tables())
+
+    assert set(authz.user_masks) == {'alice', 'bob'}
+    assert authz.user_masks['alice'] == authz.permission_bits['manage_users'] | authz.permission_bits['view_analytics']
+    assert authz.user_masks['bob'] == 0
+    assert authz.user_roles['alice'] == ['support', 'analyst']
+
+def test_checks_use_one_compiled_snapshot_until_invalidated():
+    invalidate_admin_authz()
+    client = admin_tables()
+
+    assert has_admin_permission('alice', 'manage_users', client)
+    assert not has_admin_permission('alice', 'manage_roles', client)
+    assert not has_admin_permission('alice', 'no_such_permission', client)
+    assert is_admin_user('bob', client) and not is_admin_user('carol', client)
+    assert is_admin_user(SUPER_ADMIN_USER_ID, client)
+    assert admin_roles_of('alice', client) == ['support', 'analyst']
+    assert client.queries == 4
+
+    # A role assignment route changed the data
+    client.tables['user_admin_roles'].append({'user_id': 'carol', 'role_id': 'r1'})
+    assert not is_admin_user('carol', client)
+    invalidate_admin_authz()
+    assert has_admin_permission('carol', 'manage_users', client)
+    assert get_admin_authz(client) is get_admin_authz(client)
+    assert client.queries == 8
@@ -0,0 +1,189 @@
+import os
+import sys
+import uuid
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app_auth0'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app_auth0', 'migrations'))
+
+from study.sm2 import sm2_step, AUTH0
+from study.load_balancer import balance_interval, fuzz_days
+
+# A disposable local Postgres, e.g. postgresql+psycopg2://postgres@localhost:5432/postgres
+TEST_DATABASE_URL = os.getenv('TEST_DATABASE_URL')
+
+pytestmark = pytest.mark.skipif(not TEST_DATABASE_URL, reason='TEST_DATABASE_URL is not set')
+
+USER_ID = str(uuid.uuid4())
+DECK_ID = str(uuid.uuid4())
+SESSION_ID = str(uuid.uuid4())
+
+@pytest.fixture
+def connection():
+    from sqlalchemy import create_engine, text
+    from add_due_load import DUE_COUNTS_SQL
+    from add_scheduler_parameters import SCHEDULER_PARAMETERS_SQL, APPLY_CARD_REVIEW_SQL
+
+    schema = f"sm2_parity_{uuid.uuid4().hex[:8]}"
+    engine = create_engine(TEST_DATABASE_URL)
+    with engine.connect() as connection:
+        connection.execute(text(f"CREATE SCHEMA {schema}; SET search_path TO {schema}, public;"))
+        # Only the columns apply_card_review touches, with the production types
+        connection.execute(text("""
+            CREATE TABLE users (id UUID PRIMARY KEY);
+            CREATE TABLE decks (id UUID PRIMARY KEY, user_id UUID);
+            CREATE TABLE study_sessions (id UUID PRIMARY KEY, user_id UUID);
+            CREATE TABLE cards (
+                id UUID PRIMARY KEY, deck_id UUID REFERENCES decks(id),
+                interval INTEGER DEFAULT 1, easiness FLOAT DEFAULT 2.5, repetitions INTEGER DEFAULT 0,
+                next_review TIMESTAMP WITH TIME ZONE, first_reviewed_at TIMESTAMP WITH TIME ZONE
+            );
+            CREATE TABLE card_reviews (
+                id VARCHAR PRIMARY KEY, session_id VARCHAR NOT NULL, card_id VARCHAR NOT NULL,
+                quality INTEGER NOT NULL, time_taken INTEGER, created_at TIMESTAMP,
+                prev_easiness FLOAT, prev_interval INTEGER, prev_repetitions INTEGER,
+                new_easiness FLOAT, new_interval INTEGER, new_repetitions INTEGER
+            );
+        """))
+        connection.execute(text(DUE_COUNTS_SQL))
+        connection.execute(text(SCHEDULER_PARAMETERS_SQL))
+        connection.execute(text(APPLY_CARD_REVIEW_SQL))
+        connection.execute(text("INSERT INTO users VALUES (:id)"), {'id': USER_ID})
+        connection.execute(text("INSERT INTO decks VALUES (:id, :user_id)"), {'id': DECK_ID, 'user_id': USER_ID})
+        connection.execute(text("INSERT INTO study_sessions VALUES (:id, :user_id)"), {'id': SESSION_ID, 'user_id': USER_ID})
+        try:
+            yield connection
+        finally:
+            # Nothing was committed, so this drops the schema as well
+            connection.rollback()
+
+def apply(connection, card_id, quality, reviewed_at=None, user_id=USER_ID, load_balance=False, session_id=SESSION_ID):
+    from sqlalchemy import text
+    return connection.execute(
+        text("SELECT * FROM apply_card_review(:card_id, :user_id, :session_id, :quality, NULL, :reviewed_at, :load_balance)"),
+        {'card_id': card_id, 'user_id': user_id, 'session_id': session_id,
+         'quality': quality, 'reviewed_at': reviewed_at, 'load_balance': load_balance}
+    ).mappings().one()
+
+def test_matches_the_python_core_bit_for_bit(connection):
+    from sqlalchemy import text
+    rng = random.Random(7)
+    reviewed_at = datetime(2024, 5, 10, 12, 0, tzinfo=timezone.utc)
+
+    for _ in range(100):
+        card_id = str(uuid.uuid4())
+        state = (rng.choice([1.3, 1.7, 2.36, 2.5, 2.9]), rng.randint(1, 30), rng.randint(0, 4))
+        connection.execute(
+            text("INSERT INTO cards (id, deck_id, easiness, interval, repetitions) VALUES (:id, :deck_id, :e, :i, :r)"),
+            {'id': card_id, 'deck_id': DECK_ID, 'e': state[0], 'i': state[1], 'r': state[2]}
+        )
+        for _ in range(8):
+            quality = rng.randint(0, 5)
+            expected = sm2_step(quality, *state, AUTH0)
+            row = apply(connection, card_id, quality, reviewed_at)
+
+            assert (row['easiness'], row['interval'], row['repetitions']) == expected
+            assert row['next_review'] == reviewed_at + timedelta(days=expected[1])
+            state = expected
+
+        stored = connection.execute(text("SELECT easiness, interval, repetitions FROM cards WHERE id = :id"), {'id': card_id}).one()
+        assert tuple(stored) == state
+
+    assert connection.execute(text("SELECT COUNT(*) FROM card_reviews")).scalar() == 800
+
+def test_rejects_other_users_and_unknown_cards(connection):
+    from sqlalchemy import text
+    from sqlalchemy.exc import DBAPIError
+
+    card_id = str(uuid.uuid4())
+    connection.execute(text("INSERT INTO cards (id, deck_id) VALUES (:id, :deck_id)"), {'id': card_id, 'deck_id': DECK_ID})
+
+    with pytest.raises(DBAPIError) as error, connection.begin_nested():
+        apply(connection, card_id, 5, user_id=str(uuid.uuid4()))
+    assert error.value.orig.pgcode == '42501'
+
+    with pytest.raises(DBAPIError) as error, connection.begin_nested():
+        apply(connection, str(uuid.uuid4()), 5)
+    assert error.value.orig.pgcode == 'P0002'
+
+def test_rejects_sessions_of_other_users(connection):
+    from sqlalchemy import text
+    from sqlalchemy.exc import DBAPIError
+
+    card_id = str(uuid.uuid4())
+    other_session = str(uuid.uuid4())
+    connection.execute(text("INSERT INTO cards (id, deck_id) VALUES (:id, :deck_id)"), {'id': card_id, 'deck_id': DECK_ID})
+    connection.execute(text("INSERT INTO study_sessions VALUES (:id, :user_id)"), {'id': other_session, 'user_id': str(uuid.uuid4())})
+
+    for session_id in (other_session, str(uuid.uuid4())):
+        with pytest.raises(DBAPIError) as error, connection.begin_nested():
+            apply(connection, card_id, 5, session_id=session_id)
+        assert error.value.orig.pgcode == '42501'
+
+    assert connection.execute(text("SELECT repetitions FROM cards WHERE id = :id"), {'id': card_id}).scalar() == 0
+    assert connection.execute(text("SELECT COUNT(*) FROM card_reviews")).scalar() == 0
+
+def test_fitted_modifiers_scale_intervals_deck_over_user(connection):
+    from sqlalchemy import text
+    other_deck = str(uuid.uuid4())
+    connection.execute(text("INSERT INTO decks VALUES (:id, :user_id)"), {'id': other_deck, 'user_id': USER_ID})
+    connection.execute(
+        text("INSERT INTO scheduler_parameters (user_id, deck_id, weights, interval_modifier, target_retention, review_count) "
+             "VALUES (:user_id, :deck_id, '{}', :modifier, 0.9, 500)"),
+        [{'user_id': USER_ID, 'deck_id': None, 'modifier': 1.3}, {'user_id': USER_ID, 'deck_id': DECK_ID, 'modifier': 0.7}]
+    )
+
+    for deck_id, modifier in ((DECK_ID, 0.7), (other_deck, 1.3)):
+        card_id = str(uuid.uuid4())
+        connection.execute(
+            text("INSERT INTO cards (id, deck_id, easiness, interval, repetitions) VALUES (:id, :deck_id, 2.5, 20, 3)"),
+            {'id': card_id, 'deck_id': deck_id}
+        )
+        row = apply(connection, card_id, 4)
+        assert (row['easiness'], row['interval'], row['repetitions']) == sm2_step(4, 2.5, 20, 3, AUTH0, modifier)
+
+def test_load_balancing_matches_the_python_balancer(connection):
+    from sqlalchemy import text
+    rng = random.Random(11)
+    reviewed_at = datetime(2024, 5, 10, 12, 0, tzinfo=timezone.utc)
+    today = reviewed_at.date()
+
+    load = {}
+    for days in range(1, 150):
+        load[today + timedelta(days=days)] = rng.randint(0, 6)
+    connection.execute(
+        text("INSERT INTO deck_due_counts (deck_id, due_date, count) VALUES (:deck_id, :due_date, :count)"),
+        [{'deck_id': DECK_ID, 'due_date': day, 'count': count} for day, count in load.items()]
+    )
+
+    for _ in range(30):
+        card_id = str(uuid.uuid4())
+        state = (rng.choice([1.7, 2.5, 2.9]), rng.randint(1, 20), rng.randint(0, 4))
+        connection.execute(
+            text("INSERT INTO cards (id, deck_id, easiness, interval, repetitions) VALUES (:id, :deck_id, :e, :i, :r)"),
+            {'id': card_id, 'deck_id': DECK_ID, 'e': state[0], 'i': state[1], 'r': state[2]}
+        )
+        due = None
+        for _ in range(3):
+            quality = rng.randint(3, 5)
+            easiness, interval, repetitions = sm2_step(quality, *state, AUTH0)
+            fuzz = fuzz_days(interval)
+            interval = balance_interval(interval, {
+                days: load.get(today + timedelta(days=days), 0) - (today + timedelta(days=days) == due)
+                for days in range(interval - fuzz, interval + fuzz + 1)
+            })
+
+            row = apply(connection, card_id, quality, reviewed_at, load_balance=True)
+
+            assert row['interval'] == interval
+            if due is not None:
+                load[due] -= 1
+            due = today + timedelta(days=interval)
+            load[due] = load.get(due, 0) + 1
+            state = (easiness, interval, repetitions)
+
+    stored = dict(connection.execute(text("SELECT due_date, count FROM deck_due_counts WHERE count <> 0")).all())
+    assert stored == {day: count for day, count in load.items() if count}
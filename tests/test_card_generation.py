@@ -0,0 +1,96 @@
+import os
+import sys
+import time
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app_auth0'))
+
+from card_generation import generate_cards_concurrently, iter_topics
+
+def make_structure(parts=3, chapters=3, topics=4):
+    """Build a structure shaped like the output of generate_structure"""
+    return {
+        'parts': [
+            {
+                'title': f'Part {p}',
+                'chapters': [
+                    {
+                        'title': f'Chapter {p}.{c}',
+                        'topics': [
+                            {'title': f'Topic {p}.{c}.{t}', 'comment': '', 'card_count': 2}
+                            for t in range(topics)
+                        ]
+                    }
+                    for c in range(chapters)
+                ]
+            }
+            for p in range(parts)
+        ]
+    }
+
+class FakeAnalyzer:
+    """Stands in for TextbookAnalyzer with a fixed per-call latency"""
+
+    def __init__(self, delay=0.05, fail_on=None):
+        self.delay = delay
+        self.fail_on = fail_on
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def generate_cards_for_topic(self, topic_title, topic_comment, textbook_name, card_count, on_card=None):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            # Later topics finish first so completion order differs from input order
+            time.sleep(self.delay / (1 + len(topic_title) % 3))
+            if topic_title == self.fail_on:
+                raise RuntimeError("boom")
+            cards = [{'question': f'{topic_title} Q{i}', 'answer': 'A'} for i in range(card_count)]
+            for card in cards:
+                if on_card:
+                    on_card(card)
+            return cards
+        finally:
+            with self.lock:
+                self.active -= 1
+
+def test_results_are_ordered_by_order_index():
+    structure = make_structure()
+    results = generate_cards_concurrently(FakeAnalyzer(), 'Book', structure, max_workers=8)
+
+    expected_keys = [(p, c, t) for p, c, t, _ in iter_topics(structure)]
+    assert list(results) == expected_keys
+    assert results[(1, 2, 3)]['cards'][0]['question'] == 'Topic 1.2.3 Q0'
+
+def test_failure_is_isolated_to_one_topic():
+    structure = make_structure(parts=1, chapters=1, topics=3)
+    results = generate_cards_concurrently(FakeAnalyzer(fail_on='Topic 0.0.1'), 'Book', structure)
+
+    assert results[(0, 0, 1)] == {'cards': [], 'error': 'boom'}
+    assert len(results[(0, 0, 0)]['cards']) == 2
+    assert len(results[(0, 0, 2)]['cards']) == 2
+
+def test_concurrency_limit_and_wall_clock():
+    structure = make_structure()
+    analyzer = FakeAnalyzer(delay=0.1)
+
+    started = time.perf_counter()
+    generate_cards_concurrently(analyzer, 'Book', structure, max_workers=36)
+    elapsed = time.perf_counter() - started
+
+    # 36 topics at up to 100ms each would take ~2s serially
+    assert elapsed < 1.0
+    assert analyzer.max_active <= 36
+
+    limited = FakeAnalyzer(delay=0.01)
+    generate_cards_concurrently(limited, 'Book', structure, max_workers=4)
+    assert limited.max_active <= 4
+
+def test_on_result_called_for_every_topic():
+    structure = make_structure(parts=2, chapters=2, topics=2)
+    seen = []
+    generate_cards_concurrently(FakeAnalyzer(delay=0), 'Book', structure, on_result=lambda key, result: seen.append(key))
+
+    assert sorted(seen) == [(p, c, t) for p, c, t, _ in iter_topics(structure)]
@@ -0,0 +1,78 @@
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app_auth0'))
+
+from deck_snapshot import DeckSnapshotCache, build_deck_tree
+
+def embedded_deck(version, title='Deck'):
+    """A decks row as returned by the embedded select, with children out of order"""
+    return {
+        'id': 'deck-1',
+        'title': title,
+        'content_version': version,
+        'parts': [
+            {'id': 'part-2', 'title': 'Part II', 'order_index': 1, 'chapters': []},
+            {'id': 'part-1', 'title': 'Part I', 'order_index': 0, 'chapters': [
+                {'id': 'chapter-1', 'title': 'Chapter 1', 'order_index': 0, 'topics': [
+                    {'id': 'topic-2', 'title': 'Second', 'order_index': 1, 'cards': []},
+                    {'id': 'topic-1', 'title': 'First', 'order_index': 0, 'cards': [
+                        {'id': 'card-2', 'front': 'Q2', 'back': 'A2', 'created_at': '2024-01-02'},
+                        {'id': 'card-1', 'front': 'Q1', 'back': 'A1', 'created_at': '2024-01-01'}
+                    ]}
+                ]}
+            ]}
+        ]
+    }
+
+class CountingClient:
+    """Serves the embedded deck select and counts round trips"""
+
+    def __init__(self, deck):
+        self.deck = deck
+        self.queries = 0
+
+    def table(self, name):
+        client = self
+
+        class Query:
+            def select(self, columns):
+                return self
+
+            def eq(self, column, value):
+                return self
+
+            def execute(self):
+                client.queries += 1
+                return SimpleNamespace(data=[client.deck])
+
+        return Query()
+
+def test_tree_is_sorted_like_the_old_nested_queries():
+    tree = build_deck_tree(embedded_deck(1))
+
+    assert [part['title'] for part in tree['parts']] == ['Part I', 'Part II']
+    topics = tree['parts'][0]['chapters'][0]['topics']
+    assert [topic['title'] for topic in topics] == ['First', 'Second']
+    assert [card['id'] for card in topics[0]['cards']] == ['card-1', 'card-2']
+
+def test_snapshot_is_reused_until_the_version_changes():
+    client = CountingClient(embedded_deck(1))
+    cache = DeckSnapshotCache(client=client)
+
+    first = cache.load('deck-1', 1)
+    assert cache.load('deck-1', 1) is first
+    assert client.queries == 1
+
+    client.deck = embedded_deck(2, title='Renamed')
+    assert cache.load('deck-1', 2)['title'] == 'Renamed'
+    assert client.queries == 2
+
+def test_unversioned_decks_are_not_cached():
+    client = CountingClient(embedded_deck(None))
+    cache = DeckSnapshotCache(client=client)
+
+    cache.load('deck-1', None)
+    cache.load('deck-1', None)
+    assert client.queries == 2
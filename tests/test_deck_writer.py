@@ -0,0 +1,63 @@
+import os
+import sys
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app_auth0'))
+
+from deck_writer import DeckTree, write_deck_tree
+
+class RecordingClient:
+    """Records RPC calls instead of sending them to PostgREST"""
+
+    def __init__(self):
+        self.calls = []
+
+    def rpc(self, name, params):
+        self.calls.append((name, params))
+        return SimpleNamespace(execute=lambda: SimpleNamespace(data=params['p_tree']['deck']['id']))
+
+def test_tree_links_every_level_with_client_ids():
+    tree = DeckTree('user-1', 'Intro to Python', 'subject-1', ['sub-1'])
+    part = tree.add_part('Part I: Basics', 0)
+    chapter = tree.add_chapter(part['id'], 'Chapter 1: Syntax', 0)
+    topic = tree.add_topic(chapter['id'], 'Variables', 0)
+    card = tree.add_card(topic['id'], 'Q', 'A')
+
+    data = tree.to_dict()
+    assert data['deck']['id'] == tree.deck_id
+    assert data['parts'][0]['deck_id'] == tree.deck_id
+    assert data['chapters'][0]['part_id'] == part['id']
+    assert data['topics'][0]['chapter_id'] == chapter['id']
+    assert data['cards'] == [card]
+    assert card['deck_id'] == tree.deck_id and card['topic_id'] == topic['id']
+
+def test_cards_added_from_many_threads_are_all_kept():
+    tree = DeckTree('user-1', 'Book')
+    topic = tree.add_topic(tree.add_chapter(tree.add_part('P', 0)['id'], 'C', 0)['id'], 'T', 0)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda i: tree.add_card(topic['id'], f'Q{i}', 'A'), range(500)))
+
+    cards = tree.to_dict()['cards']
+    assert len(cards) == 500
+    assert len({card['id'] for card in cards}) == 500
+
+def test_whole_tree_is_written_in_one_call():
+    tree = DeckTree('user-1', 'Book')
+    for p in range(3):
+        part = tree.add_part(f'Part {p}', p)
+        for c in range(3):
+            chapter = tree.add_chapter(part['id'], f'Chapter {c}', c)
+            for t in range(4):
+                topic = tree.add_topic(chapter['id'], f'Topic {t}', t)
+                for i in range(6):
+                    tree.add_card(topic['id'], f'Q{i}', 'A')
+
+    client = RecordingClient()
+    assert write_deck_tree(tree, client=client) == tree.deck_id
+
+    assert len(client.calls) == 1
+    name, params = client.calls[0]
+    assert name == 'insert_deck_tree'
+    assert len(params['p_tree']['cards']) == 216
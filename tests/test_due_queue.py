@@ -0,0 +1,63 @@
+import os
+import sys
+from types import SimpleNamespace
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app_auth0'))
+
+from due_queue import DueQueue, day_start
+
+NOW = datetime(2024, 5, 10, 12, 0, tzinfo=timezone.utc)
+
+def review(card_id, day):
+    return {'id': card_id, 'front': 'Q', 'back': 'A', 'next_review': f'2024-05-{day:02d}T08:00:00+00:00',
+            'interval': 1, 'easiness': 2.5, 'repetitions': 1, 'is_new': False}
+
+def new_card(card_id):
+    return {'id': card_id, 'front': 'Q', 'back': 'A', 'next_review': '2024-05-10T00:00:00+00:00',
+            'interval': 1, 'easiness': 2.5, 'repetitions': 0, 'is_new': True}
+
+class QueueClient:
+    """Answers get_due_queue from a fixed ordered queue and records the calls"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.calls = []
+
+    def rpc(self, name, params):
+        self.calls.append(params)
+        rows = self.rows[:params['p_limit']]
+        return SimpleNamespace(execute=lambda: SimpleNamespace(data=rows))
+
+def test_every_request_is_one_rpc_without_the_cache():
+    client = QueueClient([review('c1', 1), new_card('n1')])
+    queue = DueQueue(client=client, use_cache=False, review_cap=100, new_cap=5)
+
+    assert [card['id'] for card in queue.get('user-1', 'deck-1', limit=10, now=NOW)] == ['c1', 'n1']
+    queue.get('user-1', 'deck-1', limit=10, now=NOW)
+
+    assert len(client.calls) == 2
+    assert client.calls[0]['p_day_start'] == day_start(NOW).isoformat() == '2024-05-10T00:00:00+00:00'
+    assert (client.calls[0]['p_review_cap'], client.calls[0]['p_new_cap']) == (100, 5)
+
+def test_cached_queue_serves_most_overdue_and_drops_reviewed_cards():
+    client = QueueClient([review('c1', 1), review('c2', 3), review('c3', 5), new_card('n1')])
+    queue = DueQueue(client=client, use_cache=True, window=10)
+
+    assert [card['id'] for card in queue.get('user-1', 'deck-1', limit=2, now=NOW)] == ['c1', 'c2']
+
+    queue.record_review('user-1', 'deck-1', 'c1')
+    queue.record_review('user-1', 'deck-1', 'c2')
+    assert [card['id'] for card in queue.get('user-1', 'deck-1', limit=3, now=NOW)] == ['c3', 'n1']
+    assert len(client.calls) == 1
+
+def test_cached_queue_refills_when_the_window_runs_out():
+    client = QueueClient([review(f'c{day}', day) for day in range(1, 6)])
+    queue = DueQueue(client=client, use_cache=True, window=2)
+
+    queue.get('user-1', 'deck-1', limit=2, now=NOW)
+    queue.record_review('user-1', 'deck-1', 'c1')
+    client.rows = client.rows[1:]
+
+    assert [card['id'] for card in queue.get('user-1', 'deck-1', limit=2, now=NOW)] == ['c2', 'c3']
+    assert len(client.calls) == 2
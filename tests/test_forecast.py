@@ -0,0 +1,50 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app_auth0'))
+
+from study.forecast import simulate_reviews, forecast_reviews
+from study.sm2 import sm2_step, AUTH0
+
+def loop_forecast(states, quality, days):
+    """Reference: walk each card's reviews one at a time"""
+    counts = [0] * days
+    for easiness, interval, repetitions, due in states:
+        due = max(due, 0)
+        while due < days:
+            counts[due] += 1
+            easiness, interval, repetitions = sm2_step(quality, easiness, interval, repetitions, AUTH0)
+            due += interval
+    return counts
+
+@pytest.mark.parametrize('quality', [0, 3, 4, 5])
+def test_matches_a_per_card_loop_when_the_answer_is_fixed(quality):
+    rng = np.random.default_rng(1)
+    states = [(float(rng.uniform(1.3, 3.0)), int(rng.integers(1, 60)), int(rng.integers(0, 6)), int(rng.integers(-5, 40)))
+              for _ in range(500)]
+    probabilities = [1.0 if q == quality else 0.0 for q in range(6)]
+
+    counts = simulate_reviews(*zip(*states), days=120, runs=3, quality_probabilities=probabilities, seed=1)
+
+    assert counts.shape == (3, 120)
+    assert (counts == loop_forecast(states, quality, 120)).all()
+
+def test_runs_differ_and_summaries_bracket_the_mean():
+    rng = np.random.default_rng(2)
+    n = 2000
+    forecast = forecast_reviews(rng.uniform(1.3, 3.0, n), rng.integers(1, 30, n), rng.integers(0, 6, n),
+                                rng.integers(0, 30, n), days=60, runs=20, seed=4)
+
+    assert len(forecast['mean']) == 60
+    assert all(low <= mean <= high for low, mean, high in zip(forecast['p10'], forecast['mean'], forecast['p90']))
+    assert forecast['p10'] != forecast['p90']
+
+def test_empty_collection_and_bad_input():
+    assert simulate_reviews([], [], [], [], days=7, runs=2).sum() == 0
+    with pytest.raises(ValueError):
+        simulate_reviews([2.5], [1], [0], [0], quality_probabilities=[1, 0, 0])
+    with pytest.raises(ValueError):
+        simulate_reviews([2.5], [1], [0], [0], days=366)
@@ -0,0 +1,108 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app_auth0'))
+
+from generation_jobs import SQLiteJobStore
+import deck_worker
+from deck_worker import process_job
+
+def make_store(tmp_path, lease_seconds=60):
+    return SQLiteJobStore(str(tmp_path / 'jobs.db'), lease_seconds=lease_seconds)
+
+def test_claim_takes_oldest_pending_job_once(tmp_path):
+    store = make_store(tmp_path)
+    first = store.enqueue('user-1', {'textbook_name': 'Book A'})
+    store.enqueue('user-1', {'textbook_name': 'Book B'})
+
+    job = store.claim('worker-1')
+    assert job['id'] == first['id']
+    assert job['status'] == 'running'
+    assert job['attempts'] == 1
+    assert job['payload'] == {'textbook_name': 'Book A'}
+
+    other = store.claim('worker-2')
+    assert other['id'] != first['id']
+    assert store.claim('worker-3') is None
+
+def test_abandoned_job_is_reclaimed_after_lease(tmp_path):
+    store = make_store(tmp_path, lease_seconds=0)
+    job = store.enqueue('user-1', {'textbook_name': 'Book'})
+    store.claim('crashed-worker')
+
+    time.sleep(0.01)
+    reclaimed = store.claim('worker-2')
+    assert reclaimed['id'] == job['id']
+    assert reclaimed['locked_by'] == 'worker-2'
+    assert reclaimed['attempts'] == 2
+
+    # The crashed worker no longer owns the job
+    assert not store.complete(job['id'], 'crashed-worker', {'deck': {}})
+
+def test_failed_job_is_retried_until_exhausted(tmp_path):
+    store = make_store(tmp_path)
+    job = store.enqueue('user-1', {'textbook_name': 'Book'}, max_attempts=2)
+
+    store.claim('worker-1')
+    store.fail(job['id'], 'worker-1', 'rate limited')
+    assert store.get(job['id'])['status'] == 'pending'
+
+    store.claim('worker-1')
+    store.fail(job['id'], 'worker-1', 'rate limited again')
+    failed = store.get(job['id'])
+    assert failed['status'] == 'failed'
+    assert failed['error'] == 'rate limited again'
+    assert store.claim('worker-1') is None
+
+    retried = store.retry(job['id'])
+    assert retried['status'] == 'pending'
+    assert retried['attempts'] == 0
+    assert store.claim('worker-1')['id'] == job['id']
+
+def test_process_job_records_progress_and_result(tmp_path):
+    store = make_store(tmp_path)
+    job = store.enqueue('user-1', {'textbook_name': 'Book'})
+    claimed = store.claim('worker-1')
+
+    def pipeline(textbook_name, user_id, on_progress=None, use_cache=True):
+        on_progress(0, 2, 100)
+        on_progress(2, 2, 450)
+        return {'message': 'Deck generated successfully', 'deck': {'title': textbook_name}}
+
+    assert process_job(store, claimed, 'worker-1', pipeline=pipeline)
+
+    done = store.get(job['id'])
+    assert done['status'] == 'completed'
+    assert done['result']['deck']['title'] == 'Book'
+    assert (done['topics_done'], done['topics_total'], done['tokens_used']) == (2, 2, 450)
+
+def test_process_job_releases_job_on_error(tmp_path):
+    store = make_store(tmp_path)
+    job = store.enqueue('user-1', {'textbook_name': 'Book'})
+    claimed = store.claim('worker-1')
+
+    def pipeline(textbook_name, user_id, on_progress=None, use_cache=True):
+        raise RuntimeError('overloaded')
+
+    assert not process_job(store, claimed, 'worker-1', pipeline=pipeline)
+
+    pending = store.get(job['id'])
+    assert pending['status'] == 'pending'
+    assert pending['error'] == 'overloaded'
+
+def test_use_is_refunded_only_when_the_job_fails_for_good(tmp_path, monkeypatch):
+    refunded = []
+    monkeypatch.setattr(deck_worker, '_refund_usage', refunded.append)
+    store = make_store(tmp_path)
+    job = store.enqueue('user-1', {'textbook_name': 'Book'}, max_attempts=2)
+
+    def pipeline(textbook_name, user_id, on_progress=None, use_cache=True):
+        raise RuntimeError('overloaded')
+
+    process_job(store, store.claim('worker-1'), 'worker-1', pipeline=pipeline)
+    assert refunded == []
+
+    process_job(store, store.claim('worker-1'), 'worker-1', pipeline=pipeline)
+    assert store.get(job['id'])['status'] == 'failed'
+    assert [refund['id'] for refund in refunded] == [job['id']]
@@ -0,0 +1,73 @@
+import os
+import sys
+from types import SimpleNamespace
+
+from flask import Flask, request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app_auth0'))
+
+import identity
+from identity import current_user_id, user_id_for, invalidate_user
+
+class FakeUsers:
+    """Just enough of the supabase client for users lookups by auth0_id"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = 0
+
+    def table(self, name):
+        assert name == 'users'
+        return self
+
+    def select(self, columns):
+        return self
+
+    def eq(self, column, value):
+        self.auth0_id = value
+        return self
+
+    def execute(self):
+        self.queries += 1
+        return SimpleNamespace(data=[{'id': self.rows[self.auth0_id]}] if self.auth0_id in self.rows else [])
+
+app = Flask(__name__)
+
+def as_caller(auth0_id):
+    context = app.test_request_context()
+    context.push()
+    request.user = {'sub': auth0_id}
+    return context
+
+def test_one_lookup_per_request_and_cached_across_requests():
+    identity.invalidate_all_users()
+    client = FakeUsers({'auth0|a': 'user-a'})
+
+    context = as_caller('auth0|a')
+    try:
+        assert current_user_id(client) == 'user-a'
+        assert user_id_for('auth0|a', client) == 'user-a'
+    finally:
+        context.pop()
+    assert client.queries == 1
+
+    context = as_caller('auth0|a')
+    try:
+        assert current_user_id(client) == 'user-a'
+        invalidate_user('auth0|a')
+        assert current_user_id(client) == 'user-a'
+    finally:
+        context.pop()
+    assert client.queries == 2
+
+def test_unknown_users_are_not_cached():
+    identity.invalidate_all_users()
+    client = FakeUsers({})
+
+    assert user_id_for('auth0|new', client) is None
+    # Signed up in between
+    client.rows['auth0|new'] = 'user-new'
+    assert user_id_for('auth0|new', client) == 'user-new'
+    assert user_id_for('auth0|new', client) == 'user-new'
+    assert client.queries == 2
+    assert user_id_for(None, client) is None
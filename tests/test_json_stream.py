@@ -0,0 +1,125 @@
+import os
+import sys
+import json
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app_auth0'))
+
+from json_stream import JSONArrayStream
+
+CARDS = [
+    {'question': 'What does {} mean in "set()"?', 'answer': 'An empty dict, not a set ["]'},
+    {'question': 'Escapes \\" inside strings', 'answer': 'Handled'},
+    {'question': 'Nested', 'answer': {'parts': [1, 2, {'x': ']'}]}}
+]
+
+def test_objects_are_emitted_as_they_close():
+    text = "```json\n" + json.dumps(CARDS, indent=2) + "\n```"
+    parser = JSONArrayStream()
+
+    received = []
+    for i in range(0, len(text), 7):
+        received.extend(parser.feed(text[i:i + 7]))
+
+    assert received == CARDS
+    assert parser.finished and not parser.truncated
+
+def test_truncated_array_keeps_complete_objects():
+    text = json.dumps(CARDS)
+    parser = JSONArrayStream()
+
+    received = parser.feed(text[:text.index('Nested') + 3])
+    assert received == CARDS[:2]
+    assert parser.truncated
+
+class FakeStream:
+    def __init__(self, text, stop_reason):
+        self.text = text
+        self.stop_reason = stop_reason
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    @property
+    def text_stream(self):
+        for i in range(0, len(self.text), 5):
+            yield self.text[i:i + 5]
+
+    def get_final_message(self):
+        return SimpleNamespace(
+            stop_reason=self.stop_reason,
+            usage=SimpleNamespace(input_tokens=10, output_tokens=len(self.text))
+        )
+
+class FakeMessages:
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.prompts = []
+
+    def stream(self, **kwargs):
+        self.prompts.append(kwargs['messages'][0]['content'])
+        return FakeStream(*self.replies.pop(0))
+
+def make_analyzer(monkeypatch, replies):
+    monkeypatch.setenv('ANTHROPIC_API_KEY', 'test-key')
+    monkeypatch.setattr('llm_cache.LLM_CACHE_ENABLED', False)
+    from textbook_analyzer import TextbookAnalyzer
+
+    analyzer = TextbookAnalyzer()
+    analyzer.client = SimpleNamespace(messages=FakeMessages(replies))
+    return analyzer
+
+def card(i):
+    return {'question': f'Q{i}', 'answer': f'A{i}'}
+
+def test_truncated_reply_requests_only_missing_cards(monkeypatch):
+    first = json.dumps([card(0), card(1), card(2)])
+    first = first[:first.index('Q2')]
+    analyzer = make_analyzer(monkeypatch, [
+        (first, 'max_tokens'),
+        (json.dumps([card(2), card(3)]), 'end_turn')
+    ])
+
+    streamed = []
+    cards = analyzer.generate_cards_for_topic('Loops', 'Iteration', 'Intro to Python', 4, on_card=streamed.append)
+
+    assert cards == [card(0), card(1), card(2), card(3)]
+    assert streamed == cards
+    follow_up = analyzer.client.messages.prompts[1]
+    assert 'Create 2 Anki flashcards' in follow_up
+    assert '- Q0' in follow_up and '- Q1' in follow_up
+
+def test_complete_reply_makes_a_single_call(monkeypatch):
+    analyzer = make_analyzer(monkeypatch, [(json.dumps([card(0), card(1)]), 'end_turn')])
+
+    assert analyzer.generate_cards_for_topic('Loops', 'Iteration', 'Intro to Python', 2) == [card(0), card(1)]
+    assert len(analyzer.client.messages.prompts) == 1
+
+class FailingStream(FakeStream):
+    """Yields the text, then drops the connection"""
+
+    @property
+    def text_stream(self):
+        yield from FakeStream.text_stream.fget(self)
+        raise ConnectionError('stream dropped')
+
+def test_cards_streamed_before_an_error_are_kept(monkeypatch):
+    partial = json.dumps([card(0), card(1), card(2)])
+    partial = partial[:partial.index('Q2')]
+    analyzer = make_analyzer(monkeypatch, [(partial, 'end_turn')])
+    analyzer.client.messages.stream = lambda **kwargs: FailingStream(partial, 'end_turn')
+
+    streamed = []
+    cards = analyzer.generate_cards_for_topic('Loops', 'Iteration', 'Intro to Python', 4, on_card=streamed.append)
+    assert cards == streamed == [card(0), card(1)]
+
+    # The follow-up for the missing cards fails partway as well
+    rest = json.dumps([card(2), card(3)])
+    replies = [FakeStream(partial, 'max_tokens'), FailingStream(rest[:rest.index('Q3')], 'end_turn')]
+    analyzer.client.messages.stream = lambda **kwargs: replies.pop(0)
+    streamed = []
+    cards = analyzer.generate_cards_for_topic('Loops', 'Iteration', 'Intro to Python', 4, on_card=streamed.append)
+    assert cards == streamed == [card(0), card(1), card(2)]
@@ -0,0 +1,82 @@
+import os
+import sys
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app_auth0', 'migrations'))
+
+# A disposable local Postgres, e.g. postgresql+psycopg2://postgres@localhost:5432/postgres
+TEST_DATABASE_URL = os.getenv('TEST_DATABASE_URL')
+
+pytestmark = pytest.mark.skipif(not TEST_DATABASE_URL, reason='TEST_DATABASE_URL is not set')
+
+NOW = datetime(2024, 6, 1, 12, 0, tzinfo=timezone.utc)
+
+@pytest.fixture
+def connection():
+    from sqlalchemy import create_engine, text
+    from add_live_deck_card_states import LIVE_DECK_CARD_STATES_SQL
+
+    schema = f"live_states_{uuid.uuid4().hex[:8]}"
+    engine = create_engine(TEST_DATABASE_URL)
+    with engine.connect() as connection:
+        connection.execute(text(f"CREATE SCHEMA {schema}; SET search_path TO {schema}, public;"))
+        connection.execute(text("""
+            CREATE TABLE live_decks (id UUID PRIMARY KEY, user_id UUID, deck_id UUID);
+            CREATE TABLE cards (id UUID PRIMARY KEY, deck_id UUID, created_at TIMESTAMP);
+            CREATE TABLE user_card_states (
+                id UUID PRIMARY KEY, user_id UUID, live_deck_id UUID, card_id UUID, is_active BOOLEAN,
+                easiness FLOAT, interval INTEGER, repetitions INTEGER, next_review TIMESTAMP WITH TIME ZONE
+            );
+        """))
+        connection.execute(text(LIVE_DECK_CARD_STATES_SQL))
+        try:
+            yield connection
+        finally:
+            # Nothing was committed, so this drops the schema as well
+            connection.rollback()
+
+def card_states(connection, live_deck_id, now=None, limit=None):
+    from sqlalchemy import text
+    return connection.execute(
+        text("SELECT get_live_deck_card_states(:live_deck_id, :now, :limit)"),
+        {'live_deck_id': live_deck_id, 'now': now, 'limit': limit}
+    ).scalar()
+
+def test_unstarted_cards_are_new_and_due_reviews_come_first(connection):
+    from sqlalchemy import text
+    user_id, deck_id, live_deck_id = str(uuid.uuid4()), str(uuid.uuid4()), str(uuid.uuid4())
+    connection.execute(text("INSERT INTO live_decks VALUES (:id, :user_id, :deck_id)"),
+                       {'id': live_deck_id, 'user_id': user_id, 'deck_id': deck_id})
+    card_ids = [str(uuid.uuid4()) for _ in range(6)]
+    connection.execute(text("INSERT INTO cards VALUES (:id, :deck_id, :created_at)"), [
+        {'id': card_id, 'deck_id': deck_id, 'created_at': datetime(2024, 1, 1) + timedelta(minutes=index)}
+        for index, card_id in enumerate(card_ids)
+    ])
+    # Reviewed twice: due yesterday, not due yet, switched off; and one toggled twice but never reviewed
+    connection.execute(text("INSERT INTO user_card_states VALUES (:id, :user_id, :live_deck_id, :card_id, :active, 2.6, :interval, 2, :next_review)"), [
+        {'id': str(uuid.uuid4()), 'user_id': user_id, 'live_deck_id': live_deck_id, 'card_id': card_id,
+         'active': active, 'interval': interval, 'next_review': next_review}
+        for card_id, active, interval, next_review in [
+            (card_ids[1], True, 6, NOW - timedelta(days=1)),
+            (card_ids[2], True, 6, NOW + timedelta(days=3)),
+            (card_ids[3], False, 6, NOW - timedelta(days=2)),
+            (card_ids[4], True, 1, None)
+        ]
+    ])
+
+    cards = card_states(connection, live_deck_id)
+    assert [card['card_id'] for card in cards] == card_ids
+    assert [card['is_new'] for card in cards] == [True, False, False, False, True, True]
+    assert cards[0] == {'card_id': card_ids[0], 'is_active': True, 'next_review': None,
+                        'interval': 1, 'easiness': 2.5, 'repetitions': 0, 'is_new': True}
+    assert cards[3]['is_active'] is False
+
+    due = card_states(connection, live_deck_id, NOW)
+    assert [(card['card_id'], card['is_new']) for card in due] == [
+        (card_ids[1], False), (card_ids[0], True), (card_ids[4], True), (card_ids[5], True)
+    ]
+    assert [card['card_id'] for card in card_states(connection, live_deck_id, NOW, 1)] == [card_ids[1], card_ids[0]]
+    assert card_states(connection, str(uuid.uuid4())) == []
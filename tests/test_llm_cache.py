@@ -0,0 +1,92 @@
+import os
+import sys
+import json
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app_auth0'))
+
+from llm_cache import LLMCache, cache_key
+
+def test_key_depends_on_every_input():
+    base = cache_key('model', 'system', 'prompt', 0.3)
+    assert base == cache_key('model', 'system', 'prompt', 0.3)
+    assert base != cache_key('other', 'system', 'prompt', 0.3)
+    assert base != cache_key('model', 'other', 'prompt', 0.3)
+    assert base != cache_key('model', 'system', 'other', 0.3)
+    assert base != cache_key('model', 'system', 'prompt', 0.2)
+
+def test_hit_miss_and_ttl(tmp_path):
+    cache = LLMCache(str(tmp_path / 'cache.db'), ttl_seconds=60)
+    assert cache.get('k') is None
+    cache.put('k', '{"a": 1}')
+    assert cache.get('k') == '{"a": 1}'
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (1, 1, 1)
+
+    cache.ttl_seconds = 0
+    time.sleep(0.01)
+    assert cache.get('k') is None
+    assert cache.stats()['entries'] == 0
+
+def test_size_cap_evicts_least_recently_used(tmp_path):
+    cache = LLMCache(str(tmp_path / 'cache.db'), max_bytes=10 ** 9)
+    for name in ('a', 'b', 'c'):
+        cache.put(name, name * 500)
+        time.sleep(0.01)
+    cache.get('a')
+
+    # Entries compress to the same size; leave room for exactly two
+    entry_size = cache.stats()['bytes'] // 3
+    cache.max_bytes = entry_size * 2
+    cache.put('d', 'd' * 500)
+
+    assert cache.get('b') is None
+    assert cache.get('c') is None
+    assert cache.get('a') is not None
+    assert cache.get('d') is not None
+    assert cache.stats()['evictions'] == 2
+
+class FakeStream:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    @property
+    def text_stream(self):
+        yield "```json" + json.dumps([{'question': 'Q', 'answer': 'A'}]) + "```"
+
+    def get_final_message(self):
+        return SimpleNamespace(
+            usage=SimpleNamespace(input_tokens=10, output_tokens=20),
+            stop_reason='end_turn'
+        )
+
+class FakeMessages:
+    def __init__(self):
+        self.calls = 0
+
+    def stream(self, **kwargs):
+        self.calls += 1
+        return FakeStream()
+
+def test_analyzer_serves_repeats_from_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv('ANTHROPIC_API_KEY', 'test-key')
+    monkeypatch.setattr('llm_cache.LLM_CACHE_ENABLED', False)
+    from textbook_analyzer import TextbookAnalyzer
+
+    analyzer = TextbookAnalyzer()
+    analyzer.cache = LLMCache(str(tmp_path / 'cache.db'))
+    analyzer.client = SimpleNamespace(messages=FakeMessages())
+
+    first = analyzer.generate_cards_for_topic('Loops', 'Iteration', 'Intro to Python', 1)
+    second = analyzer.generate_cards_for_topic('Loops', 'Iteration', 'Intro to Python', 1)
+    assert first == second == [{'question': 'Q', 'answer': 'A'}]
+    assert analyzer.client.messages.calls == 1
+    assert analyzer.tokens_used == 30
+
+    analyzer.generate_cards_for_topic('Loops', 'Iteration', 'Intro to Python', 1, use_cache=False)
+    assert analyzer.client.messages.calls == 2
@@ -0,0 +1,107 @@
+import os
+import sys
+import uuid
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app_auth0'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app_auth0', 'migrations'))
+
+from study.param_optimizer import RecallModelFitter, review_features, interval_modifier
+
+TRUE_WEIGHTS = {
+    'sharp': np.array([5.0, -0.6, 0.5, 0.1]),
+    'average': np.array([4.1, -0.45, 0.8, 0.2]),
+    'struggling': np.array([3.85, -0.45, 0.8, 0.2])
+}
+
+def simulated_log(n, seed=0):
+    rng = np.random.default_rng(seed)
+    keys = rng.choice(list(TRUE_WEIGHTS), n)
+    intervals, easiness, repetitions = rng.integers(1, 200, n), rng.uniform(1.3, 3.0, n), rng.integers(1, 10, n)
+    features = review_features(intervals, easiness, repetitions)
+    logits = np.einsum('ij,ij->i', np.stack([TRUE_WEIGHTS[key] for key in keys]), features)
+    passed = rng.random(n) < 1 / (1 + np.exp(-logits))
+    return keys, intervals, easiness, repetitions, passed
+
+def test_recovers_per_group_weights_from_chunks():
+    keys, intervals, easiness, repetitions, passed = simulated_log(150_000)
+    features = review_features(intervals, easiness, repetitions)
+
+    fitter = RecallModelFitter()
+    losses = []
+    for _ in range(5):
+        fitter.start_epoch()
+        for start in range(0, len(keys), 7_000):
+            fitter.partial_fit(keys[start:start + 7_000], features[start:start + 7_000], passed[start:start + 7_000])
+        losses.append(fitter.loss())
+        fitter.end_epoch()
+
+    assert losses == sorted(losses, reverse=True)
+    parameters = fitter.parameters(target_retention=0.9)
+    for key, weights in TRUE_WEIGHTS.items():
+        mean_features = features[keys == key].mean(axis=0)
+        assert parameters[key]['review_count'] == (keys == key).sum()
+        assert parameters[key]['interval_modifier'] == pytest.approx(interval_modifier(weights, mean_features), rel=0.1)
+    # Weaker recall means shorter intervals for the same target
+    modifiers = [parameters[key]['interval_modifier'] for key in ('struggling', 'average', 'sharp')]
+    assert modifiers == sorted(modifiers) and modifiers[0] < 1 < modifiers[2]
+
+def test_modifier_hits_the_target_retention():
+    weights = np.array([3.0, -0.5, 0.0, 0.0])
+    mean_features = np.array([1.0, np.log(20), 0.0, 0.0])
+    modifier = interval_modifier(weights, mean_features, target_retention=0.85)
+
+    logit = weights @ np.array([1.0, np.log(20 * modifier), 0.0, 0.0])
+    assert 1 / (1 + np.exp(-logit)) == pytest.approx(0.85)
+    assert interval_modifier(np.array([3.0, 0.1, 0, 0]), mean_features) == 1.0
+
+@pytest.mark.skipif(not os.getenv('TEST_DATABASE_URL'), reason='TEST_DATABASE_URL is not set')
+def test_fits_and_stores_parameters_from_the_review_log():
+    from sqlalchemy import create_engine, text
+    from add_scheduler_parameters import SCHEDULER_PARAMETERS_SQL
+    import fit_scheduler_parameters
+
+    schema = f"fit_{uuid.uuid4().hex[:8]}"
+    engine = create_engine(os.getenv('TEST_DATABASE_URL'), connect_args={'options': f'-csearch_path={schema},public'})
+    with engine.connect() as connection:
+        connection.execute(text(f"CREATE SCHEMA {schema}"))
+        connection.commit()
+    try:
+        keys, intervals, easiness, repetitions, passed = simulated_log(20_000, seed=1)
+        users = {key: str(uuid.uuid4()) for key in TRUE_WEIGHTS}
+        decks = {key: str(uuid.uuid4()) for key in TRUE_WEIGHTS}
+        cards = {key: str(uuid.uuid4()) for key in TRUE_WEIGHTS}
+        with engine.connect() as connection:
+            connection.execute(text("""
+                CREATE TABLE users (id UUID PRIMARY KEY);
+                CREATE TABLE decks (id UUID PRIMARY KEY, user_id UUID);
+                CREATE TABLE cards (id UUID PRIMARY KEY, deck_id UUID);
+                CREATE TABLE card_reviews (id VARCHAR PRIMARY KEY, card_id VARCHAR, quality INTEGER,
+                                           prev_easiness FLOAT, prev_interval INTEGER, prev_repetitions INTEGER);
+            """))
+            connection.execute(text(SCHEDULER_PARAMETERS_SQL))
+            for key in TRUE_WEIGHTS:
+                connection.execute(text("INSERT INTO users VALUES (:id)"), {'id': users[key]})
+                connection.execute(text("INSERT INTO decks VALUES (:id, :user_id)"), {'id': decks[key], 'user_id': users[key]})
+                connection.execute(text("INSERT INTO cards VALUES (:id, :deck_id)"), {'id': cards[key], 'deck_id': decks[key]})
+            connection.execute(
+                text("INSERT INTO card_reviews VALUES (:id, :card_id, :quality, :e, :i, :r)"),
+                [{'id': str(uuid.uuid4()), 'card_id': cards[key], 'quality': 4 if ok else 1,
+                  'e': float(e), 'i': int(i), 'r': int(r)}
+                 for key, i, e, r, ok in zip(keys, intervals, easiness, repetitions, passed)]
+            )
+            connection.commit()
+
+        fitter = fit_scheduler_parameters.fit(engine, group_by='user', epochs=5, chunk_size=3_000)
+        with engine.connect() as connection:
+            assert fit_scheduler_parameters.write_parameters(connection, fitter.parameters(), 'user') == 3
+            connection.commit()
+            stored = dict(connection.execute(text("SELECT user_id::text, interval_modifier FROM scheduler_parameters")).all())
+
+        assert stored[users['struggling']] < stored[users['average']] < stored[users['sharp']]
+    finally:
+        with engine.connect() as connection:
+            connection.execute(text(f"DROP SCHEMA {schema} CASCADE"))
+            connection.commit()
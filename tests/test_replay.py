@@ -0,0 +1,159 @@
+import os
+import sys
+import uuid
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app_auth0'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app_auth0', 'migrations'))
+
+from study.replay import replay_card, fold_reviews, drifted_fields
+from study.sm2 import sm2_step, AUTH0
+
+START = datetime(2024, 3, 1, 9, 30)
+
+def review_log(card_id, qualities, state=(2.5, 1, 0), modifier=1.0):
+    reviews, reviewed_at = [], START
+    for quality in qualities:
+        new_state = sm2_step(quality, *state, AUTH0, modifier)
+        reviews.append({
+            'card_id': card_id, 'created_at': reviewed_at, 'quality': quality,
+            'prev_easiness': state[0], 'prev_interval': state[1], 'prev_repetitions': state[2],
+            'new_easiness': new_state[0], 'new_interval': new_state[1], 'new_repetitions': new_state[2]
+        })
+        reviewed_at += timedelta(days=new_state[1], minutes=7)
+        state = new_state
+    return reviews, state
+
+def test_replay_rebuilds_the_state_the_log_ends_in():
+    reviews, state = review_log('a', [4, 5, 3, 1, 4, 4, 5], state=(2.2, 3, 2))
+
+    replayed = replay_card('a', reviews)
+
+    assert (replayed.easiness, replayed.interval, replayed.repetitions) == state
+    assert replayed.next_review == reviews[-1]['created_at'].replace(tzinfo=timezone.utc) + timedelta(days=state[1])
+    assert replayed.first_reviewed_at == START.replace(tzinfo=timezone.utc)
+    assert (replayed.reviews, replayed.breaks) == (7, 0)
+    # Recomputing an untouched log gives the same answer
+    assert replay_card('a', reviews, recompute=True) == replayed
+
+def test_recompute_applies_a_new_modifier_and_fills_gaps():
+    reviews, state = review_log('a', [4, 4, 5, 4, 5])
+    _, scaled = review_log('a', [4, 4, 5, 4, 5], modifier=1.4)
+    for review in reviews[2:]:
+        review['new_interval'] = None
+
+    # Trusting the log, only the missing transitions are computed
+    assert replay_card('a', reviews).interval == state[1]
+    assert replay_card('a', reviews, recompute=True, interval_modifier=1.4).interval == scaled[1] != state[1]
+
+def test_counts_breaks_and_folds_cards_one_at_a_time():
+    first, _ = review_log('a', [5, 5, 5])
+    second, second_state = review_log('b', [3, 0, 4])
+    # A lost update: the second review started from a state the first didn't leave
+    first[1]['prev_interval'] = 4
+
+    replayed = [card for card, _ in fold_reviews(iter(first + second))]
+
+    assert [(card.card_id, card.reviews, card.breaks) for card in replayed] == [('a', 3, 1), ('b', 3, 0)]
+    stored = {'easiness': second_state[0], 'interval': second_state[1], 'repetitions': 9,
+              'next_review': replayed[1].next_review, 'first_reviewed_at': None}
+    assert drifted_fields(replayed[1], stored) == ['repetitions', 'first_reviewed_at']
+
+def test_dates_a_few_microseconds_off_the_log_are_not_drift():
+    reviews, state = review_log('a', [4, 5])
+    replayed = replay_card('a', reviews)
+    # next_review and created_at came from two reads of the clock
+    stored = {'easiness': state[0], 'interval': state[1], 'repetitions': state[2],
+              'next_review': replayed.next_review + timedelta(microseconds=37),
+              'first_reviewed_at': START - timedelta(microseconds=12)}
+
+    assert drifted_fields(replayed, stored) == []
+    stored['next_review'] += timedelta(hours=1)
+    assert drifted_fields(replayed, stored) == ['next_review']
+
+@pytest.mark.skipif(not os.getenv('TEST_DATABASE_URL'), reason='TEST_DATABASE_URL is not set')
+def test_verifies_and_repairs_drifted_cards():
+    from sqlalchemy import create_engine, text
+    from add_due_load import DUE_COUNTS_SQL
+    from add_scheduler_parameters import SCHEDULER_PARAMETERS_SQL, APPLY_CARD_REVIEW_SQL
+    import replay_card_states
+
+    schema = f"replay_{uuid.uuid4().hex[:8]}"
+    engine = create_engine(os.getenv('TEST_DATABASE_URL'),
+                           connect_args={'options': f'-csearch_path={schema},public -ctimezone=UTC'})
+    with engine.connect() as connection:
+        connection.execute(text(f"CREATE SCHEMA {schema}"))
+        connection.commit()
+    try:
+        user_id, deck_ids = str(uuid.uuid4()), [str(uuid.uuid4()), str(uuid.uuid4())]
+        rng = random.Random(3)
+        with engine.connect() as connection:
+            connection.execute(text("""
+                CREATE TABLE users (id UUID PRIMARY KEY);
+                CREATE TABLE decks (id UUID PRIMARY KEY, user_id UUID);
+                CREATE TABLE study_sessions (id UUID PRIMARY KEY, user_id UUID);
+                CREATE TABLE cards (
+                    id UUID PRIMARY KEY, deck_id UUID REFERENCES decks(id) ON DELETE CASCADE,
+                    interval INTEGER DEFAULT 1, easiness FLOAT DEFAULT 2.5, repetitions INTEGER DEFAULT 0,
+                    next_review TIMESTAMP WITH TIME ZONE, first_reviewed_at TIMESTAMP WITH TIME ZONE
+                );
+                CREATE TABLE card_reviews (
+                    id VARCHAR PRIMARY KEY, session_id VARCHAR NOT NULL, card_id VARCHAR NOT NULL,
+                    quality INTEGER NOT NULL, time_taken INTEGER, created_at TIMESTAMP,
+                    prev_easiness FLOAT, prev_interval INTEGER, prev_repetitions INTEGER,
+                    new_easiness FLOAT, new_interval INTEGER, new_repetitions INTEGER
+                );
+            """))
+            connection.execute(text(DUE_COUNTS_SQL))
+            connection.execute(text(SCHEDULER_PARAMETERS_SQL))
+            connection.execute(text(APPLY_CARD_REVIEW_SQL))
+            connection.execute(text("INSERT INTO users VALUES (:id)"), {'id': user_id})
+            session_id = str(uuid.uuid4())
+            connection.execute(text("INSERT INTO study_sessions VALUES (:id, :user_id)"), {'id': session_id, 'user_id': user_id})
+            card_ids = []
+            for deck_id in deck_ids:
+                connection.execute(text("INSERT INTO decks VALUES (:id, :user_id)"), {'id': deck_id, 'user_id': user_id})
+                for _ in range(20):
+                    card_ids.append(str(uuid.uuid4()))
+                    connection.execute(text("INSERT INTO cards (id, deck_id) VALUES (:id, :deck_id)"),
+                                       {'id': card_ids[-1], 'deck_id': deck_id})
+            for card_id in card_ids:
+                reviewed_at = datetime(2024, 3, 1, 9, 30, tzinfo=timezone.utc)
+                for _ in range(rng.randint(1, 6)):
+                    row = connection.execute(
+                        text("SELECT * FROM apply_card_review(:card_id, :user_id, :session_id, :quality, NULL, :reviewed_at)"),
+                        {'card_id': card_id, 'user_id': user_id, 'session_id': session_id,
+                         'quality': rng.randint(0, 5), 'reviewed_at': reviewed_at}
+                    ).mappings().one()
+                    reviewed_at = row['next_review'] + timedelta(hours=rng.randint(0, 30))
+            # A card edited by hand, and one whose update was lost
+            connection.execute(text("UPDATE cards SET interval = interval + 3, repetitions = repetitions + 1 WHERE id = :id"),
+                               {'id': card_ids[0]})
+            connection.execute(text("UPDATE cards SET next_review = next_review - interval '2 days' WHERE id = :id"),
+                               {'id': card_ids[25]})
+            connection.commit()
+
+        report = replay_card_states.replay(engine, fetch_size=7)
+        assert (report['cards'], report['drifted'], report['repaired'], report['breaks']) == (40, 2, 0, 0)
+        assert replay_card_states.replay(engine, deck_id=deck_ids[0])['drifted'] == 1
+
+        report = replay_card_states.replay(engine, user_id=user_id, repair=True, repair_batch=1)
+        assert (report['drifted'], report['repaired'], report['skipped']) == (2, 2, 0)
+        assert replay_card_states.replay(engine)['drifted'] == 0
+
+        # After a scheduler change, recomputing moves every grown interval
+        with engine.connect() as connection:
+            connection.execute(text("INSERT INTO scheduler_parameters (user_id, weights, interval_modifier, target_retention, "
+                                    "review_count) VALUES (:user_id, '{}', 1.5, 0.9, 500)"), {'user_id': user_id})
+            connection.commit()
+        assert replay_card_states.replay(engine)['drifted'] == 0
+        drifted = replay_card_states.replay(engine, recompute=True, repair=True)['repaired']
+        assert drifted > 0
+        assert replay_card_states.replay(engine, recompute=True)['drifted'] == 0
+    finally:
+        with engine.connect() as connection:
+            connection.execute(text(f"DROP SCHEMA {schema} CASCADE"))
+            connection.commit()
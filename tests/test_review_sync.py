@@ -0,0 +1,284 @@
+import os
+import sys
+import json
+import uuid
+from types import SimpleNamespace
+from datetime import datetime, timezone
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app_auth0'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app_auth0', 'migrations'))
+
+from review_sync import apply_review_batch, STATUS_APPLIED, STATUS_DUPLICATE, STATUS_REJECTED
+from study.sm2 import sm2_step, AUTH0
+
+NOW = datetime(2024, 5, 10, 12, 0, tzinfo=timezone.utc)
+
+class SyncClient:
+    """Stores cards and review rows in memory and counts round trips"""
+
+    def __init__(self, cards, load=None, parameters=None, sessions=None, before_write=None):
+        self.cards = cards
+        self.reviews = {}
+        self.load = load or {}
+        self.parameters = parameters or []
+        self.sessions = sessions or {'s1': 'user-1'}
+        # Called before each apply_review_batch, e.g. to change a card concurrently
+        self.before_write = before_write
+        self.round_trips = 0
+        # Number of ids sent in each in_ lookup
+        self.lookups = []
+
+    def _result(self, data):
+        self.round_trips += 1
+        return SimpleNamespace(data=data)
+
+    def table(self, name):
+        client = self
+
+        class Query:
+            def select(self, columns):
+                return self
+
+            def eq(self, column, value):
+                rows = [row for row in client.parameters if row['user_id'] == value]
+                return SimpleNamespace(execute=lambda: client._result(rows))
+
+            def in_(self, column, values):
+                client.lookups.append(len(values))
+                if name == 'card_reviews':
+                    rows = [row for key, row in client.reviews.items() if key in values]
+                else:
+                    rows = [dict(card) for card in client.cards.values() if card['id'] in values]
+                return SimpleNamespace(execute=lambda: client._result(rows))
+
+        return Query()
+
+    def rpc(self, name, params):
+        if name == 'get_user_due_load':
+            return SimpleNamespace(execute=lambda: self._result(self.load))
+
+        def execute():
+            if self.before_write:
+                self.before_write(self)
+            foreign = {row['session_id'] for row in params['p_reviews']
+                       if self.sessions.get(row['session_id']) != params['p_user_id']}
+            held = {update['id'] for update in params['p_cards']
+                    if tuple(self.cards[update['id']][field] for field in ('repetitions', 'interval', 'next_review'))
+                    != (update['expected_repetitions'], update['expected_interval'], update['expected_next_review'])}
+            held |= {row['card_id'] for row in params['p_reviews'] if row['session_id'] in foreign}
+
+            statuses = []
+            for row in params['p_reviews']:
+                key = row['idempotency_key']
+                if row['session_id'] in foreign:
+                    status = 'unauthorized'
+                elif row['card_id'] in held:
+                    status = 'stale'
+                elif key in self.reviews:
+                    status = 'duplicate'
+                else:
+                    self.reviews[key] = row
+                    status = 'applied'
+                statuses.append({'idempotency_key': key, 'status': status})
+            touched = {row['card_id'] for row, status in zip(params['p_reviews'], statuses) if status['status'] == 'applied'}
+            for update in params['p_cards']:
+                if update['id'] in touched:
+                    self.cards[update['id']].update(
+                        {field: value for field, value in update.items() if not field.startswith('expected_')}
+                    )
+            return self._result(statuses)
+        return SimpleNamespace(execute=execute)
+
+def card(card_id, owner='user-1', **state):
+    return {'id': card_id, 'deck_id': 'deck-1', 'interval': 1, 'easiness': 2.5, 'repetitions': 0,
+            'next_review': None, 'first_reviewed_at': None, 'decks': {'user_id': owner}, **state}
+
+def review(key, card_id, quality):
+    return {'idempotency_key': key, 'card_id': card_id, 'session_id': 's1', 'quality': quality}
+
+def test_reviews_of_a_card_are_applied_in_order_with_ids_looked_up_in_chunks():
+    client = SyncClient({f'c{i}': card(f'c{i}') for i in range(30)})
+    batch = [review(f'k{i}', f'c{i % 30}', 4) for i in range(300)]
+
+    results = apply_review_batch('user-1', batch, client=client, now=NOW)
+
+    assert all(result['status'] == STATUS_APPLIED for result in results)
+    # Three chunks of idempotency keys, one of cards, then parameters and the write
+    assert client.lookups == [100, 100, 100, 30]
+    assert client.round_trips == 6
+
+    state = (2.5, 1, 0)
+    for _ in range(10):
+        state = sm2_step(4, *state, AUTH0)
+    assert (client.cards['c1']['easiness'], client.cards['c1']['interval'], client.cards['c1']['repetitions']) == state
+    assert client.cards['c1']['first_reviewed_at'] == NOW.isoformat()
+
+def test_load_balancing_spreads_cards_reviewed_together():
+    def cards():
+        return {f'c{i}': card(f'c{i}', interval=10, repetitions=3) for i in range(40)}
+    batch = [review(f'k{i}', f'c{i}', 4) for i in range(40)]
+
+    plain = apply_review_batch('user-1', batch, client=SyncClient(cards()), now=NOW, load_balance=False)
+    client = SyncClient(cards(), load={'2024-06-05': 3})
+    balanced = apply_review_batch('user-1', batch, client=client, now=NOW, load_balance=True)
+
+    assert {result['interval'] for result in plain} == {25}
+    # 25 days give or take 3, with three cards already due on day 26
+    per_day = {days: 0 for days in range(22, 29)}
+    per_day[26] = 3
+    for result in balanced:
+        per_day[result['interval']] += 1
+    assert max(per_day.values()) - min(per_day.values()) <= 1
+    assert client.round_trips == 5
+
+def test_fitted_interval_modifiers_scale_grown_intervals():
+    cards = {'c1': card('c1', interval=10, repetitions=3), 'c2': card('c2', interval=10, repetitions=3, deck_id='deck-2')}
+    parameters = [{'user_id': 'user-1', 'deck_id': None, 'interval_modifier': 1.5},
+                  {'user_id': 'user-1', 'deck_id': 'deck-2', 'interval_modifier': 0.8},
+                  {'user_id': 'user-2', 'deck_id': None, 'interval_modifier': 2.0}]
+    client = SyncClient(cards, parameters=parameters)
+
+    results = apply_review_batch('user-1', [review('k1', 'c1', 4), review('k2', 'c2', 4)], client=client, now=NOW)
+
+    assert [result['interval'] for result in results] == [
+        sm2_step(4, 2.5, 10, 3, AUTH0, 1.5)[1], sm2_step(4, 2.5, 10, 3, AUTH0, 0.8)[1]
+    ] == [38, 20]
+
+def test_resubmitting_a_batch_changes_nothing():
+    client = SyncClient({'c1': card('c1')})
+    batch = [review('k1', 'c1', 5), review('k2', 'c1', 5)]
+    apply_review_batch('user-1', batch, client=client, now=NOW)
+    after_first = dict(client.cards['c1'])
+
+    results = apply_review_batch('user-1', batch + [review('k2', 'c1', 0)], client=client, now=NOW)
+
+    assert [result['status'] for result in results] == [STATUS_DUPLICATE] * 3
+    assert client.cards['c1'] == after_first
+    assert len(client.reviews) == 2
+
+def test_foreign_and_unknown_cards_are_rejected():
+    client = SyncClient({'c1': card('c1', owner='someone-else')})
+
+    results = apply_review_batch('user-1', [review('k1', 'c1', 5), review('k2', 'missing', 5)], client=client, now=NOW)
+
+    assert [result['status'] for result in results] == [STATUS_REJECTED, STATUS_REJECTED]
+    assert client.reviews == {}
+
+def test_reviews_of_a_card_changed_concurrently_are_computed_again():
+    def review_elsewhere(client):
+        # Another device reviewed c1 after this batch read it
+        if client.cards['c1']['repetitions'] == 0:
+            client.cards['c1'].update(repetitions=1, interval=1, next_review='2024-05-11T12:00:00+00:00')
+
+    client = SyncClient({'c1': card('c1'), 'c2': card('c2')}, before_write=review_elsewhere)
+    results = apply_review_batch('user-1', [review('k1', 'c1', 4), review('k2', 'c2', 4), review('k3', 'c1', 4)],
+                                 client=client, now=NOW)
+
+    assert [result['status'] for result in results] == [STATUS_APPLIED] * 3
+    state = sm2_step(4, *sm2_step(4, 2.5, 1, 1, AUTH0), AUTH0)
+    assert (results[2]['easiness'], results[2]['interval'], results[2]['repetitions']) == state
+    assert (client.cards['c1']['easiness'], client.cards['c1']['interval'], client.cards['c1']['repetitions']) == state
+    assert client.reviews['k1']['prev_repetitions'] == 1
+    assert client.cards['c2']['repetitions'] == 1
+
+def test_reviews_are_rejected_once_the_retries_are_used_up():
+    def review_elsewhere(client):
+        client.cards['c1']['repetitions'] += 1
+
+    client = SyncClient({'c1': card('c1')}, before_write=review_elsewhere)
+    results = apply_review_batch('user-1', [review('k1', 'c1', 4)], client=client, now=NOW, retries=1)
+
+    assert results[0]['status'] == STATUS_REJECTED
+    assert 'interval' not in results[0]
+    assert client.reviews == {}
+    assert client.round_trips == 8
+
+def test_reviews_on_other_users_sessions_are_rejected():
+    client = SyncClient({'c1': card('c1'), 'c2': card('c2')}, sessions={'s1': 'user-1', 's2': 'user-2'})
+    batch = [review('k1', 'c1', 4), {**review('k2', 'c1', 5), 'session_id': 's2'},
+             review('k3', 'c1', 4), {**review('k4', 'c2', 5), 'session_id': 'unknown'}]
+
+    results = apply_review_batch('user-1', batch, client=client, now=NOW)
+
+    assert [result['status'] for result in results] == [STATUS_APPLIED, STATUS_REJECTED, STATUS_APPLIED, STATUS_REJECTED]
+    assert sorted(client.reviews) == ['k1', 'k3']
+    # The refused review doesn't count towards the card's schedule
+    assert (client.cards['c1']['easiness'], client.cards['c1']['interval'], client.cards['c1']['repetitions']) == \
+        sm2_step(4, *sm2_step(4, 2.5, 1, 0, AUTH0), AUTH0)
+    assert client.cards['c2']['repetitions'] == 0
+
+@pytest.mark.parametrize('reviews', [[], [review('k1', 'c1', 6)], [{'card_id': 'c1', 'quality': 3}]])
+def test_invalid_batches_raise(reviews):
+    with pytest.raises(ValueError):
+        apply_review_batch('user-1', reviews, client=SyncClient({}), now=NOW)
+
+@pytest.mark.skipif(not os.getenv('TEST_DATABASE_URL'), reason='TEST_DATABASE_URL is not set')
+def test_batch_rpc_writes_only_cards_still_as_read_and_sessions_of_the_caller():
+    from sqlalchemy import create_engine, text
+    from add_review_batches import APPLY_REVIEW_BATCH_SQL
+
+    schema = f"review_batches_{uuid.uuid4().hex[:8]}"
+    engine = create_engine(os.getenv('TEST_DATABASE_URL'))
+    with engine.connect() as connection:
+        connection.execute(text(f"CREATE SCHEMA {schema}; SET search_path TO {schema}, public;"))
+        try:
+            # Only the columns apply_review_batch touches, with the production types
+            connection.execute(text("""
+                CREATE TABLE study_sessions (id UUID PRIMARY KEY, user_id UUID);
+                CREATE TABLE cards (
+                    id UUID PRIMARY KEY, interval INTEGER DEFAULT 1, easiness FLOAT DEFAULT 2.5,
+                    repetitions INTEGER DEFAULT 0, next_review TIMESTAMP WITH TIME ZONE,
+                    first_reviewed_at TIMESTAMP WITH TIME ZONE
+                );
+                CREATE TABLE card_reviews (
+                    id VARCHAR PRIMARY KEY, session_id VARCHAR NOT NULL, card_id VARCHAR NOT NULL,
+                    quality INTEGER NOT NULL, time_taken INTEGER, created_at TIMESTAMP,
+                    prev_easiness FLOAT, prev_interval INTEGER, prev_repetitions INTEGER,
+                    new_easiness FLOAT, new_interval INTEGER, new_repetitions INTEGER, idempotency_key TEXT
+                );
+                CREATE UNIQUE INDEX ON card_reviews(idempotency_key) WHERE idempotency_key IS NOT NULL;
+            """))
+            connection.execute(text(APPLY_REVIEW_BATCH_SQL))
+
+            user_id, session_id, other_session = str(uuid.uuid4()), str(uuid.uuid4()), str(uuid.uuid4())
+            connection.execute(text("INSERT INTO study_sessions VALUES (:id, :user_id)"),
+                               [{'id': session_id, 'user_id': user_id}, {'id': other_session, 'user_id': str(uuid.uuid4())}])
+            c1, c2 = str(uuid.uuid4()), str(uuid.uuid4())
+            connection.execute(text("INSERT INTO cards (id) VALUES (:id)"), [{'id': c1}, {'id': c2}])
+
+            def update(card_id, repetitions=0, interval=1, next_review=None):
+                return {'id': card_id, 'interval': 1, 'easiness': 2.6, 'repetitions': 1,
+                        'next_review': '2024-05-11T12:00:00+00:00', 'first_reviewed_at': '2024-05-10T12:00:00+00:00',
+                        'expected_repetitions': repetitions, 'expected_interval': interval,
+                        'expected_next_review': next_review}
+
+            def row(key, card_id, session=session_id):
+                return {'id': str(uuid.uuid4()), 'session_id': session, 'card_id': card_id, 'quality': 5,
+                        'created_at': '2024-05-10T12:00:00+00:00', 'prev_easiness': 2.5, 'prev_interval': 1,
+                        'prev_repetitions': 0, 'new_easiness': 2.6, 'new_interval': 1, 'new_repetitions': 1,
+                        'idempotency_key': key}
+
+            def apply(cards, reviews):
+                return dict(connection.execute(
+                    text("SELECT * FROM apply_review_batch(:user_id, CAST(:cards AS JSONB), CAST(:reviews AS JSONB))"),
+                    {'user_id': user_id, 'cards': json.dumps(cards), 'reviews': json.dumps(reviews)}
+                ).all())
+
+            # A review on another user's session holds its card back, c2 was read in a state it has left
+            assert apply([update(c1), update(c2, repetitions=3)],
+                         [row('k1', c1), row('k2', c1, other_session), row('k3', c2)]) == \
+                {'k1': 'stale', 'k2': 'unauthorized', 'k3': 'stale'}
+            assert connection.execute(text("SELECT COUNT(*) FROM card_reviews")).scalar() == 0
+            assert connection.execute(text("SELECT SUM(repetitions) FROM cards")).scalar() == 0
+
+            assert apply([update(c1), update(c2)], [row('k1', c1), row('k3', c2)]) == {'k1': 'applied', 'k3': 'applied'}
+            assert connection.execute(text("SELECT SUM(repetitions) FROM cards")).scalar() == 2
+
+            # Resubmitted from the state it was computed from, which the first submission has changed
+            assert apply([update(c1)], [row('k1', c1)]) == {'k1': 'stale'}
+            assert apply([update(c1, 1, 1, '2024-05-11T12:00:00+00:00')], [row('k1', c1)]) == {'k1': 'duplicate'}
+            assert connection.execute(text("SELECT COUNT(*) FROM card_reviews")).scalar() == 2
+        finally:
+            connection.rollback()
@@ -0,0 +1,67 @@
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app_auth0'))
+
+from due_queue import DueQueue
+from session_queue import SessionQueueStore
+
+def card(card_id, is_new=False):
+    return {'id': card_id, 'front': 'Q', 'back': 'A', 'next_review': '2024-05-10T08:00:00+00:00',
+            'interval': 1, 'easiness': 2.5, 'repetitions': 0 if is_new else 1, 'is_new': is_new}
+
+class QueueClient:
+    """Answers get_due_queue from a fixed ordered queue and counts the calls"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.calls = 0
+
+    def rpc(self, name, params):
+        self.calls += 1
+        rows = self.rows[:params['p_limit']]
+        return SimpleNamespace(execute=lambda: SimpleNamespace(data=rows))
+
+def store(tmp_path, rows, **kwargs):
+    client = QueueClient(rows)
+    due_queue = DueQueue(client=client, use_cache=False)
+    return client, SessionQueueStore(due_queue=due_queue, path=str(tmp_path / 'queues.db'), **kwargs)
+
+def test_session_is_queried_once_and_follows_reviews(tmp_path):
+    client, queues = store(tmp_path, [card(f'c{i}') for i in range(10)] + [card('n1', is_new=True)])
+
+    assert queues.build('s1', 'user-1', 'deck-1') == 11
+    window = queues.window('s1', 3)
+    assert [c['id'] for c in window['cards']] == ['c0', 'c1', 'c2']
+    assert (window['user_id'], window['remaining']) == ('user-1', 11)
+
+    queues.record_review('user-1', 'deck-1', 'c0')
+    queues.record_review('user-1', 'deck-1', 'c2')
+    queues.record_review('user-1', 'deck-1', 'unknown')
+    queues.record_review('user-2', 'deck-1', 'c1')
+
+    window = queues.window('s1', 3)
+    assert [c['id'] for c in window['cards']] == ['c1', 'c3', 'c4']
+    assert window['remaining'] == 9
+    assert window['cards'][0] == card('c1')
+    assert client.calls == 1
+
+def test_invalidated_expired_and_excess_sessions_are_forgotten(tmp_path):
+    _, queues = store(tmp_path, [card('c1')], max_sessions=2)
+
+    queues.build('s1', 'user-1', 'deck-1')
+    queues.build('s2', 'user-1', 'deck-2')
+    queues.invalidate('deck-1')
+    assert queues.window('s1', 1) is None
+    assert queues.window('s2', 1) is not None
+
+    for session_id in ('s3', 's4', 's5'):
+        time.sleep(0.01)
+        queues.build(session_id, 'user-1', 'deck-2')
+    assert [queues.window(s, 1) is not None for s in ('s2', 's3', 's4', 's5')] == [False, False, True, True]
+
+    queues.ttl_seconds = 0
+    time.sleep(0.01)
+    assert queues.window('s5', 1) is None
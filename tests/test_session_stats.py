@@ -0,0 +1,82 @@
+import os
+import sys
+import uuid
+import random
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app_auth0'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app_auth0', 'migrations'))
+
+from study.session_stats import summarize_session, session_totals, estimate_percentile, time_bucket, TIME_BUCKET_BOUNDS_MS
+
+def test_summary_of_running_totals():
+    statistics = summarize_session(session_totals([(5, 1200), (2, 3000), (4, 1500), (3, None), (0, 70000)]))
+
+    assert statistics['totalCards'] == 5
+    assert statistics['correctAnswers'] == 3
+    assert statistics['totalTimeMs'] == 75700
+    assert statistics['averageQuality'] == pytest.approx(14 / 5)
+    assert statistics['averageTimeMs'] == pytest.approx(75700 / 4)
+    assert [bucket['count'] for bucket in statistics['timeHistogram']] == [0, 0, 2, 1, 0, 0, 0, 0, 1]
+    assert statistics['timeHistogram'][-1]['upToMs'] is None
+    # Half of the four timed reviews fell below 2s
+    assert statistics['medianTimeMs'] == 2000
+
+def test_empty_session_and_percentile_interpolation():
+    statistics = summarize_session({'cards_studied': 0, 'time_histogram': None})
+    assert (statistics['totalCards'], statistics['averageQuality'], statistics['medianTimeMs']) == (0, 0, None)
+
+    histogram = [0, 4, 0, 0, 0, 0, 0, 0, 0]
+    assert estimate_percentile(histogram, 0.5) == 750
+    assert estimate_percentile([0] * 8 + [3], 0.5) == TIME_BUCKET_BOUNDS_MS[-1]
+
+@pytest.mark.skipif(not os.getenv('TEST_DATABASE_URL'), reason='TEST_DATABASE_URL is not set')
+def test_trigger_keeps_the_totals_of_single_and_batched_inserts():
+    from sqlalchemy import create_engine, text
+    from add_session_statistics import SESSION_STATISTICS_SQL
+
+    schema = f"session_stats_{uuid.uuid4().hex[:8]}"
+    engine = create_engine(os.getenv('TEST_DATABASE_URL'))
+    with engine.connect() as connection:
+        connection.execute(text(f"CREATE SCHEMA {schema}; SET search_path TO {schema}, public;"))
+        try:
+            connection.execute(text("""
+                CREATE TABLE study_sessions (id UUID PRIMARY KEY, ended_at TIMESTAMP WITH TIME ZONE);
+                CREATE TABLE card_reviews (id VARCHAR PRIMARY KEY, session_id VARCHAR NOT NULL, card_id VARCHAR NOT NULL,
+                                           quality INTEGER NOT NULL, time_taken INTEGER);
+            """))
+            sessions = [str(uuid.uuid4()) for _ in range(3)]
+            connection.execute(text("INSERT INTO study_sessions (id) VALUES (:id)"), [{'id': session_id} for session_id in sessions])
+            connection.execute(text(SESSION_STATISTICS_SQL))
+
+            rng = random.Random(5)
+            reviews = {session_id: [] for session_id in sessions}
+            insert = "INSERT INTO card_reviews VALUES (:id, :session_id, :card_id, :quality, :time_taken)"
+
+            def review(session_id):
+                row = {'id': str(uuid.uuid4()), 'session_id': session_id, 'card_id': str(uuid.uuid4()),
+                       'quality': rng.randint(0, 5),
+                       'time_taken': rng.choice([None, 0, 499, 500, 64000, rng.randint(1, 90000)])}
+                reviews[session_id].append((row['quality'], row['time_taken']))
+                return row
+
+            # One statement per review, then whole batches across sessions in one statement
+            for _ in range(40):
+                connection.execute(text(insert), review(rng.choice(sessions)))
+            for _ in range(3):
+                rows = [review(rng.choice(sessions)) for _ in range(50)]
+                values = ', '.join(f"(:id{i}, :session_id{i}, :card_id{i}, :quality{i}, :time_taken{i})" for i in range(len(rows)))
+                connection.execute(text(f"INSERT INTO card_reviews VALUES {values}"),
+                                   {f"{key}{i}": value for i, row in enumerate(rows) for key, value in row.items()})
+            # Not a session id; counted nowhere and doesn't fail the insert
+            connection.execute(text(insert), {'id': 'x', 'session_id': 'offline-1', 'card_id': 'c', 'quality': 4, 'time_taken': 10})
+
+            for session_id in sessions:
+                stored = connection.execute(
+                    text("SELECT cards_studied, correct_answers, quality_sum, total_time_ms, time_histogram "
+                         "FROM study_sessions WHERE id = :id"), {'id': session_id}
+                ).mappings().one()
+                assert dict(stored) == session_totals(reviews[session_id])
+        finally:
+            connection.rollback()
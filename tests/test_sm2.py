@@ -0,0 +1,110 @@
+import os
+import sys
+import math
+import itertools
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app_auth0'))
+
+from study.sm2 import sm2_step, sm2_batch, CLASSIC, STUDY_API, AUTH0
+from study.supermemo2 import SuperMemo2
+
+# The implementations as they were before they delegated to study.sm2,
+# kept verbatim so the shared core can never drift from them
+
+def classic_before(quality, prev_easiness, prev_interval, prev_repetitions):
+    if quality < 3:
+        new_repetitions = 0
+        new_interval = 1
+    else:
+        new_repetitions = prev_repetitions + 1
+        if new_repetitions == 1:
+            new_interval = 1
+        elif new_repetitions == 2:
+            new_interval = 6
+        else:
+            new_interval = round(prev_interval * prev_easiness)
+    new_easiness = prev_easiness + (0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    new_easiness = max(1.3, new_easiness)
+    return new_easiness, new_interval, new_repetitions
+
+def study_api_before(quality, prev_easiness, prev_interval, prev_repetitions):
+    easiness = prev_easiness + (0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    easiness = max(1.3, easiness)
+    if quality < 3:
+        interval = 1
+        repetitions = 0
+    else:
+        if prev_repetitions == 0:
+            interval = 1
+        elif prev_repetitions == 1:
+            interval = 6
+        else:
+            interval = round(prev_interval * easiness)
+        repetitions = prev_repetitions + 1
+    return easiness, interval, repetitions
+
+def auth0_before(quality, easiness, interval, repetitions):
+    if quality < 3:
+        repetitions = 0
+        interval = 1
+    else:
+        easiness = max(1.3, easiness + (0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02)))
+        if repetitions == 0:
+            interval = 1
+        elif repetitions == 1:
+            interval = 6
+        else:
+            interval = math.ceil(interval * easiness)
+        repetitions += 1
+    return easiness, interval, repetitions
+
+VARIANTS = [(CLASSIC, classic_before), (STUDY_API, study_api_before), (AUTH0, auth0_before)]
+
+GRID = list(itertools.product(
+    range(6),
+    [1.3, 1.36, 1.7, 2.0, 2.36, 2.5, 2.6, 3.1],
+    [1, 2, 5, 6, 10, 15, 37, 180],
+    [0, 1, 2, 3, 8]
+))
+
+@pytest.mark.parametrize('variant, before', VARIANTS, ids=lambda value: getattr(value, 'name', ''))
+def test_step_matches_previous_implementation(variant, before):
+    for state in GRID:
+        assert sm2_step(*state, variant) == before(*state)
+
+@pytest.mark.parametrize('variant, before', VARIANTS, ids=lambda value: getattr(value, 'name', ''))
+def test_batch_matches_previous_implementation(variant, before):
+    quality, easiness, interval, repetitions = map(np.array, zip(*GRID))
+    new_easiness, new_interval, new_repetitions = sm2_batch(quality, easiness, interval, repetitions, variant)
+
+    expected = [before(*state) for state in GRID]
+    assert new_easiness.tolist() == [row[0] for row in expected]
+    assert new_interval.tolist() == [row[1] for row in expected]
+    assert new_repetitions.tolist() == [row[2] for row in expected]
+
+def test_known_differences_between_variants():
+    # A failed review only lowers easiness outside app_auth0
+    assert sm2_step(1, 2.5, 10, 4, CLASSIC)[0] == pytest.approx(1.96)
+    assert sm2_step(1, 2.5, 10, 4, AUTH0) == (2.5, 1, 0)
+
+    # 15 * 2.5 = 37.5 rounds half to even, while app_auth0 rounds up
+    assert sm2_step(4, 2.5, 15, 3, CLASSIC)[1] == 38
+    assert sm2_step(4, 2.5, 15, 3, AUTH0)[1] == 38
+    assert sm2_step(5, 2.4, 15, 3, CLASSIC)[1] == 36
+    assert sm2_step(5, 2.4, 15, 3, STUDY_API)[1] == 38
+    assert sm2_step(5, 2.4, 15, 3, AUTH0)[1] == 38
+
+@pytest.mark.parametrize('quality', [[3, -1], [6, 4]])
+def test_batch_rejects_quality_out_of_range(quality):
+    with pytest.raises(ValueError):
+        sm2_batch(quality, [2.5, 2.5], [6, 6], [2, 2])
+
+def test_supermemo2_class_uses_auth0_variant():
+    card = SuperMemo2(easiness=2.5, interval=6, repetitions=2)
+    card.calculate_next_review(4)
+
+    assert (card.easiness, card.interval, card.repetitions) == sm2_step(4, 2.5, 6, 2, AUTH0)
+    assert SuperMemo2.calculate_values(2, 2.5, 6, 2) == (2.5, 1, 0)
@@ -0,0 +1,172 @@
+import os
+import sys
+import types
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app_auth0'))
+
+# Only the entitlement logic is under test; the Stripe and Supabase clients
+# are never called, and the manager below is given a fake client
+if 'stripe' not in sys.modules:
+    sys.modules['stripe'] = types.ModuleType('stripe')
+    sys.modules['stripe'].Customer = object
+if 'supabase' not in sys.modules:
+    sys.modules['supabase'] = types.ModuleType('supabase')
+    sys.modules['supabase'].create_client = lambda url, key: None
+
+from subscription_management import (
+    SubscriptionManager, SubscriptionTier, SubscriptionStatus, FEATURE_BITS, TIER_FEATURE_MASKS,
+    TIER_FEATURES, feature_bit, invalidate_entitlement
+)
+
+class FakeQuery:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.filters = []
+        self.changes = None
+        self.descending = None
+
+    def select(self, columns):
+        return self
+
+    def update(self, changes):
+        self.changes = changes
+        return self
+
+    def eq(self, column, value):
+        self.filters.append((column, value))
+        return self
+
+    def order(self, column, desc=False):
+        self.descending = (column, desc)
+        return self
+
+    def execute(self):
+        rows = [row for row in self.client.tables[self.name]
+                if all(row.get(column) == value for column, value in self.filters)]
+        if self.changes is not None:
+            if self.client.fail_updates:
+                raise RuntimeError('connection lost')
+            for row in rows:
+                row.update(self.changes)
+        else:
+            self.client.selects += 1
+        if self.descending:
+            column, desc = self.descending
+            rows = sorted(rows, key=lambda row: row[column], reverse=desc)
+        return SimpleNamespace(data=[dict(row) for row in rows])
+
+class FakeClient:
+    """A subscriptions table, counting the reads made"""
+
+    def __init__(self, subscriptions):
+        self.tables = {'subscriptions': subscriptions}
+        self.selects = 0
+        self.fail_updates = False
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+def subscription(user_id, tier, status, updated_at, stripe_id=None):
+    return {'id': stripe_id or f'{user_id}-{updated_at}', 'user_id': user_id, 'tier': tier, 'status': status,
+            'updated_at': updated_at, 'stripe_subscription_id': stripe_id or f'{user_id}-{updated_at}'}
+
+def make_manager(subscriptions):
+    for user_id in {row['user_id'] for row in subscriptions} | {'nobody'}:
+        invalidate_entitlement(user_id)
+    manager = SubscriptionManager()
+    manager.supabase = FakeClient(subscriptions)
+    return manager
+
+def test_tier_masks_hold_the_boolean_features_of_each_tier():
+    assert 'max_decks' not in FEATURE_BITS
+    for tier, features in TIER_FEATURES.items():
+        for feature, value in features.items():
+            if isinstance(value, bool):
+                assert bool(TIER_FEATURE_MASKS[tier] & FEATURE_BITS[feature]) is value
+
+    assert feature_bit('can_use_media') == feature_bit('use_media') == feature_bit('media') != 0
+    assert feature_bit('teleportation') == 0
+
+def test_features_follow_the_active_subscription():
+    manager = make_manager([subscription('u1', 'basic', 'active', '2024-01-01')])
+
+    assert manager.get_subscription_tier('u1') == SubscriptionTier.BASIC
+    assert manager.has_feature_access('u1', 'media')
+    assert manager.has_feature_access('u1', 'can_share_decks')
+    assert not manager.has_feature_access('u1', 'ai_features')
+    assert not manager.has_feature_access('u1', 'teleportation')
+    assert manager.has_feature_access('u1') == TIER_FEATURES[SubscriptionTier.BASIC]
+
+def test_active_subscription_wins_over_a_later_inactive_one():
+    manager = make_manager([
+        subscription('u1', 'pro', 'active', '2024-01-01'),
+        subscription('u1', 'basic', 'canceled', '2024-03-01')
+    ])
+
+    entitlement = manager.get_entitlement('u1')
+    assert (entitlement.tier, entitlement.status) == (SubscriptionTier.PRO, SubscriptionStatus.ACTIVE)
+    assert manager.get_subscription('u1')['tier'] == 'pro'
+
+def test_without_an_active_subscription_the_latest_reports_its_status():
+    manager = make_manager([
+        subscription('u1', 'pro', 'canceled', '2024-01-01'),
+        subscription('u1', 'basic', 'past_due', '2024-03-01'),
+        subscription('u2', 'pro', 'incomplete', '2024-01-01')
+    ])
+
+    entitlement = manager.get_entitlement('u1')
+    assert entitlement.tier == SubscriptionTier.FREE
+    assert entitlement.status == SubscriptionStatus.PAST_DUE
+    assert entitlement.subscription['tier'] == 'basic'
+    assert manager.get_subscription('u1') is None
+    # Statuses outside SubscriptionStatus still yield a free entitlement
+    assert manager.get_entitlement('u2').status is None
+    assert manager.get_current_subscription('nobody') is None
+    assert manager.get_subscription_tier('nobody') == SubscriptionTier.FREE
+
+def test_entitlement_is_read_once_until_invalidated():
+    manager = make_manager([subscription('u1', 'basic', 'active', '2024-01-01')])
+
+    manager.get_entitlement('u1')
+    manager.has_feature_access('u1', 'media')
+    manager.get_subscription_tier('u1')
+    assert manager.supabase.selects == 1
+
+    invalidate_entitlement('u1')
+    manager.get_entitlement('u1')
+    assert manager.supabase.selects == 2
+
+def test_subscription_and_invoice_events_invalidate_the_entitlement():
+    manager = make_manager([subscription('u1', 'pro', 'active', '2024-01-01', stripe_id='sub_1')])
+    assert manager.get_subscription_tier('u1') == SubscriptionTier.PRO
+
+    result = manager.handle_webhook({'type': 'invoice.payment_failed', 'data': {'object': {'subscription': 'sub_1'}}})
+    assert result == {'status': 'success'}
+    assert manager.get_entitlement('u1').status == SubscriptionStatus.PAST_DUE
+    assert manager.get_subscription_tier('u1') == SubscriptionTier.FREE
+
+    manager.handle_webhook({'type': 'invoice.payment_succeeded', 'data': {'object': {'subscription': 'sub_1'}}})
+    assert manager.get_subscription_tier('u1') == SubscriptionTier.PRO
+
+    manager.handle_webhook({'type': 'customer.subscription.deleted', 'data': {'object': {'id': 'sub_1'}}})
+    assert manager.get_entitlement('u1').status == SubscriptionStatus.CANCELED
+
+    # Events that aren't handled still drop the entry
+    manager.supabase.tables['subscriptions'][0]['status'] = 'active'
+    manager.handle_webhook({'type': 'customer.subscription.trial_will_end', 'data': {'object': {'id': 'sub_1'}}})
+    assert manager.get_subscription_tier('u1') == SubscriptionTier.PRO
+
+def test_failed_webhook_handler_still_invalidates():
+    manager = make_manager([subscription('u1', 'pro', 'active', '2024-01-01', stripe_id='sub_1')])
+    manager.get_entitlement('u1')
+    reads = manager.supabase.selects
+
+    manager.supabase.fail_updates = True
+    result = manager.handle_webhook({'type': 'customer.subscription.deleted', 'data': {'object': {'id': 'sub_1'}}})
+    assert result['status'] == 'error'
+
+    manager.get_entitlement('u1')
+    # One read to find the subscription's users, one to reload the entitlement
+    assert manager.supabase.selects == reads + 2
@@ -0,0 +1,124 @@
+import os
+import sys
+import json
+import time
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+import jwt
+import pytest
+from jwt.algorithms import RSAAlgorithm
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app_auth0'))
+
+from token_verification import JWKSCache, verify_token
+
+ISSUER = 'https://tenant.example.com/'
+AUDIENCE = 'http://localhost:5002/api'
+
+def make_key(kid):
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    jwk = json.loads(RSAAlgorithm.to_jwk(private_key.public_key()))
+    jwk.update({'kid': kid, 'use': 'sig', 'alg': 'RS256'})
+    return private_key, jwk
+
+def make_token(private_key, kid, audience=AUDIENCE, expires_in=300):
+    claims = {'sub': 'auth0|user-1', 'iss': ISSUER, 'aud': audience, 'exp': int(time.time()) + expires_in}
+    return jwt.encode(claims, private_key, algorithm='RS256', headers={'kid': kid})
+
+class JWKSServer:
+    """Serves a mutable key set on localhost and counts fetches"""
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.fetches = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.fetches += 1
+                body = json.dumps({'keys': server.keys}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.httpd.server_port}/.well-known/jwks.json'
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+
+@pytest.fixture
+def signing_key():
+    return make_key('key-1')
+
+@pytest.fixture
+def jwks_server(signing_key):
+    server = JWKSServer([signing_key[1]])
+    yield server
+    server.close()
+
+def verify(token, cache, audience=AUDIENCE):
+    return verify_token(token, audience=audience, issuer=ISSUER, jwks_cache=cache)
+
+def test_tokens_are_verified_locally_after_first_fetch(signing_key, jwks_server):
+    cache = JWKSCache(jwks_server.url)
+    token = make_token(signing_key[0], 'key-1')
+
+    for _ in range(50):
+        assert verify(token, cache)['sub'] == 'auth0|user-1'
+    assert jwks_server.fetches == 1
+
+def test_rotated_key_is_picked_up_on_unknown_kid(signing_key, jwks_server):
+    cache = JWKSCache(jwks_server.url, min_refresh_seconds=0)
+    verify(make_token(signing_key[0], 'key-1'), cache)
+
+    new_private, new_jwk = make_key('key-2')
+    jwks_server.keys = [signing_key[1], new_jwk]
+
+    assert verify(make_token(new_private, 'key-2'), cache)['sub'] == 'auth0|user-1'
+    assert jwks_server.fetches == 2
+
+def test_unknown_kids_refresh_at_most_once_per_interval(signing_key, jwks_server):
+    cache = JWKSCache(jwks_server.url, min_refresh_seconds=60)
+    verify(make_token(signing_key[0], 'key-1'), cache)
+
+    forged_private, _ = make_key('forged')
+    for _ in range(10):
+        with pytest.raises(jwt.InvalidTokenError):
+            verify(make_token(forged_private, 'forged'), cache)
+    assert jwks_server.fetches == 1
+
+def test_invalid_tokens_are_rejected(signing_key, jwks_server):
+    cache = JWKSCache(jwks_server.url)
+
+    with pytest.raises(jwt.ExpiredSignatureError):
+        verify(make_token(signing_key[0], 'key-1', expires_in=-60), cache)
+    with pytest.raises(jwt.InvalidAudienceError):
+        verify(make_token(signing_key[0], 'key-1', audience='someone-else'), cache)
+
+    # Right kid, wrong private key
+    other_private, _ = make_key('key-1')
+    with pytest.raises(jwt.InvalidSignatureError):
+        verify(make_token(other_private, 'key-1'), cache)
+
+    unsigned = jwt.encode({'sub': 'x', 'iss': ISSUER, 'aud': AUDIENCE, 'exp': int(time.time()) + 60}, 's' * 32, algorithm='HS256', headers={'kid': 'key-1'})
+    with pytest.raises(jwt.InvalidAlgorithmError):
+        verify(unsigned, cache)
+
+def test_prefetch_keeps_keys_warm(signing_key, jwks_server):
+    cache = JWKSCache(jwks_server.url, refresh_seconds=0.05)
+    cache.start_prefetch()
+    try:
+        time.sleep(0.3)
+        # The first request finds the keys already loaded
+        assert jwks_server.fetches >= 2
+        assert cache.get_key('key-1') is not None
+    finally:
+        cache.stop_prefetch()
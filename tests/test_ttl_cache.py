@@ -0,0 +1,91 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app_auth0'))
+
+from ttl_cache import TTLCache, approximate_size
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = TTLCache(60, clock=clock)
+
+    cache.set(('user-1', 'deck-1'), 'owner')
+    clock.now = 59
+    assert cache.get(('user-1', 'deck-1')) == 'owner'
+    clock.now = 60
+    assert cache.get(('user-1', 'deck-1')) is None
+    assert cache.stats() == {'entries': 0, 'bytes': 0, 'hits': 1, 'misses': 1, 'evictions': 0, 'expirations': 1}
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(60, max_entries=2)
+
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+
+    assert cache.get('a') == 1
+    assert cache.get('b') is None
+    assert cache.get('c') == 3
+
+def test_get_or_load_and_invalidate_where():
+    cache = TTLCache(60)
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return 'editor'
+
+    assert cache.get_or_load(('user-1', 'deck-1'), loader) == 'editor'
+    assert cache.get_or_load(('user-1', 'deck-1'), loader) == 'editor'
+    assert len(loads) == 1
+
+    cache.set(('user-2', 'deck-1'), 'viewer')
+    cache.set(('user-2', 'deck-2'), 'viewer')
+    cache.invalidate_where(lambda key: key[1] == 'deck-1')
+    assert len(cache) == 1
+    assert cache.get(('user-2', 'deck-2')) == 'viewer'
+
+def test_expired_entries_are_swept_on_write_without_being_read():
+    clock = FakeClock()
+    cache = TTLCache(60, clock=clock)
+
+    for index in range(100):
+        cache.set(f'token-{index}', index)
+    clock.now = 30
+    cache.set('late', 'x')
+    clock.now = 61
+    cache.set('now', 'y')
+
+    assert len(cache) == 2
+    assert cache.stats()['expirations'] == 100
+    # After an idle spell the occupied slots are visited directly
+    clock.now = 10 ** 6
+    cache.set('much-later', 'z', ttl_seconds=0)
+    clock.now += 1
+    cache.set('again', 'w')
+    assert len(cache) == 1
+
+def test_memory_cap_evicts_least_recently_used_and_keys_are_hashed():
+    profile = {'email': 'someone@example.com', 'name': 'Someone'}
+    cache = TTLCache(60, max_bytes=3 * approximate_size(profile), hash_keys=True)
+
+    for index in range(5):
+        cache.set(f'auth0|{index}', dict(profile))
+    assert len(cache) == 3
+    assert cache.get('auth0|0') is None and cache.get('auth0|4') == profile
+    assert cache.stats()['evictions'] == 2
+    assert cache.stats()['bytes'] <= cache.max_bytes
+    assert not any(isinstance(key, str) for key in cache._entries)
+
+    cache.set('huge', ['x' * 1000] * 100)
+    assert cache.get('huge') is None and len(cache) == 3
+    cache.invalidate('auth0|4')
+    assert cache.get('auth0|4') is None
@@ -0,0 +1,171 @@
+import os
+import sys
+import uuid
+import json
+from types import SimpleNamespace
+from datetime import datetime, timezone
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app_auth0'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app_auth0', 'migrations'))
+
+from usage_metering import UsageMeter, TokenBucketLimiter, period_start
+
+NOW = datetime(2024, 6, 15, 12, 0, tzinfo=timezone.utc)
+
+class FakeUsageTable:
+    """subscription_usage in memory, with the select and rpc calls the meter makes"""
+
+    def __init__(self):
+        self.counts = {}
+        self.selects = 0
+        self.flushes = []
+        self.fail = False
+
+    def table(self, name):
+        assert name == 'subscription_usage'
+        self.filters = {}
+        return self
+
+    def select(self, columns):
+        return self
+
+    def eq(self, column, value):
+        self.filters[column] = value
+        return self
+
+    def rpc(self, name, params):
+        assert name == 'increment_subscription_usage'
+        self.rows = params['p_rows']
+        return SimpleNamespace(execute=self._flush)
+
+    def _flush(self):
+        if self.fail:
+            raise ConnectionError('database unavailable')
+        self.flushes.append(self.rows)
+        totals = []
+        for row in self.rows:
+            key = (row['user_id'], row['feature'], row['period_start'])
+            self.counts[key] = self.counts.get(key, 0) + row['amount']
+            totals.append({'user_id': row['user_id'], 'feature': row['feature'],
+                           'period_start': row['period_start'], 'usage_count': self.counts[key]})
+        return SimpleNamespace(data=totals)
+
+    def execute(self):
+        self.selects += 1
+        key = (self.filters['user_id'], self.filters['feature'], self.filters['period_start'])
+        return SimpleNamespace(data=[{'usage_count': self.counts[key]}] if key in self.counts else [])
+
+def test_increments_are_buffered_and_flushed_in_one_call():
+    client = FakeUsageTable()
+    client.counts[('user-1', 'deck_generation', '2024-06-01')] = 3
+    meter = UsageMeter(client, now=lambda: NOW)
+
+    for _ in range(4):
+        meter.increment('user-1', 'deck_generation')
+    meter.increment('user-2', 'deck_generation', 2)
+
+    assert client.flushes == []
+    assert meter.usage('user-1', 'deck_generation') == 7
+    assert not meter.within_limit('user-1', 'deck_generation', 7)
+    assert meter.within_limit('user-2', 'deck_generation', 3)
+
+    assert meter.flush() == 2
+    assert sorted((row['user_id'], row['amount']) for row in client.flushes[0]) == [('user-1', 4), ('user-2', 2)]
+    selects = client.selects
+    # The flush returned the new totals, so nothing is read again
+    assert meter.usage('user-1', 'deck_generation') == 7
+    assert meter.usage('user-2', 'deck_generation') == 2
+    assert client.selects == selects
+    assert meter.flush() == 0
+
+def test_failed_flush_keeps_the_counts():
+    client = FakeUsageTable()
+    meter = UsageMeter(client, now=lambda: NOW)
+    meter.increment('user-1', 'deck_generation')
+
+    client.fail = True
+    with pytest.raises(ConnectionError):
+        meter.flush()
+    assert meter.usage('user-1', 'deck_generation') == 1
+
+    client.fail = False
+    meter.increment('user-1', 'deck_generation')
+    meter.flush()
+    assert client.counts == {('user-1', 'deck_generation', '2024-06-01'): 2}
+    assert period_start(datetime(2024, 12, 31, 23, 59, tzinfo=timezone.utc)) == '2024-12-01'
+
+def test_reserve_checks_and_counts_in_one_step():
+    client = FakeUsageTable()
+    client.counts[('user-1', 'deck_generation', '2024-06-01')] = 8
+    meter = UsageMeter(client, now=lambda: NOW)
+
+    assert meter.reserve('user-1', 'deck_generation', 10)
+    assert meter.reserve('user-1', 'deck_generation', 10)
+    assert not meter.reserve('user-1', 'deck_generation', 10)
+    assert meter.usage('user-1', 'deck_generation') == 10
+
+    # A refund frees the use again; one that cancels the reservation writes nothing
+    meter.increment('user-1', 'deck_generation', -1)
+    assert meter.reserve('user-1', 'deck_generation', 10)
+    meter.increment('user-1', 'deck_generation', -2)
+    assert meter.flush() == 0
+    assert client.flushes == []
+    assert meter.usage('user-1', 'deck_generation') == 8
+
+def test_token_bucket_allows_a_burst_then_the_refill_rate():
+    now = [0.0]
+    limiter = TokenBucketLimiter(rate_per_minute=6, burst=3, clock=lambda: now[0])
+
+    assert [limiter.acquire('user-1') for _ in range(3)] == [0, 0, 0]
+    assert limiter.acquire('user-1') == pytest.approx(10)
+    assert limiter.acquire('user-2') == 0
+    now[0] = 10
+    assert limiter.acquire('user-1') == 0
+    assert limiter.acquire('user-1') > 0
+    # Idle long enough to refill completely
+    now[0] = 1000
+    assert [limiter.acquire('user-1') for _ in range(3)] == [0, 0, 0]
+
+@pytest.mark.skipif(not os.getenv('TEST_DATABASE_URL'), reason='TEST_DATABASE_URL is not set')
+def test_increment_rpc_upserts_per_month_and_returns_totals():
+    from sqlalchemy import create_engine, text
+    from add_usage_metering import USAGE_METERING_SQL
+
+    schema = f"usage_metering_{uuid.uuid4().hex[:8]}"
+    engine = create_engine(os.getenv('TEST_DATABASE_URL'))
+    with engine.connect() as connection:
+        connection.execute(text(f"CREATE SCHEMA {schema}; SET search_path TO {schema}, public;"))
+        try:
+            # As created by table_creation/subscriptions, before this migration
+            connection.execute(text("""
+                CREATE TABLE subscription_usage (
+                    id UUID PRIMARY KEY, user_id VARCHAR(36), feature VARCHAR(50) NOT NULL,
+                    usage_count INTEGER DEFAULT 0, last_used_at TIMESTAMP WITH TIME ZONE,
+                    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(), updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+                    UNIQUE(user_id, feature)
+                );
+            """))
+            connection.execute(text(USAGE_METERING_SQL))
+
+            user_1, user_2 = str(uuid.uuid4()), str(uuid.uuid4())
+
+            def increment(rows):
+                totals = connection.execute(text("SELECT increment_subscription_usage(CAST(:rows AS JSONB))"),
+                                            {'rows': json.dumps(rows)}).scalar()
+                return {(row['user_id'], row['period_start']): row['usage_count'] for row in totals}
+
+            assert increment([
+                {'user_id': user_1, 'feature': 'deck_generation', 'period_start': '2024-06-01', 'amount': 2},
+                {'user_id': user_1, 'feature': 'deck_generation', 'period_start': '2024-06-01', 'amount': 1},
+                {'user_id': user_2, 'feature': 'deck_generation', 'period_start': '2024-06-01', 'amount': 1}
+            ]) == {(user_1, '2024-06-01'): 3, (user_2, '2024-06-01'): 1}
+            assert increment([
+                {'user_id': user_1, 'feature': 'deck_generation', 'period_start': '2024-06-01', 'amount': 4},
+                {'user_id': user_1, 'feature': 'deck_generation', 'period_start': '2024-07-01', 'amount': 1}
+            ]) == {(user_1, '2024-06-01'): 7, (user_1, '2024-07-01'): 1}
+            assert increment([]) == {}
+            assert connection.execute(text("SELECT COUNT(*) FROM subscription_usage")).scalar() == 3
+        finally:
+            connection.rollback()